@@ -1,17 +1,28 @@
+import hashlib
+import hmac
 import os
-import json
 import random
 import string
 from functools import wraps
-from datetime import datetime
-
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from datetime import date, datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
 
 from flask import (
-    Flask, render_template, request, redirect, url_for,
-    session, flash, abort
+    Flask, Response, render_template, request, redirect, url_for,
+    session, flash, abort, stream_with_context, make_response
 )
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+import db
+import exportar
+import lentas
+import metricas
+import migrations
+import queries
+import relatorios
+from cache import LRUCache, TTLCache
+from db import get_db
+from ratelimit import TokenBucket
 
 app = Flask(__name__)
 app.secret_key = os.environ.get("SECRET_KEY", "troque-essa-chave-por-algo-seu-123")
@@ -19,113 +30,68 @@ app.secret_key = os.environ.get("SECRET_KEY", "troque-essa-chave-por-algo-seu-12
 # =========================
 # CONFIG
 # =========================
-DATABASE_URL = (os.environ.get("DATABASE_URL") or "").strip()
 SITE_CONSULTA = os.environ.get("SITE_CONSULTA", "https://sistema-lck.onrender.com/").strip()
 
+# proxies confiáveis na frente do app (Render = 1); sem isso remote_addr é o
+# IP do proxy e o limite da consulta pública valeria para todo mundo junto
+PROXY_HOPS = int(os.environ.get("PROXY_HOPS", "1"))
+if PROXY_HOPS > 0:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_HOPS)
+
+# entra no ETag das telas da OS: template novo no deploy não pode dar 304
+# com o HTML da versão anterior (o Render preenche RENDER_GIT_COMMIT)
+VERSAO_APP = (os.environ.get("RENDER_GIT_COMMIT") or os.environ.get("APP_VERSAO") or "").strip()[:12]
+
+# consulta pública: resultado em cache por OS e limite de tentativas erradas por IP
+consulta_cache = TTLCache(
+    maxsize=int(os.environ.get("CONSULTA_CACHE_MAX", "2000")),
+    ttl=float(os.environ.get("CONSULTA_CACHE_TTL", "60")),
+)
+consulta_limite = TokenBucket(
+    capacidade=int(os.environ.get("CONSULTA_FALHAS_MAX", "10")),
+    janela=float(os.environ.get("CONSULTA_FALHAS_JANELA", "600")),
+)
+# OS que o cliente já abriu com o código certo, guardadas na sessão (as mais recentes)
+CONSULTAS_SESSAO = 10
+
+# mudanças de status que avisam o cliente (fila em notificacoes, enviada pelo
+# notificador.py); separados por vírgula
+NOTIFICAR_STATUS = tuple(
+    s.strip() for s in os.environ.get("NOTIFICAR_STATUS", "fechada,aguardando aprovação").split(",") if s.strip()
+)
+
+# /metrics para o Prometheus: admin logado ou "Authorization: Bearer <token>"
+METRICAS_TOKEN = os.environ.get("METRICAS_TOKEN", "").strip()
+
+# impressão em lote: máximo de OS num documento
+LOTE_IMPRESSAO_MAX = int(os.environ.get("LOTE_IMPRESSAO_MAX", "200"))
+
+# HTML já renderizado: impressões por OS + versão, formulários fixos por mtime
+# do template (ver html_cacheado); limite em MB por worker
+paginas_cache = LRUCache(
+    max_bytes=int(float(os.environ.get("PAGINAS_CACHE_MB", "16")) * 1024 * 1024),
+    tamanho=lambda html: len(html.encode("utf-8")),
+)
+
 # =========================
 # DB (Postgres / Neon)
 # =========================
-def get_db():
-    if not DATABASE_URL:
-        raise RuntimeError("DATABASE_URL não configurada no Render.")
-    return psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
-
-def now_str():
-    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-def ensure_tables():
-    conn = get_db()
-    cur = conn.cursor()
+# pool por processo; get_db() devolve a conexão do request (ver db.py)
+db.init_app(app)
+# comandos acima de DB_LENTA_MS vão para consultas_lentas (ver lentas.py)
+lentas.init_app(app)
 
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS usuarios (
-        id SERIAL PRIMARY KEY,
-        usuario TEXT UNIQUE NOT NULL,
-        senha TEXT NOT NULL,
-        role TEXT DEFAULT 'user'
-    );
-    """)
-
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS os (
-        id SERIAL PRIMARY KEY,
-        data_entrada TEXT,
-        status TEXT DEFAULT 'aberta',
-
-        cliente_nome TEXT,
-        cliente_fone TEXT,
-        cliente_cpf TEXT,
-        cliente_endereco TEXT,
-        cliente_email TEXT,
-
-        tipo TEXT,
-        equipamento TEXT,
-
-        checklist_json TEXT,
-        relato_cliente TEXT,
-        diagnostico_tecnico TEXT,
-
-        valor_orcado NUMERIC DEFAULT 0,
-        valor_pago NUMERIC DEFAULT 0,
-        data_pagamento TEXT,
-
-        codigo_consulta TEXT
-    );
-    """)
-
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS os_historico (
-        id SERIAL PRIMARY KEY,
-        os_id INTEGER NOT NULL,
-        data TEXT,
-        acao TEXT,
-        obs TEXT,
-        visivel_cliente INTEGER DEFAULT 1,
-
-        valor_orcado NUMERIC DEFAULT NULL,
-        valor_pago NUMERIC DEFAULT NULL,
-        data_pagamento TEXT DEFAULT NULL
-    );
-    """)
-
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS devedores (
-        id SERIAL PRIMARY KEY,
-        criado_em TEXT,
-        cliente_nome TEXT,
-        cliente_fone TEXT,
-        referencia TEXT,
-        valor NUMERIC DEFAULT 0,
-        obs TEXT,
-        status TEXT DEFAULT 'em aberto',
-        pago_em TEXT
-    );
-    """)
-
-    def upsert_user(usuario, senha, role):
-        cur.execute("""
-            INSERT INTO usuarios (usuario, senha, role)
-            VALUES (%s, %s, %s)
-            ON CONFLICT (usuario)
-            DO UPDATE SET senha = EXCLUDED.senha, role = EXCLUDED.role;
-        """, (usuario, senha, role))
-
-    # usuários fixos
-    upsert_user("Lucas", "0904", "admin")
-    upsert_user("Carol", "2858", "admin")
-    upsert_user("Natan", "0000", "user")
-    upsert_user("Tiago", "1234", "user")
+# datas vão pro banco como timestamptz (com fuso) e aparecem nas telas no APP_TZ
+TZ = ZoneInfo(db.APP_TZ)
 
-    conn.commit()
-    conn.close()
+def agora():
+    return datetime.now(timezone.utc).replace(microsecond=0)
 
-@app.before_request
-def startup():
-    # roda 1x por instância
-    if not getattr(app, "_db_ready", False):
-        ensure_tables()
-        app._db_ready = True
-        print("✅ DB Postgres/Neon pronto.")
+# schema: migrações numeradas em migrations.py, aplicadas no boot do processo
+# (ou no deploy com `python migrations.py` + MIGRATE_ON_BOOT=0). Nenhum
+# request faz DDL.
+if os.environ.get("MIGRATE_ON_BOOT", "1") == "1" and db.DATABASE_URL:
+    migrations.migrate()
 
 # =========================
 # Helpers / Permissões
@@ -154,13 +120,118 @@ def parse_money(v):
     except Exception:
         return 0.0
 
-def gen_codigo_consulta(conn) -> str:
-    cur = conn.cursor()
-    while True:
-        code = "".join(random.choices(string.ascii_uppercase + string.digits, k=6))
-        cur.execute("SELECT 1 FROM os WHERE codigo_consulta = %s", (code,))
-        if not cur.fetchone():
-            return code
+def parse_data(v):
+    """Data digitada no form (15/02/2026, 15/02/26, 2026-02-15) -> date, ou None."""
+    v = (v or "").strip().replace(".", "/").replace("-", "/")
+    for fmt in ("%d/%m/%Y", "%d/%m/%y", "%Y/%m/%d"):
+        try:
+            return datetime.strptime(v, fmt).date()
+        except ValueError:
+            pass
+    return None
+
+def parse_ids(v, limite):
+    """"12, 15 20-30" -> [12, 15, 20, ..., 30] (sem repetir, na ordem digitada).
+
+    Para no `limite` de ids; o que não é número nem faixa é ignorado.
+    """
+    ids, vistos = [], set()
+    for parte in (v or "").replace(",", " ").replace(";", " ").split():
+        a, _, b = parte.partition("-")
+        if not a.isdigit() or (b and not b.isdigit()):
+            continue
+        ini, fim = sorted((int(a), int(b or a)))
+        for i in range(ini, fim + 1):
+            if i not in vistos:
+                vistos.add(i)
+                ids.append(i)
+                if len(ids) >= limite:
+                    return ids
+    return ids
+
+def parse_periodo(de, ate):
+    """Converte o filtro de datas (AAAA-MM-DD) em limites [de, ate) no fuso
+    do APP_TZ, para comparar com as colunas timestamptz. Data inválida é
+    ignorada."""
+    def dia(v):
+        try:
+            return datetime.strptime((v or "").strip(), "%Y-%m-%d").replace(tzinfo=TZ)
+        except ValueError:
+            return None
+
+    d, a = dia(de), dia(ate)
+    return d, (a + timedelta(days=1) if a else None)
+
+def invalidar_os(os_id):
+    """Chamado pelas rotas que alteram uma OS, depois do commit."""
+    consulta_cache.pop(os_id)
+    # a versão nova já não bate com as chaves antigas; aqui só libera memória
+    paginas_cache.descartar(lambda k: k[0] == "os" and k[1] == os_id)
+
+def _mtime_templates(*nomes):
+    pasta = os.path.join(app.root_path, app.template_folder)
+    return max(os.path.getmtime(os.path.join(pasta, n)) for n in nomes + ("base.html",))
+
+def chave_os(versao, template, *parciais):
+    """Chave do HTML de uma tela de OS: muda a cada escrita na OS."""
+    return ("os", versao["id"], template, versao["versao"], _mtime_templates(template, *parciais))
+
+def chave_estatica(template):
+    """Chave de uma página que só depende do template (e de quem está logado)."""
+    return ("estatico", template, session.get("usuario"), _mtime_templates(template))
+
+def html_cacheado(chave):
+    """(HTML guardado sob `chave` ou None, chave para o guardar_html).
+
+    Com flash pendente não usa nem guarda: a mensagem é renderizada no
+    base.html (e consumida no render), então só vale para esta página.
+    """
+    if session.get("_flashes"):
+        return None, None
+    return paginas_cache.get(chave), chave
+
+def guardar_html(chave, html):
+    if chave is not None:
+        paginas_cache.set(chave, html)
+    return html
+
+def render_estatico(template):
+    html, chave = html_cacheado(chave_estatica(template))
+    if html is None:
+        html = guardar_html(chave, render_template(template))
+    return html
+
+def _cabecalhos_os(resp, versao, pagina):
+    """ETag/Last-Modified da tela `pagina` de uma OS na `versao` atual.
+
+    O ETag leva o papel do usuário (admin vê botões a mais) e o
+    navegador revalida sempre (no-cache), só não baixa de novo o que não mudou.
+    """
+    chave = f"{VERSAO_APP}:{pagina}:{versao['id']}:{versao['versao']}:{session.get('role') or ''}"
+    resp.set_etag(hashlib.sha1(chave.encode("utf-8")).hexdigest()[:20])
+    resp.last_modified = versao["atualizado_em"]
+    resp.headers["Cache-Control"] = "private, no-cache"
+    return resp
+
+def os_condicional(cur, os_id, pagina):
+    """Confere If-None-Match/If-Modified-Since contra a versão da OS.
+
+    Devolve (versão, resposta 304 ou None). Uma consulta só, na linha da OS;
+    versão None = OS não existe (a rota segue e dá 404). Com flash pendente
+    a página é renderizada de novo, senão a mensagem sumiria num 304.
+    """
+    versao = queries.os_versao(cur, os_id)
+    if versao is None or session.get("_flashes"):
+        return versao, None
+    resp = _cabecalhos_os(Response(), versao, pagina).make_conditional(request)
+    return versao, (resp if resp.status_code == 304 else None)
+
+def renderizar_os(versao, pagina, template, **ctx):
+    return _cabecalhos_os(make_response(render_template(template, **ctx)), versao, pagina)
+
+def gen_codigo_consulta() -> str:
+    # unicidade fica por conta do índice único em os.codigo_consulta (ver os_nova_post)
+    return "".join(random.choices(string.ascii_uppercase + string.digits, k=6))
 
 STATUS_LABEL = {
     "aberta": "Aberta",
@@ -170,6 +241,7 @@ STATUS_LABEL = {
     "fechada": "Finalizado",
     "sem conserto": "Sem conserto",
 }
+STATUS_ABERTOS = ("aberta", "aguardando orçamento", "aguardando aprovação", "em execução")
 STATUS_CLASS = {
     "aberta": "st-aberta",
     "aguardando orçamento": "st-orc",
@@ -239,6 +311,28 @@ CHECKLIST_LABELS = {
     "ck_outro_detalhes": "Detalhes / observações",
 }
 
+
+def checklist_em_ordem(checklist) -> dict:
+    """Checklist vindo do banco (jsonb já chega como dict) na ordem do formulário.
+
+    O jsonb não guarda a ordem das chaves; a tela e a impressão seguem a ordem
+    do CHECKLIST_LABELS, com chaves desconhecidas no fim.
+    """
+    checklist = checklist or {}
+    ordem = [k for k in CHECKLIST_LABELS if k in checklist]
+    ordem += [k for k in checklist if k not in CHECKLIST_LABELS]
+    return {k: checklist[k] for k in ordem}
+
+@app.template_filter("data")
+def fmt_data(v):
+    """timestamptz no fuso do APP_TZ (como o now_str() antigo gravava); date
+    como DD/MM/AAAA, do jeito que é digitado."""
+    if isinstance(v, datetime):
+        return v.astimezone(TZ).strftime("%Y-%m-%d %H:%M:%S")
+    if isinstance(v, date):
+        return v.strftime("%d/%m/%Y")
+    return v or ""
+
 @app.context_processor
 def inject_helpers():
     def pad_os(n: int) -> str:
@@ -260,7 +354,7 @@ def inject_helpers():
 # =========================
 @app.get("/")
 def index():
-    return render_template("index.html")
+    return render_estatico("index.html")
 
 @app.get("/inicio")
 def inicio():
@@ -268,7 +362,7 @@ def inicio():
 
 @app.get("/consultar")
 def consultar():
-    return render_template("consultar.html")
+    return render_estatico("consultar.html")
 
 @app.post("/consultar")
 def consultar_post():
@@ -277,31 +371,59 @@ def consultar_post():
 
     if not os_id_raw.isdigit():
         return render_template("consultar.html", erro="Informe o número da OS (apenas números).")
-
     os_id = int(os_id_raw)
 
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM os WHERE id = %s", (os_id,))
-    row = cur.fetchone()
+    # quem errou demais fica de fora antes de qualquer consulta ao banco
+    ip = request.remote_addr or "?"
+    if not consulta_limite.disponivel(ip):
+        return render_template(
+            "consultar.html", erro="Muitas tentativas sem sucesso. Aguarde alguns minutos e tente de novo."
+        ), 429
 
-    if not row:
-        conn.close()
+    versao = queries.os_versao(get_db().cursor(), os_id)
+    if not versao:
+        consulta_limite.consumir(ip)
         return render_template("consultar.html", erro="OS não encontrada.")
 
-    if str(row.get("codigo_consulta") or "").upper() != str(codigo).upper():
-        conn.close()
+    if str(versao["codigo_consulta"] or "").upper() != codigo:
+        consulta_limite.consumir(ip)
         return render_template("consultar.html", erro="Código inválido.")
 
-    cur.execute("""
-        SELECT * FROM os_historico
-        WHERE os_id = %s AND visivel_cliente = 1
-        ORDER BY id DESC
-    """, (os_id,))
-    hist = cur.fetchall()
+    # o código fica na sessão (cookie assinado), nunca na URL: não vai para
+    # log de acesso, histórico do navegador nem Referer. O resultado é um
+    # GET: atualizar a página não reenvia o form e o navegador pode
+    # revalidar com If-None-Match (304 se a OS não mudou)
+    liberadas = [i for i in session.get("consultas", []) if i != os_id]
+    session["consultas"] = (liberadas + [os_id])[-CONSULTAS_SESSAO:]
+    return redirect(url_for("consultar_os", os_id=os_id))
+
+@app.get("/consultar/<int:os_id>")
+def consultar_os(os_id):
+    # só abre a OS cujo código já foi conferido no POST (consultar_post)
+    if os_id not in session.get("consultas", []):
+        return redirect(url_for("consultar"))
+
+    cur = get_db().cursor()
+    versao, nao_mudou = os_condicional(cur, os_id, "consultar")
+    if nao_mudou:
+        return nao_mudou
+
+    if not versao:
+        return render_template("consultar.html", erro="OS não encontrada.")
+
+    # cache por OS e versão: o que outro worker alterou (versão nova) nunca
+    # sai com o conteúdo antigo, nem com o ETag novo
+    cached = consulta_cache.get(os_id)
+    if cached and cached[0] == versao["versao"]:
+        _, row, hist = cached
+    else:
+        row = queries.os_cliente(cur, os_id)
+        if not row:
+            return render_template("consultar.html", erro="OS não encontrada.")
+        hist = queries.historico_cliente(cur, os_id)
+        consulta_cache.set(os_id, (versao["versao"], row, hist))
 
-    conn.close()
-    return render_template("consultar.html", resultado=row, historico=hist)
+    return renderizar_os(versao, "consultar", "consultar.html", resultado=row, historico=hist)
 
 # =========================
 # Auth
@@ -317,9 +439,7 @@ def login_post():
 
     conn = get_db()
     cur = conn.cursor()
-    cur.execute("SELECT * FROM usuarios WHERE usuario = %s", (usuario,))
-    u = cur.fetchone()
-    conn.close()
+    u = queries.usuario_por_nome(cur, usuario)
 
     if not u or str(u["senha"]) != str(senha):
         flash("Usuário ou senha inválidos.", "err")
@@ -343,30 +463,44 @@ def logout():
 def painel():
     conn = get_db()
     cur = conn.cursor()
-    cur.execute("""
-        SELECT id, data_entrada, status, cliente_nome, cliente_fone, tipo, equipamento, codigo_consulta
-        FROM os
-        WHERE status IN ('aberta','aguardando orçamento','aguardando aprovação','em execução')
-        ORDER BY id DESC
-        LIMIT 80
-    """)
-    abertas = cur.fetchall()
-    conn.close()
-    return render_template("painel.html", abertas=abertas)
+    abertas = queries.os_abertas(cur)
+
+    resumo = {r["status"]: r for r in queries.os_resumo(cur)}
+    em_aberto = [resumo[s] for s in STATUS_ABERTOS if s in resumo]
+    totais = {
+        "abertas": sum(r["qtd"] for r in em_aberto),
+        # orçado e ainda não pago, só das OS em andamento
+        "a_receber": sum(r["valor_orcado"] - r["valor_pago"] for r in em_aberto),
+    }
+    return render_template("painel.html", abertas=abertas, resumo=resumo, totais=totais)
+
+@app.get("/os/buscar")
+@login_required
+def os_buscar():
+    q = (request.args.get("q") or "").strip()
+    conn = get_db()
+    cur = conn.cursor()
+    rows = queries.os_buscar(cur, q) if q else []
+    return render_template("os_buscar.html", rows=rows, q=q)
 
 @app.get("/os/finalizadas")
 @login_required
 def os_finalizadas():
+    status = (request.args.get("status") or "").strip()
+    if status not in ("fechada", "sem conserto"):
+        status = ""
+    de, ate = parse_periodo(request.args.get("de"), request.args.get("ate"))
+
     conn = get_db()
     cur = conn.cursor()
-    cur.execute("""
-        SELECT * FROM os
-        WHERE status IN ('fechada','sem conserto')
-        ORDER BY id DESC
-    """)
-    rows = cur.fetchall()
-    conn.close()
-    return render_template("os_listar.html", rows=rows, grupo="finalizadas")
+    pagina = queries.os_finalizadas_pagina(
+        cur, status, de, ate, request.args.get("antes"), request.args.get("depois")
+    )
+
+    return render_template(
+        "os_listar.html", rows=pagina["rows"], pagina=pagina, grupo="finalizadas",
+        filtro={"status": status, "de": request.args.get("de") or "", "ate": request.args.get("ate") or ""},
+    )
 
 # =========================
 # Devedores
@@ -374,15 +508,27 @@ def os_finalizadas():
 @app.get("/devedores")
 @login_required
 def devedores():
+    status = (request.args.get("status") or "").strip()
+    if status not in ("em aberto", "pago"):
+        status = ""
+    de, ate = parse_periodo(request.args.get("de"), request.args.get("ate"))
+
     conn = get_db()
     cur = conn.cursor()
-    cur.execute("""
-        SELECT * FROM devedores
-        ORDER BY CASE WHEN status='em aberto' THEN 0 ELSE 1 END, id DESC
-    """)
-    rows = cur.fetchall()
-    conn.close()
-    return render_template("devedores.html", rows=rows)
+    pagina = queries.devedores_pagina(
+        cur, status, de, ate, request.args.get("antes"), request.args.get("depois")
+    )
+
+    # faixas de aging: até 30 dias, 31 a 60, mais de 60 (contando por dia)
+    hoje = datetime.now(TZ).replace(hour=0, minute=0, second=0, microsecond=0)
+    resumo = queries.devedores_resumo(
+        cur, hoje - timedelta(days=30), hoje - timedelta(days=60), status, de, ate,
+    )
+
+    return render_template(
+        "devedores.html", rows=pagina["rows"], pagina=pagina, resumo=resumo,
+        filtro={"status": status, "de": request.args.get("de") or "", "ate": request.args.get("ate") or ""},
+    )
 
 @app.get("/devedores/novo")
 @login_required
@@ -404,12 +550,8 @@ def devedores_novo_post():
 
     conn = get_db()
     cur = conn.cursor()
-    cur.execute("""
-        INSERT INTO devedores (criado_em, cliente_nome, cliente_fone, referencia, valor, obs, status, pago_em)
-        VALUES (%s, %s, %s, %s, %s, %s, 'em aberto', NULL)
-    """, (now_str(), cliente_nome, cliente_fone, referencia, valor, obs))
+    queries.devedor_inserir(cur, agora(), cliente_nome, cliente_fone, referencia, valor, obs)
     conn.commit()
-    conn.close()
 
     flash("Devedor cadastrado.", "ok")
     return redirect(url_for("devedores"))
@@ -419,9 +561,8 @@ def devedores_novo_post():
 def devedor_marcar_pago(dev_id):
     conn = get_db()
     cur = conn.cursor()
-    cur.execute("UPDATE devedores SET status='pago', pago_em=%s WHERE id=%s", (now_str(), dev_id))
+    queries.devedor_pagar(cur, dev_id, agora())
     conn.commit()
-    conn.close()
     flash("Marcado como pago.", "ok")
     return redirect(url_for("devedores"))
 
@@ -430,9 +571,8 @@ def devedor_marcar_pago(dev_id):
 def devedor_reabrir(dev_id):
     conn = get_db()
     cur = conn.cursor()
-    cur.execute("UPDATE devedores SET status='em aberto', pago_em=NULL WHERE id=%s", (dev_id,))
+    queries.devedor_reabrir(cur, dev_id)
     conn.commit()
-    conn.close()
     flash("Devedor reaberto.", "ok")
     return redirect(url_for("devedores"))
 
@@ -442,9 +582,8 @@ def devedor_reabrir(dev_id):
 def devedor_excluir(dev_id):
     conn = get_db()
     cur = conn.cursor()
-    cur.execute("DELETE FROM devedores WHERE id=%s", (dev_id,))
+    queries.devedor_excluir(cur, dev_id)
     conn.commit()
-    conn.close()
     flash("Devedor excluído.", "ok")
     return redirect(url_for("devedores"))
 
@@ -454,9 +593,7 @@ def devedor_excluir(dev_id):
 def os_devedor_form(os_id):
     conn = get_db()
     cur = conn.cursor()
-    cur.execute("SELECT * FROM os WHERE id=%s", (os_id,))
-    o = cur.fetchone()
-    conn.close()
+    o = queries.os_para_devedor(cur, os_id)
 
     if not o:
         abort(404)
@@ -492,19 +629,13 @@ def os_devedor_post(os_id):
     conn = get_db()
     cur = conn.cursor()
 
-    cur.execute("""
-        INSERT INTO devedores (criado_em, cliente_nome, cliente_fone, referencia, valor, obs, status, pago_em)
-        VALUES (%s, %s, %s, %s, %s, %s, 'em aberto', NULL)
-    """, (now_str(), cliente_nome, cliente_fone, referencia, valor, obs))
+    queries.devedor_inserir(cur, agora(), cliente_nome, cliente_fone, referencia, valor, obs)
 
-    cur.execute("""
-        INSERT INTO os_historico (os_id, data, acao, obs, visivel_cliente)
-        VALUES (%s, %s, %s, %s, 0)
-    """, (os_id, now_str(), "Devedor registrado",
-          f"Devedor criado: {cliente_nome} • R$ {valor:.2f} • {referencia}"))
+    queries.historico_inserir(cur, os_id, agora(), "Devedor registrado",
+                              f"Devedor criado: {cliente_nome} • R$ {valor:.2f} • {referencia}", 0)
 
     conn.commit()
-    conn.close()
+    invalidar_os(os_id)
 
     flash("Devedor adicionado a partir da OS.", "ok")
     return redirect(url_for("os_detalhe", os_id=os_id))
@@ -515,12 +646,12 @@ def os_devedor_post(os_id):
 @app.get("/os/nova")
 @login_required
 def os_nova():
-    return render_template("nova_os.html")
+    return render_estatico("nova_os.html")
 
 @app.post("/os/nova")
 @login_required
 def os_nova_post():
-    data_entrada = now_str()
+    data_entrada = agora()
 
     cliente_nome = request.form.get("cliente_nome", "").strip()
     cliente_fone = request.form.get("cliente_fone", "").strip()
@@ -536,7 +667,9 @@ def os_nova_post():
 
     valor_orcado = parse_money(request.form.get("valor_orcado"))
     valor_pago = parse_money(request.form.get("valor_pago"))
-    data_pagamento = request.form.get("data_pagamento", "").strip()
+    data_pagamento = parse_data(request.form.get("data_pagamento"))
+    if request.form.get("data_pagamento", "").strip() and not data_pagamento:
+        flash("Data de pagamento inválida (use DD/MM/AAAA); a OS foi criada sem ela.", "err")
 
     checklist = {}
     for k, v in request.form.items():
@@ -546,50 +679,31 @@ def os_nova_post():
     conn = get_db()
     cur = conn.cursor()
 
-    codigo = gen_codigo_consulta(conn)
-
-    cur.execute("""
-        INSERT INTO os (
-            data_entrada, status,
-            cliente_nome, cliente_fone, cliente_cpf, cliente_endereco, cliente_email,
-            tipo, equipamento,
-            checklist_json, relato_cliente, diagnostico_tecnico,
-            valor_orcado, valor_pago, data_pagamento,
-            codigo_consulta
-        )
-        VALUES (
-            %s, 'aberta',
-            %s, %s, %s, %s, %s,
-            %s, %s,
-            %s, %s, %s,
-            %s, %s, %s,
-            %s
-        )
-        RETURNING id
-    """, (
-        data_entrada,
-        cliente_nome, cliente_fone, cliente_cpf, cliente_endereco, cliente_email,
-        tipo, equipamento,
-        json.dumps(checklist, ensure_ascii=False),
-        relato_cliente, diagnostico_tecnico,
-        valor_orcado, valor_pago, data_pagamento,
-        codigo
-    ))
-
-    os_id = cur.fetchone()["id"]
-
-    cur.execute("""
-        INSERT INTO os_historico (os_id, data, acao, obs, visivel_cliente, valor_orcado, valor_pago, data_pagamento)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-    """, (
-        os_id, now_str(), "OS criada", "Entrada registrada no sistema.", 1,
-        (valor_orcado if request.form.get("valor_orcado") else None),
-        (valor_pago if request.form.get("valor_pago") else None),
-        (data_pagamento if request.form.get("data_pagamento") else None)
-    ))
+    dados = {
+        "data_entrada": data_entrada,
+        "cliente_nome": cliente_nome, "cliente_fone": cliente_fone, "cliente_cpf": cliente_cpf,
+        "cliente_endereco": cliente_endereco, "cliente_email": cliente_email,
+        "tipo": tipo, "equipamento": equipamento,
+        "checklist_json": checklist,
+        "relato_cliente": relato_cliente, "diagnostico_tecnico": diagnostico_tecnico,
+        "valor_orcado": valor_orcado, "valor_pago": valor_pago, "data_pagamento": data_pagamento,
+        # snapshot do histórico "OS criada": só o que foi informado no form
+        "hist_valor_orcado": (valor_orcado if request.form.get("valor_orcado") else None),
+        "hist_valor_pago": (valor_pago if request.form.get("valor_pago") else None),
+        "hist_data_pagamento": data_pagamento,
+    }
+
+    # OS + histórico num comando só; colisão de código (rara) só repete o INSERT
+    os_id = None
+    for _ in range(10):
+        dados["codigo_consulta"] = gen_codigo_consulta()
+        os_id = queries.os_criar(cur, dados)
+        if os_id:
+            break
+    if not os_id:
+        raise RuntimeError("Não foi possível gerar um código de consulta único.")
 
     conn.commit()
-    conn.close()
 
     return redirect(url_for("os_detalhe", os_id=os_id))
 
@@ -602,28 +716,19 @@ def os_detalhe(os_id):
     conn = get_db()
     cur = conn.cursor()
 
-    cur.execute("SELECT * FROM os WHERE id = %s", (os_id,))
-    os_row = cur.fetchone()
+    versao, nao_mudou = os_condicional(cur, os_id, "detalhe")
+    if nao_mudou:
+        return nao_mudou
+
+    os_row = queries.os_detalhe(cur, os_id)
     if not os_row:
-        conn.close()
         abort(404)
 
-    cur.execute("""
-        SELECT * FROM os_historico
-        WHERE os_id = %s
-        ORDER BY id DESC
-    """, (os_id,))
-    hist = cur.fetchall()
+    hist = queries.historico(cur, os_id)
 
-    conn.close()
-
-    checklist = {}
-    try:
-        checklist = json.loads(os_row.get("checklist_json") or "{}")
-    except Exception:
-        checklist = {}
+    checklist = checklist_em_ordem(os_row["checklist_json"])
 
-    return render_template("os_detalhe.html", os_row=os_row, historico=hist, checklist=checklist)
+    return renderizar_os(versao, "detalhe", "os_detalhe.html", os_row=os_row, historico=hist, checklist=checklist)
 
 @app.post("/os/<int:os_id>/historico")
 @login_required
@@ -635,7 +740,10 @@ def os_add_historico(os_id):
     novo_status = (request.form.get("novo_status") or "").strip().lower()
     valor_orcado = parse_money(request.form.get("valor_orcado"))
     valor_pago = parse_money(request.form.get("valor_pago"))
-    data_pagamento = (request.form.get("data_pagamento") or "").strip()
+    data_pagamento = parse_data(request.form.get("data_pagamento"))
+    if (request.form.get("data_pagamento") or "").strip() and not data_pagamento:
+        flash("Data de pagamento inválida (use DD/MM/AAAA).", "err")
+        return redirect(url_for("os_detalhe", os_id=os_id))
 
     allowed_status = set(STATUS_LABEL.keys())
     if novo_status and novo_status not in allowed_status:
@@ -644,49 +752,21 @@ def os_add_historico(os_id):
     conn = get_db()
     cur = conn.cursor()
 
-    # atualiza OS (somente campos enviados)
-    fields = []
-    values = []
-
-    if novo_status:
-        fields.append("status=%s")
-        values.append(novo_status)
-
-    if request.form.get("valor_orcado") not in (None, ""):
-        fields.append("valor_orcado=%s")
-        values.append(valor_orcado)
-
-    if request.form.get("valor_pago") not in (None, ""):
-        fields.append("valor_pago=%s")
-        values.append(valor_pago)
-
-    if request.form.get("data_pagamento") not in (None, ""):
-        fields.append("data_pagamento=%s")
-        values.append(data_pagamento)
-
-    if fields:
-        values.append(os_id)
-        cur.execute(f"UPDATE os SET {', '.join(fields)} WHERE id=%s", tuple(values))
-
-    # snapshot pós update
-    cur.execute("SELECT valor_orcado, valor_pago, data_pagamento FROM os WHERE id=%s", (os_id,))
-    after = cur.fetchone()
-    if not after:
-        conn.close()
+    # atualiza OS (somente campos enviados) + histórico com o snapshot pós update
+    enviado = lambda campo: request.form.get(campo) not in (None, "")
+    hist_id = queries.os_registrar_atualizacao(
+        cur, os_id, agora(), acao, obs, visivel_cliente,
+        status=novo_status or None,
+        valor_orcado=valor_orcado if enviado("valor_orcado") else None,
+        valor_pago=valor_pago if enviado("valor_pago") else None,
+        data_pagamento=data_pagamento,
+        notificar=NOTIFICAR_STATUS,
+    )
+    if hist_id is None:
         abort(404)
 
-    cur.execute("""
-        INSERT INTO os_historico (os_id, data, acao, obs, visivel_cliente, valor_orcado, valor_pago, data_pagamento)
-        VALUES (%s,%s,%s,%s,%s,%s,%s,%s)
-    """, (
-        os_id, now_str(), acao, obs, visivel_cliente,
-        after.get("valor_orcado"),
-        after.get("valor_pago"),
-        after.get("data_pagamento")
-    ))
-
     conn.commit()
-    conn.close()
+    invalidar_os(os_id)
 
     flash("Atualização registrada.", "ok")
     return redirect(url_for("os_detalhe", os_id=os_id))
@@ -699,19 +779,16 @@ def historico_excluir(hist_id):
     cur = conn.cursor()
 
     # descobre qual OS pertence
-    cur.execute("SELECT os_id FROM os_historico WHERE id=%s", (hist_id,))
-    row = cur.fetchone()
+    os_id = queries.historico_os_id(cur, hist_id)
 
-    if not row:
-        conn.close()
+    if os_id is None:
         abort(404)
 
-    os_id = row["os_id"]
-
-    # exclui o registro do histórico
-    cur.execute("DELETE FROM os_historico WHERE id=%s", (hist_id,))
+    # exclui o registro do histórico (muda a receita dos períodos já fechados)
+    queries.historico_excluir(cur, hist_id)
+    queries.receita_cache_limpar(cur)
     conn.commit()
-    conn.close()
+    invalidar_os(os_id)
 
     flash("Histórico excluído.", "ok")
     return redirect(url_for("os_detalhe", os_id=os_id))
@@ -725,15 +802,24 @@ def historico_excluir(hist_id):
 def os_comprovante(os_id):
     conn = get_db()
     cur = conn.cursor()
-    cur.execute("SELECT * FROM os WHERE id=%s", (os_id,))
-    os_row = cur.fetchone()
-    conn.close()
-
-    if not os_row:
+    versao, nao_mudou = os_condicional(cur, os_id, "comprovante")
+    if nao_mudou:
+        return nao_mudou
+    if not versao:
         abort(404)
 
-    # Se o arquivo no templates for os_comprovante.html, use esse nome abaixo.
-    return render_template("os_comprovante.html", os=os_row, site_consulta=SITE_CONSULTA)
+    # reimpressão da mesma versão: nem consulta nem Jinja
+    html, chave = html_cacheado(chave_os(versao, "os_comprovante.html", "_os_comprovante.html"))
+    if html is None:
+        os_row = queries.os_comprovante(cur, os_id)
+
+        if not os_row:
+            abort(404)
+
+        # Se o arquivo no templates for os_comprovante.html, use esse nome abaixo.
+        html = guardar_html(chave, render_template("os_comprovante.html", os=os_row, site_consulta=SITE_CONSULTA))
+
+    return _cabecalhos_os(make_response(html), versao, "comprovante")
 
 @app.get("/os/<int:os_id>/imprimir")
 @login_required
@@ -741,28 +827,120 @@ def os_imprimir(os_id):
     conn = get_db()
     cur = conn.cursor()
 
-    cur.execute("SELECT * FROM os WHERE id=%s", (os_id,))
-    os_row = cur.fetchone()
-    if not os_row:
-        conn.close()
+    versao, nao_mudou = os_condicional(cur, os_id, "imprimir")
+    if nao_mudou:
+        return nao_mudou
+    if not versao:
         abort(404)
 
-    cur.execute("SELECT * FROM os_historico WHERE os_id=%s ORDER BY id DESC", (os_id,))
-    hist = cur.fetchall()
-    conn.close()
+    html, chave = html_cacheado(chave_os(versao, "os_imprimir.html", "_os_folha.html"))
+    if html is None:
+        os_row = queries.os_impressao(cur, os_id)
+        if not os_row:
+            abort(404)
 
-    checklist = {}
-    try:
-        checklist = json.loads(os_row.get("checklist_json") or "{}")
-    except Exception:
-        checklist = {}
+        checklist = checklist_em_ordem(os_row["checklist_json"])
+
+        html = guardar_html(chave, render_template(
+            "os_imprimir.html",
+            os=os_row,
+            checklist=checklist,
+            site_consulta=SITE_CONSULTA
+        ))
+
+    return _cabecalhos_os(make_response(html), versao, "imprimir")
+
+@app.get("/os/imprimir")
+@login_required
+def os_imprimir_lote():
+    """Várias OS num documento só, uma por página: ?ids=12,15,20-30&doc=folha|comprovante.
+
+    Duas consultas para o lote inteiro (as OS e o histórico delas, com
+    id = ANY), em vez de duas por OS.
+    """
+    doc = request.args.get("doc") or "folha"
+    if doc not in ("folha", "comprovante"):
+        doc = "folha"
+    ids = parse_ids(request.args.get("ids"), LOTE_IMPRESSAO_MAX)
+    if not ids:
+        flash(f"Informe os números das OS (ex.: 12, 15, 20-30; até {LOTE_IMPRESSAO_MAX}).", "err")
+        return redirect(url_for("painel"))
+
+    cur = get_db().cursor()
+    if doc == "folha":
+        rows = queries.os_impressao_lote(cur, ids)
+        historicos = queries.historico_cliente_lote(cur, ids) if rows else {}
+        folhas = [
+            {"os": r, "checklist": checklist_em_ordem(r["checklist_json"]), "historico": historicos.get(r["id"], [])}
+            for r in rows
+        ]
+    else:
+        folhas = [{"os": r} for r in queries.os_comprovante_lote(cur, ids)]
+
+    achadas = {f["os"]["id"] for f in folhas}
+    return render_template(
+        "os_imprimir_lote.html",
+        doc=doc,
+        folhas=folhas,
+        faltando=[i for i in ids if i not in achadas],
+        site_consulta=SITE_CONSULTA,
+    )
+
+# =========================
+# Relatórios (admin)
+# =========================
+@app.get("/relatorios/receita")
+@login_required
+@admin_required
+def relatorio_receita():
+    gran = request.args.get("granularidade") or "mes"
+    if gran not in relatorios.GRANULARIDADES:
+        gran = "mes"
+    unidade = relatorios.GRANULARIDADES[gran]
+
+    de, ate = parse_periodo(request.args.get("de"), request.args.get("ate"))
+    hoje = datetime.now(TZ).replace(hour=0, minute=0, second=0, microsecond=0)
+    ate = ate or hoje + timedelta(days=1)
+    if not de:
+        # padrão: 12 meses, 12 semanas ou 31 dias até hoje
+        de = {"month": relatorios.proximo_periodo(hoje.replace(year=hoje.year - 1, day=1), "month"),
+              "week": hoje - timedelta(weeks=11),
+              "day": hoje - timedelta(days=30)}[unidade]
 
+    conn = get_db()
+    cur = conn.cursor()
+    linhas = relatorios.receita(cur, unidade, de, ate, TZ, agora())
+    conn.commit()  # períodos fechados recém-calculados vão pro cache
+
+    tipos = sorted({t for l in linhas for t in l["por_tipo"]}, key=lambda t: t or "")
     return render_template(
-        "os_imprimir.html",
-        os=os_row,
-        checklist=checklist,
-        historico=hist,
-        site_consulta=SITE_CONSULTA
+        "relatorio_receita.html", linhas=linhas, tipos=tipos, granularidade=gran,
+        total=sum(l["recebido"] for l in linhas),
+        filtro={"de": request.args.get("de") or "", "ate": request.args.get("ate") or ""},
+    )
+
+# =========================
+# Exportação (admin)
+# =========================
+@app.get("/exportar/os.<formato>")
+@login_required
+@admin_required
+def exportar_os(formato):
+    """OS + histórico em CSV ou JSONL, em streaming (ver exportar.py).
+
+    A conexão do request fica presa até o último pedaço sair; o teardown a
+    devolve ao pool mesmo se o cliente desistir no meio.
+    """
+    if formato not in exportar.FORMATOS:
+        abort(404)
+    de, ate = parse_periodo(request.args.get("de"), request.args.get("ate"))
+
+    pedacos = exportar.gerar(get_db(), formato, de, ate)
+    nome = f"os-{datetime.now(TZ):%Y%m%d-%H%M}.{formato}"
+    return Response(
+        stream_with_context(pedacos),
+        mimetype=exportar.FORMATOS[formato],
+        headers={"Content-Disposition": f'attachment; filename="{nome}"'},
     )
 
 # =========================
@@ -775,16 +953,71 @@ def os_excluir(os_id):
     conn = get_db()
     cur = conn.cursor()
 
-    # apaga histórico primeiro
-    cur.execute("DELETE FROM os_historico WHERE os_id=%s", (os_id,))
-    cur.execute("DELETE FROM os WHERE id=%s", (os_id,))
+    queries.os_excluir(cur, os_id)
+    queries.receita_cache_limpar(cur)
 
     conn.commit()
-    conn.close()
+    invalidar_os(os_id)
 
     flash("OS excluída com sucesso.", "ok")
     return redirect(url_for("painel"))
 
+# =========================
+# Consultas lentas (admin)
+# =========================
+@app.get("/admin/consultas-lentas")
+@login_required
+@admin_required
+def consultas_lentas():
+    dias = request.args.get("dias", type=int) or 7
+    if dias not in (1, 7, 30):
+        dias = 7
+    cur = get_db().cursor()
+    top = queries.consultas_lentas_top(cur, agora() - timedelta(days=dias))
+    return render_template(
+        "consultas_lentas.html", top=top, dias=dias,
+        limite_ms=db.DB_LENTA_MS, explain=lentas.DB_LENTA_EXPLAIN,
+    )
+
+
+@app.get("/admin/consultas-lentas/<int:lenta_id>")
+@login_required
+@admin_required
+def consulta_lenta(lenta_id):
+    lenta = queries.consulta_lenta(get_db().cursor(), lenta_id)
+    if not lenta:
+        abort(404)
+    return render_template("consulta_lenta.html", lenta=lenta)
+
+
+@app.post("/admin/consultas-lentas/limpar")
+@login_required
+@admin_required
+def consultas_lentas_limpar():
+    conn = get_db()
+    queries.consultas_lentas_limpar(conn.cursor())
+    conn.commit()
+    flash("Registro de consultas lentas limpo.", "ok")
+    return redirect(url_for("consultas_lentas"))
+
+# =========================
+# Métricas (admin / Prometheus)
+# =========================
+@app.get("/metrics")
+def metrics():
+    token = request.headers.get("Authorization", "")
+    if not (METRICAS_TOKEN and hmac.compare_digest(token, f"Bearer {METRICAS_TOKEN}")):
+        if session.get("role") != "admin":
+            abort(404 if not session.get("user_id") else 403)
+    return Response(
+        app.extensions["metricas"].texto(),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )
+
+# depois de todas as rotas: um histograma por endpoint, em memória
+# compartilhada entre os workers (ver metricas.py)
+metricas.init_app(app)
+
 # =========================
 # Run local
 # =========================
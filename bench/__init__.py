@@ -0,0 +1,4 @@
+"""Ferramentas de medição: seed de dados sintéticos, checagens de plano/latência e teste de carga.
+
+Rodam contra o banco de DATABASE_URL — use um banco local/descartável.
+"""
@@ -0,0 +1,322 @@
+"""Teste de carga das rotas quentes, com relatório em JSON para comparar commits.
+
+    python -m bench.seed                      # uma vez, num banco descartável
+    python -m bench.carga --concorrencia 8 --duracao 60 --saida carga.json
+    python -m bench.carga --url http://localhost:10000 ...   # servidor rodando (gunicorn)
+
+Cada thread faz login com o usuário do seed (bench/bench) e sorteia, pelo
+--mix, entre:
+
+- painel, os_finalizadas (primeira página ou uma página funda, com filtro
+  de status às vezes) e os_detalhe de uma OS qualquer;
+- consultar_post: POST /consultar e o GET para onde ele redireciona, como o
+  cliente faz (conta como uma operação);
+- os_nova_post: OS nova com checklist no formato dos campos ck_*;
+- os_add_historico: observação numa OS existente (sem mudar status nem
+  valores, para a carga não mexer no resumo nem na receita).
+
+Sem --url o app roda no próprio processo (test_client do Flask, uma thread
+por cliente): mede app + banco sem rede nem gunicorn, que é o que muda de um
+commit para outro. Os comandos e o tempo de banco por request vêm do
+Server-Timing que o db.py põe em toda resposta.
+
+O relatório traz, no total e por operação: p50/p95/p99, média, vazão
+(op/s), erros e comandos SQL por request. As OS e históricos criados são
+apagados no fim (--manter para não apagar). Mesmo --seed e mesmo banco:
+mesma sequência de operações por thread.
+"""
+import argparse
+import http.cookiejar
+import json
+import math
+import random
+import re
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime, timezone
+
+import db
+from bench.seed import BENCH_SENHA, BENCH_USUARIO, fake_os
+
+OPERACOES = ("painel", "os_finalizadas", "os_detalhe", "consultar_post", "os_nova_post", "os_add_historico")
+# leitura bem mais frequente que escrita, como na loja
+MIX_PADRAO = "painel=3,os_finalizadas=2,os_detalhe=4,consultar_post=3,os_nova_post=1,os_add_historico=1"
+
+_SERVER_TIMING = re.compile(r'\bdb;dur=([\d.]+);desc="(\d+) comandos"')
+
+
+# =========================
+# Clientes
+# =========================
+class ClienteApp:
+    """Requests direto no app Flask, sem rede."""
+
+    def __init__(self, app):
+        self.c = app.test_client()
+
+    def pedir(self, metodo, caminho, dados=None):
+        r = self.c.open(caminho, method=metodo, data=dados)
+        r.close()
+        return r.status_code, r.headers.get("Location"), ", ".join(r.headers.getlist("Server-Timing"))
+
+
+class _SemRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class ClienteHTTP:
+    """Requests num servidor rodando, com cookie de sessão e sem seguir redirect."""
+
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+        self.abrir = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _SemRedirect
+        ).open
+
+    def pedir(self, metodo, caminho, dados=None):
+        corpo = urllib.parse.urlencode(dados).encode() if dados is not None else None
+        req = urllib.request.Request(self.url + caminho, data=corpo, method=metodo)
+        try:
+            r = self.abrir(req, timeout=60)
+        except urllib.error.HTTPError as e:
+            r = e  # 3xx/4xx/5xx: a resposta vem na exceção
+        with r:
+            r.read()
+            cabecalhos = r.headers
+            loc = cabecalhos.get("Location")
+            if loc:
+                loc = urllib.parse.urlsplit(loc)
+                loc = loc.path + (f"?{loc.query}" if loc.query else "")
+            return r.status, loc, ", ".join(cabecalhos.get_all("Server-Timing") or [])
+
+
+# =========================
+# Operações
+# =========================
+class Amostra:
+    """Ids e códigos reais do banco para as rotas por OS."""
+
+    def __init__(self, cur, rng, n=5000):
+        # sorteio aqui e não no banco (setseed/random() só o Postgres tem)
+        cur.execute("SELECT id, codigo_consulta FROM os WHERE codigo_consulta IS NOT NULL ORDER BY id")
+        todas = [(r["id"], r["codigo_consulta"]) for r in cur.fetchall()]
+        if not todas:
+            raise SystemExit("ERRO: banco sem OS. Rode antes: python -m bench.seed")
+        self.os = sorted(rng.sample(todas, min(n, len(todas))))
+        cur.execute("SELECT max(id) AS os_max FROM os")
+        self.os_max = cur.fetchone()["os_max"]
+        cur.execute("SELECT coalesce(max(id), 0) AS hist_max FROM os_historico")
+        self.hist_max = cur.fetchone()["hist_max"]
+
+
+def _form_os(rng):
+    o = fake_os(rng, datetime.now(), "aberta")
+    form = {k: o[k] for k in ("cliente_nome", "cliente_fone", "cliente_cpf", "cliente_endereco",
+                              "cliente_email", "tipo", "equipamento", "relato_cliente")}
+    form.update(o["checklist"])
+    return form
+
+
+def operacao(nome, cli, rng, amostra):
+    """Executa uma operação; devolve [(status, server_timing), ...] dos requests feitos."""
+    os_id, codigo = rng.choice(amostra.os)
+    if nome == "painel":
+        r = cli.pedir("GET", "/painel")
+        return [(r[0], r[2])]
+    if nome == "os_finalizadas":
+        q = {}
+        if rng.random() < 0.3:
+            q["status"] = rng.choice(["fechada", "sem conserto"])
+        if rng.random() < 0.5:
+            q["antes"] = f"0.{os_id}"
+        r = cli.pedir("GET", "/os/finalizadas" + (f"?{urllib.parse.urlencode(q)}" if q else ""))
+        return [(r[0], r[2])]
+    if nome == "os_detalhe":
+        r = cli.pedir("GET", f"/os/{os_id}")
+        return [(r[0], r[2])]
+    if nome == "consultar_post":
+        r = cli.pedir("POST", "/consultar", {"os_id": str(os_id), "codigo": codigo})
+        feitos = [(r[0], r[2])]
+        if r[0] in (302, 303) and r[1]:
+            r2 = cli.pedir("GET", r[1])
+            feitos.append((r2[0], r2[2]))
+        return feitos
+    if nome == "os_nova_post":
+        r = cli.pedir("POST", "/os/nova", _form_os(rng))
+        return [(r[0], r[2])]
+    if nome == "os_add_historico":
+        r = cli.pedir("POST", f"/os/{os_id}/historico", {
+            "acao": "Observação", "obs": "bench: " + rng.choice(["cliente ligou", "peça pedida", "em teste"]),
+            "visivel_cliente": rng.choice(["0", "1"]),
+        })
+        return [(r[0], r[2])]
+    raise ValueError(nome)
+
+
+def _ok(status):
+    # redirect é a resposta normal dos POST (PRG) e do consultar
+    return status < 400
+
+
+def cliente_worker(i, fazer_cliente, mix, amostra, seed, inicio_medicao, fim, resultados):
+    rng = random.Random(seed * 1000 + i)
+    cli = fazer_cliente()
+    status, destino, _ = cli.pedir("POST", "/login", {"usuario": BENCH_USUARIO, "senha": BENCH_SENHA})
+    if status != 302 or not (destino or "").endswith("/painel"):
+        # senha errada também redireciona (de volta para /login)
+        raise SystemExit(f"ERRO: login do {BENCH_USUARIO} falhou ({status} -> {destino}). Rode o bench.seed.")
+
+    nomes, pesos = zip(*mix.items())
+    meus = []
+    while time.perf_counter() < fim:
+        nome = rng.choices(nomes, weights=pesos)[0]
+        t0 = time.perf_counter()
+        feitos = operacao(nome, cli, rng, amostra)
+        dur = time.perf_counter() - t0
+        if t0 < inicio_medicao:
+            continue  # aquecimento
+        comandos, tempo_db = 0, 0.0
+        for _, st in feitos:
+            m = _SERVER_TIMING.search(st)
+            if m:
+                tempo_db += float(m.group(1))
+                comandos += int(m.group(2))
+        meus.append((nome, dur * 1000, len(feitos), comandos, tempo_db,
+                     all(_ok(s) for s, _ in feitos)))
+    resultados[i] = meus
+
+
+# =========================
+# Relatório
+# =========================
+def percentil(ordenados, p):
+    """Nearest-rank: o menor valor com pelo menos p% das amostras até ele."""
+    if not ordenados:
+        return 0.0
+    return ordenados[max(0, math.ceil(p / 100 * len(ordenados)) - 1)]
+
+
+def resumo(amostras, segundos) -> dict:
+    tempos = sorted(a[1] for a in amostras)
+    reqs = sum(a[2] for a in amostras) or 1
+    return {
+        "n": len(amostras),
+        "erros": sum(1 for a in amostras if not a[5]),
+        "op_por_s": round(len(amostras) / segundos, 2),
+        "p50_ms": round(percentil(tempos, 50), 3),
+        "p95_ms": round(percentil(tempos, 95), 3),
+        "p99_ms": round(percentil(tempos, 99), 3),
+        "media_ms": round(statistics.fmean(tempos), 3) if tempos else 0.0,
+        "comandos_por_req": round(sum(a[3] for a in amostras) / reqs, 2),
+        "db_ms_por_req": round(sum(a[4] for a in amostras) / reqs, 3),
+    }
+
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_mix(spec) -> dict:
+    mix = {}
+    for parte in spec.split(","):
+        nome, _, peso = parte.strip().partition("=")
+        if nome not in OPERACOES:
+            raise SystemExit(f"ERRO: operação desconhecida no --mix: {nome!r} (use {', '.join(OPERACOES)})")
+        mix[nome] = float(peso or 1)
+    return {k: v for k, v in mix.items() if v > 0}
+
+
+def limpar(conn, amostra):
+    """Apaga o que a carga criou: OS novas e históricos novos."""
+    cur = conn.cursor()
+    cur.execute("DELETE FROM os_historico WHERE id > %s OR os_id > %s", (amostra.hist_max, amostra.os_max))
+    cur.execute("DELETE FROM os WHERE id > %s", (amostra.os_max,))
+    conn.commit()
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--url", help="servidor já rodando; sem isso o app roda neste processo")
+    ap.add_argument("--concorrencia", type=int, default=8, help="clientes simultâneos")
+    ap.add_argument("--duracao", type=float, default=30, help="segundos medidos")
+    ap.add_argument("--aquecimento", type=float, default=5, help="segundos iniciais fora da medição")
+    ap.add_argument("--mix", default=MIX_PADRAO, help="pesos das operações (nome=peso,...)")
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--saida", help="grava o JSON aqui, além de imprimir")
+    ap.add_argument("--manter", action="store_true", help="não apaga as OS/históricos criados")
+    args = ap.parse_args(argv)
+
+    mix = parse_mix(args.mix)
+    conn = db.connect()
+    try:
+        cur = conn.cursor()
+        amostra = Amostra(cur, random.Random(args.seed))
+        conn.commit()
+
+        if args.url:
+            fazer_cliente = lambda: ClienteHTTP(args.url)
+        else:
+            from app import app
+            fazer_cliente = lambda: ClienteApp(app)
+
+        resultados = [None] * args.concorrencia
+        inicio = time.perf_counter()
+        inicio_medicao = inicio + args.aquecimento
+        fim = inicio_medicao + args.duracao
+        threads = [
+            threading.Thread(target=cliente_worker, daemon=True, args=(
+                i, fazer_cliente, mix, amostra, args.seed, inicio_medicao, fim, resultados))
+            for i in range(args.concorrencia)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        if any(r is None for r in resultados):
+            print("ERRO: algum cliente parou no meio (veja o traceback acima).", file=sys.stderr)
+            return 1
+
+        amostras = [a for r in resultados for a in r]
+        relatorio = {
+            "meta": {
+                "commit": _commit(),
+                "quando": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "modo": args.url or "in-process",
+                "concorrencia": args.concorrencia,
+                "duracao_s": args.duracao,
+                "mix": mix,
+                "seed": args.seed,
+                "os_no_banco": amostra.os_max,
+            },
+            "total": resumo(amostras, args.duracao),
+            "por_operacao": {
+                nome: resumo([a for a in amostras if a[0] == nome], args.duracao)
+                for nome in OPERACOES if nome in mix
+            },
+        }
+        if not args.manter:
+            limpar(conn, amostra)
+    finally:
+        conn.close()
+
+    texto = json.dumps(relatorio, indent=2, ensure_ascii=False, sort_keys=True)
+    print(texto)
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as f:
+            f.write(texto + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
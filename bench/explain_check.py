@@ -0,0 +1,150 @@
+"""Confere que as consultas das rotas usam índice.
+
+Roda EXPLAIN em cada consulta quente contra um banco populado
+(python -m bench.seed) e falha se alguma cair em Seq Scan numa tabela grande.
+
+    python -m bench.explain_check
+"""
+import json
+import sys
+
+import db
+import queries
+
+# tabelas que crescem com o histórico da loja; usuarios/schema_version são
+# pequenas e Seq Scan nelas é o plano certo
+TABELAS_GRANDES = {"os", "os_historico", "devedores", "notificacoes"}
+
+# (rota, chamada) — as mesmas funções de queries.py que as rotas usam; `p`
+# traz ids/códigos reais do banco (ver _params)
+CONSULTAS = [
+    ("painel", lambda cur, p: (queries.os_abertas(cur), queries.os_resumo(cur))),
+    ("os_finalizadas", lambda cur, p: queries.os_finalizadas_pagina(cur, antes=f"0.{p['os_id']}")),
+    ("os_finalizadas (status)", lambda cur, p: queries.os_finalizadas_pagina(
+        cur, status="sem conserto", antes=f"0.{p['os_id']}")),
+    ("devedores", lambda cur, p: queries.devedores_pagina(cur, antes=f"0.{p['dev_id']}")),
+    ("devedores (resumo)", lambda cur, p: queries.devedores_resumo(
+        cur, "2026-01-01 00:00:00", "2025-12-01 00:00:00", status="em aberto")),
+    ("relatorio_receita", lambda cur, p: queries.receita_por_periodo(
+        cur, "month", "2025-01-01 00:00:00+00", "2026-01-01 00:00:00+00", "UTC")),
+    ("os_buscar (nome)", lambda cur, p: queries.os_buscar(cur, "maria souza")),
+    ("os_buscar (telefone)", lambda cur, p: queries.os_buscar(cur, "99999-1234")),
+    ("os_por_checklist", lambda cur, p: queries.os_por_checklist(cur, contem={"ck_cel_agua": "Sim (confirmado)"})),
+    ("os_por_checklist (chave)", lambda cur, p: queries.os_por_checklist(cur, chave="ck_cel_biometria")),
+    ("os_por_imei", lambda cur, p: queries.os_por_imei(cur, "356938035643809")),
+    ("os_detalhe", lambda cur, p: (queries.os_detalhe(cur, p["os_id"]), queries.historico(cur, p["os_id"]))),
+    ("os_imprimir", lambda cur, p: queries.os_impressao(cur, p["os_id"])),
+    ("os_comprovante", lambda cur, p: queries.os_comprovante(cur, p["os_id"])),
+    ("os_imprimir_lote", lambda cur, p: (queries.os_impressao_lote(cur, list(range(p["os_id"], p["os_id"] + 50))),
+                                         queries.historico_cliente_lote(cur, list(range(p["os_id"], p["os_id"] + 50))))),
+    ("os_versao (ETag)", lambda cur, p: queries.os_versao(cur, p["os_id"])),
+    ("consultar_os", lambda cur, p: (queries.os_cliente(cur, p["os_id"]),
+                                     queries.historico_cliente(cur, p["os_id"]))),
+    ("os_nova_post", lambda cur, p: queries.os_criar(cur, _nova_os(p))),
+    ("historico_excluir", lambda cur, p: (queries.historico_os_id(cur, p["hist_id"]),
+                                          queries.historico_excluir(cur, p["hist_id"]))),
+    ("os_add_historico", lambda cur, p: queries.os_registrar_atualizacao(
+        cur, p["os_id"], None, None, None, 0)),
+    ("os_excluir", lambda cur, p: queries.os_excluir(cur, p["os_id"])),
+    ("notificador", lambda cur, p: queries.notificacoes_pegar(cur, 20)),
+]
+
+
+class ExplainCursor:
+    """Cursor que, em vez de executar, guarda o EXPLAIN de cada comando.
+
+    As funções de queries.py rodam normalmente, só que sem efeito: leituras
+    devolvem vazio e escritas não acontecem (EXPLAIN sem ANALYZE).
+    """
+
+    def __init__(self, cur):
+        self.cur = cur
+        self.connection = cur.connection
+        self.planos = []
+
+    def execute(self, sql, params=None):
+        self.cur.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+        plano = self.cur.fetchone()["QUERY PLAN"]
+        if isinstance(plano, str):
+            plano = json.loads(plano)
+        self.planos.append(plano[0]["Plan"])
+
+    def fetchone(self):
+        return None
+
+    def fetchall(self):
+        return []
+
+
+def _nova_os(p) -> dict:
+    # EXPLAIN sem ANALYZE: o INSERT não acontece
+    campos = ["data_entrada", "cliente_nome", "cliente_fone", "cliente_cpf", "cliente_endereco",
+              "cliente_email", "tipo", "equipamento", "checklist_json", "relato_cliente",
+              "diagnostico_tecnico", "valor_orcado", "valor_pago", "data_pagamento",
+              "hist_valor_orcado", "hist_valor_pago", "hist_data_pagamento"]
+    return dict({c: None for c in campos}, checklist_json={}, codigo_consulta=p["codigo"])
+
+
+def _params(cur) -> dict:
+    cur.execute("SELECT id, codigo_consulta FROM os ORDER BY id DESC LIMIT 1")
+    o = cur.fetchone()
+    if not o:
+        raise SystemExit("ERRO: banco vazio. Rode antes: python -m bench.seed")
+    cur.execute("SELECT id FROM os_historico WHERE os_id = %s LIMIT 1", (o["id"],))
+    h = cur.fetchone()
+    cur.execute("SELECT max(id) AS id FROM devedores")
+    d = cur.fetchone()
+    return {"os_id": o["id"], "codigo": o["codigo_consulta"], "hist_id": h["id"] if h else 0,
+            "dev_id": d["id"] or 0}
+
+
+def _nodes(plan):
+    yield plan
+    for p in plan.get("Plans", []):
+        yield from _nodes(p)
+
+
+def seq_scans(planos) -> list:
+    return [
+        n.get("Relation Name") for plano in planos for n in _nodes(plano)
+        if n["Node Type"] == "Seq Scan" and n.get("Relation Name") in TABELAS_GRANDES
+    ]
+
+
+def check(conn, consultas=CONSULTAS, log=print) -> list:
+    # EXPLAIN de PREPARE não existe; aqui o SQL vai direto
+    prepare, db.DB_PREPARE = db.DB_PREPARE, False
+    try:
+        cur = conn.cursor()
+        params = _params(cur)
+        falhas = []
+        for rota, chamada in consultas:
+            ecur = ExplainCursor(cur)
+            chamada(ecur, params)
+            tabelas = seq_scans(ecur.planos)
+            if tabelas:
+                falhas.append((rota, tabelas))
+                log(f"  FALHOU  {rota}: Seq Scan em {', '.join(tabelas)}")
+            else:
+                log(f"  ok      {rota} ({len(ecur.planos)} consulta(s))")
+        conn.rollback()
+        return falhas
+    finally:
+        db.DB_PREPARE = prepare
+
+
+def main():
+    conn = db.connect()
+    try:
+        falhas = check(conn)
+    finally:
+        conn.close()
+    if falhas:
+        print(f"❌ {len(falhas)} rota(s) com consulta sem índice.")
+        return 1
+    print("✅ Todas as consultas usam índice.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,148 @@
+"""Latência da criação de OS: caminho antigo (4 idas ao banco) x CTE única.
+
+    python -m bench.os_nova --n 300 [--rtt-ms 20]
+
+--rtt-ms soma uma espera fixa a cada ida ao banco (inclusive o COMMIT) para
+simular a distância até o Neon quando o banco é local. As OS criadas são
+apagadas no fim.
+"""
+import argparse
+import json
+import random
+import statistics
+import string
+import sys
+import time
+from datetime import datetime
+
+import db
+import migrations
+import queries
+from bench.seed import fake_os
+
+
+class CountingCursor:
+    """Cursor que conta idas ao banco (e opcionalmente simula RTT)."""
+
+    def __init__(self, cur, rtt):
+        self.cur = cur
+        self.connection = cur.connection
+        self.rtt = rtt
+        self.idas = 0
+
+    def execute(self, sql, params=None):
+        self.idas += 1
+        if self.rtt:
+            time.sleep(self.rtt)
+        return self.cur.execute(sql, params)
+
+    def fetchone(self):
+        return self.cur.fetchone()
+
+    def fetchall(self):
+        return self.cur.fetchall()
+
+
+def _dados(rng):
+    o = fake_os(rng, datetime.now(), "aberta")
+    dados = {k: o[k] for k in ("data_entrada", "cliente_nome", "cliente_fone", "cliente_cpf",
+                               "cliente_endereco", "cliente_email", "tipo", "equipamento",
+                               "relato_cliente", "diagnostico_tecnico", "valor_orcado",
+                               "valor_pago", "data_pagamento")}
+    dados["checklist_json"] = o["checklist"]
+    dados.update(hist_valor_orcado=None, hist_valor_pago=None, hist_data_pagamento=None)
+    return dados
+
+
+def _codigo(rng):
+    return "".join(rng.choices(string.ascii_uppercase + string.digits, k=6))
+
+
+def criar_antigo(cur, dados, rng) -> int:
+    """Como os_nova_post fazia antes: sonda o código, INSERT os, INSERT histórico."""
+    while True:
+        code = _codigo(rng)
+        cur.execute("SELECT 1 FROM os WHERE codigo_consulta = %s", (code,))
+        if not cur.fetchone():
+            break
+    cur.execute("""
+        INSERT INTO os (data_entrada, status, cliente_nome, cliente_fone, cliente_cpf, cliente_endereco,
+                        cliente_email, tipo, equipamento, checklist_json, relato_cliente, diagnostico_tecnico,
+                        valor_orcado, valor_pago, data_pagamento, codigo_consulta)
+        VALUES (%(data_entrada)s, 'aberta', %(cliente_nome)s, %(cliente_fone)s, %(cliente_cpf)s,
+                %(cliente_endereco)s, %(cliente_email)s, %(tipo)s, %(equipamento)s, %(checklist_json)s,
+                %(relato_cliente)s, %(diagnostico_tecnico)s, %(valor_orcado)s, %(valor_pago)s,
+                %(data_pagamento)s, %(codigo)s)
+        RETURNING id
+    """, dict(dados, codigo=code, checklist_json=json.dumps(dados["checklist_json"], ensure_ascii=False)))
+    os_id = cur.fetchone()["id"]
+    cur.execute("""
+        INSERT INTO os_historico (os_id, data, acao, obs, visivel_cliente, valor_orcado, valor_pago, data_pagamento)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+    """, (os_id, dados["data_entrada"], "OS criada", "Entrada registrada no sistema.", 1, None, None, None))
+    return os_id
+
+
+def criar_cte(cur, dados, rng) -> int:
+    while True:
+        dados["codigo_consulta"] = _codigo(rng)
+        os_id = queries.os_criar(cur, dados)
+        if os_id:
+            return os_id
+
+
+def medir(conn, criar, n, rtt, rng) -> dict:
+    cur = CountingCursor(conn.cursor(), rtt)
+    tempos, ids = [], []
+    for _ in range(n):
+        dados = _dados(rng)
+        t0 = time.perf_counter()
+        ids.append(criar(cur, dados, rng))
+        cur.idas += 1  # COMMIT
+        if rtt:
+            time.sleep(rtt)
+        conn.commit()
+        tempos.append((time.perf_counter() - t0) * 1000)
+
+    cur.cur.execute("DELETE FROM os_historico WHERE os_id = ANY(%s)", (ids,))
+    cur.cur.execute("DELETE FROM os WHERE id = ANY(%s)", (ids,))
+    conn.commit()
+
+    tempos.sort()
+    return {
+        "n": n,
+        "idas_por_os": round(cur.idas / n, 2),
+        "p50_ms": round(statistics.median(tempos), 3),
+        "p95_ms": round(tempos[int(len(tempos) * 0.95) - 1], 3),
+        "media_ms": round(statistics.fmean(tempos), 3),
+    }
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--n", type=int, default=300, help="OS criadas por variante")
+    ap.add_argument("--rtt-ms", type=float, default=0.0, help="latência simulada por ida ao banco")
+    ap.add_argument("--seed", type=int, default=42)
+    args = ap.parse_args(argv)
+
+    migrations.migrate()
+    db.DB_PREPARE = True
+    conn = db.connect()
+    try:
+        rng = random.Random(args.seed)
+        rtt = args.rtt_ms / 1000
+        # aquece conexão e prepared statement
+        medir(conn, criar_cte, 5, 0, rng)
+        resultado = {
+            "rtt_simulado_ms": args.rtt_ms,
+            "antes": medir(conn, criar_antigo, args.n, rtt, rng),
+            "depois": medir(conn, criar_cte, args.n, rtt, rng),
+        }
+    finally:
+        conn.close()
+    print(json.dumps(resultado, indent=2, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,320 @@
+"""Popula o banco com dados sintéticos com cara de loja real.
+
+    python -m bench.seed --os 100000 --hist 3 --devedores 5000
+
+Recusa rodar em banco que já tem OS (use --append para somar). Enche também a
+fila de notificacoes (quase tudo enviado, as mais novas pendentes) e cria o
+usuário do teste de carga (bench/bench, ver bench.carga).
+"""
+import argparse
+import json
+import random
+import string
+import sys
+from datetime import datetime, timedelta
+
+from psycopg2.extras import execute_values
+
+import db
+import migrations
+
+ABERTAS = ["aberta", "aguardando orçamento", "aguardando aprovação", "em execução"]
+FINALIZADAS = ["fechada", "sem conserto"]
+
+NOMES = ["Ana", "Bruno", "Carla", "Diego", "Eduarda", "Felipe", "Gabriela", "Henrique",
+         "Isabela", "João", "Karina", "Lucas", "Mariana", "Nicolas", "Olívia", "Paulo",
+         "Rafaela", "Sérgio", "Tatiane", "Vinícius", "Wesley", "Yasmin"]
+SOBRENOMES = ["Silva", "Santos", "Oliveira", "Souza", "Lima", "Pereira", "Ferreira",
+              "Costa", "Rodrigues", "Almeida", "Nascimento", "Carvalho", "Gomes", "Ribeiro"]
+
+EQUIPAMENTOS = {
+    "Celular": ["Samsung Galaxy A54", "Motorola Moto G84", "Xiaomi Redmi Note 12", "Samsung Galaxy S21"],
+    "iPhone": ["iPhone 11", "iPhone 12", "iPhone 13 Pro", "iPhone XR"],
+    "Tablet": ["Samsung Tab A8", "Lenovo Tab M10"],
+    "Notebook": ["Dell Inspiron 15", "Lenovo IdeaPad 3", "Acer Aspire 5", "Samsung Book"],
+    "Computador": ["Desktop i5 8GB", "Gamer Ryzen 5"],
+    "TV": ["Samsung 50\" Crystal", "LG 43\" Smart", "TCL 55\" 4K"],
+    "Videogame": ["PlayStation 4", "PlayStation 5", "Xbox Series S", "Nintendo Switch"],
+    "Outro": ["Caixa JBL", "Impressora HP", "Roteador TP-Link"],
+}
+TIPO_PESOS = {"Celular": 40, "iPhone": 15, "Tablet": 5, "Notebook": 15, "Computador": 5,
+              "TV": 8, "Videogame": 8, "Outro": 4}
+
+# campos ck_* do nova_os.html, por grupo de tipo, com valores possíveis
+CHECKLIST = {
+    "cel": {
+        "ck_cel_tela_estado": ["Boa", "Riscada", "Trincada", "Quebrada"],
+        "ck_cel_tela_quebrada": ["Não", "Sim"],
+        "ck_cel_touch": ["Sim", "Não", "Intermitente"],
+        "ck_cel_display": ["Ok", "Manchas", "Sem imagem", "Piscando", "Não testado"],
+        "ck_cel_liga": ["Sim", "Não", "Não verificado"],
+        "ck_cel_carrega": ["Sim", "Não", "Intermitente"],
+        "ck_cel_bateria_pct": ["0-10%", "11-30%", "31-60%", "61-100%"],
+        "ck_cel_power": ["Ok", "Falhando", "Não testado"],
+        "ck_cel_volume": ["Ok", "Falhando", "Não testado"],
+        "ck_cel_wifi": ["Ok", "Não conecta", "Intermitente", "Não testado"],
+        "ck_cel_chip": ["Sim", "Não", "Não verificado"],
+        "ck_cel_cam_traseira": ["Ok", "Com defeito", "Não testado"],
+        "ck_cel_audio": ["Ok", "Baixo", "Rouco", "Mudo", "Não testado"],
+        "ck_cel_conector": ["Ok", "Com defeito", "Não testado"],
+        "ck_cel_agua": ["Não", "Sim", "Não verificado"],
+        "ck_cel_conta": ["Não", "Sim"],
+        "ck_cel_carcaca": ["Boa", "Riscada", "Amassada"],
+        "ck_cel_acessorios": ["Nenhum", "Capa", "Carregador", "Capa e carregador"],
+    },
+    "pc": {
+        "ck_pc_fonte": ["Sim", "Não"],
+        "ck_pc_bateria": ["Ok", "Viciada", "Não segura carga"],
+        "ck_pc_hdssd": ["HD 500GB", "SSD 240GB", "SSD 480GB"],
+        "ck_pc_teclado": ["Ok", "Teclas falhando"],
+        "ck_pc_tela": ["Ok", "Manchas", "Trincada"],
+        "ck_pc_acessorios": ["Nenhum", "Mouse", "Bolsa"],
+    },
+    "tv": {
+        "ck_tv_polegadas": ["32", "43", "50", "55", "65"],
+        "ck_tv_controle": ["Sim", "Não"],
+        "ck_tv_fonte": ["Sim", "Não"],
+        "ck_tv_tela_trincada": ["Não", "Sim"],
+        "ck_tv_base": ["Sim", "Não"],
+    },
+    "vg": {
+        "ck_vg_controles": ["0", "1", "2"],
+        "ck_vg_cabos": ["HDMI", "HDMI e força", "Nenhum"],
+        "ck_vg_leitor": ["Ok", "Não lê", "Não testado"],
+    },
+    "outro": {
+        "ck_outro_acessorios": ["Nenhum", "Cabo"],
+        "ck_outro_estado": ["Bom", "Marcas de uso", "Avariado"],
+    },
+}
+GRUPO = {"Celular": "cel", "iPhone": "cel", "Tablet": "cel", "Notebook": "pc",
+         "Computador": "pc", "TV": "tv", "Videogame": "vg", "Outro": "outro"}
+
+# login usado pelo bench.carga
+BENCH_USUARIO, BENCH_SENHA = "bench", "bench"
+
+ACOES = ["Orçamento concluído", "Cliente informado", "Aguardando aprovação",
+         "Aprovado pelo cliente", "Serviço em execução", "Pagamento registrado"]
+
+
+def _digits(rng, n):
+    return "".join(rng.choices(string.digits, k=n))
+
+
+def _codigo(rng, usados: set) -> str:
+    # mesmo formato do gen_codigo_consulta, sem repetir (índice único)
+    while True:
+        code = "".join(rng.choices(string.ascii_uppercase + string.digits, k=6))
+        if code not in usados:
+            usados.add(code)
+            return code
+
+
+def _texto(quando: datetime) -> str:
+    """Data como texto de timestamptz (no SQLite já no formato que o db_sqlite grava, em UTC)."""
+    return quando.strftime("%Y-%m-%d %H:%M:%S") + (".000+00:00" if db.SQLITE else "")
+
+
+def _inserir(cur, tabela, colunas, linhas, lote, retornar=False):
+    """INSERT de várias linhas: execute_values no Postgres, executemany no SQLite."""
+    sql = f"INSERT INTO {tabela} ({', '.join(colunas)}) VALUES "
+    volta = " RETURNING id" if retornar else ""
+    if not db.SQLITE:
+        return execute_values(cur, sql + "%s" + volta, linhas, page_size=lote, fetch=retornar)
+    sql += "(" + ", ".join(["%s"] * len(colunas)) + ")"
+    if not retornar:
+        cur.executemany(sql, linhas)
+        return None
+    ids = []
+    for linha in linhas:
+        cur.execute(sql + volta, linha)
+        ids.append(cur.fetchone())
+    return ids
+
+
+def fake_checklist(rng, tipo) -> dict:
+    campos = CHECKLIST[GRUPO[tipo]]
+    ck = {k: rng.choice(v) for k, v in campos.items() if rng.random() < 0.7}
+    if GRUPO[tipo] == "cel":
+        ck["ck_cel_imei1"] = _digits(rng, 15)
+        if rng.random() < 0.4:
+            ck["ck_cel_imei2"] = _digits(rng, 15)
+    return ck
+
+
+def fake_os(rng, quando: datetime, status: str) -> dict:
+    tipo = rng.choices(list(TIPO_PESOS), weights=list(TIPO_PESOS.values()))[0]
+    orcado = rng.choice([0, 80, 120, 150, 200, 250, 350, 480, 650]) if status != "aberta" else 0
+    pago = orcado if status == "fechada" else (orcado / 2 if rng.random() < 0.2 else 0)
+    return {
+        "data_entrada": _texto(quando),
+        "status": status,
+        "cliente_nome": f"{rng.choice(NOMES)} {rng.choice(SOBRENOMES)} {rng.choice(SOBRENOMES)}",
+        "cliente_fone": f"(11) 9{_digits(rng, 4)}-{_digits(rng, 4)}",
+        "cliente_cpf": f"{_digits(rng, 3)}.{_digits(rng, 3)}.{_digits(rng, 3)}-{_digits(rng, 2)}",
+        "cliente_endereco": f"Rua {rng.choice(SOBRENOMES)}, {rng.randint(1, 2000)}",
+        "cliente_email": "",
+        "tipo": tipo,
+        "equipamento": rng.choice(EQUIPAMENTOS[tipo]),
+        "checklist": fake_checklist(rng, tipo),
+        "relato_cliente": rng.choice(["Não liga", "Tela quebrada após queda", "Não carrega",
+                                      "Caiu na água", "Lento e travando", "Sem imagem"]),
+        "diagnostico_tecnico": rng.choice(["", "Troca de conector", "Troca de frontal",
+                                           "Oxidação na placa", "Formatação", "Troca de fonte"]),
+        "valor_orcado": orcado,
+        "valor_pago": pago,
+        "data_pagamento": (quando + timedelta(days=rng.randint(1, 20))).date() if pago else None,
+    }
+
+
+OS_COLS = ["data_entrada", "status", "cliente_nome", "cliente_fone", "cliente_cpf",
+           "cliente_endereco", "cliente_email", "tipo", "equipamento", "checklist_json",
+           "relato_cliente", "diagnostico_tecnico", "valor_orcado", "valor_pago",
+           "data_pagamento", "codigo_consulta"]
+HIST_COLS = ["os_id", "data", "acao", "obs", "visivel_cliente", "valor_orcado", "valor_pago", "data_pagamento"]
+DEV_COLS = ["criado_em", "cliente_nome", "cliente_fone", "referencia", "valor", "obs", "status", "pago_em"]
+NOTIF_COLS = ["os_id", "evento", "dados", "criado_em", "proxima_tentativa", "tentativas",
+              "ultimo_erro", "enviado_em", "desistido_em"]
+
+
+def _os_values(o):
+    row = dict(o, checklist_json=json.dumps(o["checklist"], ensure_ascii=False))
+    return tuple(row[c] for c in OS_COLS)
+
+
+def fake_notificacao(rng, os_id, o, evento, anterior, quando: datetime, pendente: bool) -> tuple:
+    """Aviso da fila: enviado (quase todos), desistido ou ainda pendente (os mais novos)."""
+    dados = json.dumps({
+        "status_anterior": anterior,
+        "cliente_nome": o["cliente_nome"], "cliente_fone": o["cliente_fone"],
+        "cliente_email": o["cliente_email"], "codigo_consulta": o["codigo_consulta"],
+        "valor_orcado": o["valor_orcado"], "valor_pago": o["valor_pago"],
+    }, ensure_ascii=False)
+    quando = min(quando, datetime.now())  # o histórico das OS recentes passa de hoje
+    criado = _texto(quando)
+    if pendente:
+        if rng.random() < 0.3:
+            # já falhou uma vez, espera a próxima tentativa
+            proxima = _texto(quando + timedelta(minutes=rng.randint(1, 30)))
+            return (os_id, evento, dados, criado, proxima, 1, "timeout", None, None)
+        return (os_id, evento, dados, criado, criado, 0, None, None, None)
+    if rng.random() < 0.005:
+        desistido = _texto(quando + timedelta(hours=6))
+        return (os_id, evento, dados, criado, criado, 8, "número inválido", None, desistido)
+    enviado = _texto(quando + timedelta(seconds=rng.randint(1, 30)))
+    return (os_id, evento, dados, criado, criado, 1, None, enviado, None)
+
+
+def seed(conn, n_os=100000, hist_por_os=3, n_devedores=5000, rng=None, lote=1000, log=print):
+    rng = rng or random.Random(42)
+    cur = conn.cursor()
+    inicio = datetime.now() - timedelta(days=3 * 365)
+    passo = timedelta(days=3 * 365) / max(n_os, 1)
+
+    cur.execute("SELECT codigo_consulta FROM os WHERE codigo_consulta IS NOT NULL")
+    codigos = {r["codigo_consulta"] for r in cur.fetchall()}
+
+    feitas = 0
+    while feitas < n_os:
+        n = min(lote, n_os - feitas)
+        linhas = []
+        for i in range(feitas, feitas + n):
+            # OS antigas estão quase todas finalizadas; as abertas ficam no fim
+            recente = i >= n_os * 0.97
+            status = rng.choice(ABERTAS) if (recente and rng.random() < 0.8) else \
+                rng.choices(FINALIZADAS, weights=[9, 1])[0] if rng.random() < 0.97 else rng.choice(ABERTAS)
+            o = fake_os(rng, inicio + passo * i, status)
+            o["codigo_consulta"] = _codigo(rng, codigos)
+            linhas.append(o)
+
+        ids = _inserir(cur, "os", OS_COLS, [_os_values(o) for o in linhas], lote, retornar=True)
+
+        hist = []
+        notifs = []
+        for j, (o, r) in enumerate(zip(linhas, ids)):
+            quando = datetime.strptime(o["data_entrada"][:19], "%Y-%m-%d %H:%M:%S")
+            hist.append((r["id"], o["data_entrada"], "OS criada", "Entrada registrada no sistema.", 1,
+                         None, None, None))
+            # em média hist_por_os linhas, umas OS com mais andamento que outras
+            n_hist = max(1, hist_por_os + rng.randint(-1, 1)) if hist_por_os > 1 else hist_por_os
+            for k in range(1, n_hist):
+                quando += timedelta(hours=rng.randint(2, 72))
+                ultima = k == n_hist - 1
+                acao = ("Finalizado" if o["status"] == "fechada" else "Sem conserto"
+                        if o["status"] == "sem conserto" else rng.choice(ACOES)) if ultima else rng.choice(ACOES)
+                hist.append((r["id"], _texto(quando), acao, "", rng.choice([0, 1]),
+                             o["valor_orcado"], o["valor_pago"] if ultima else 0,
+                             o["data_pagamento"] if ultima else None))
+            # fila de avisos (NOTIFICAR_STATUS padrão): orçamento para aprovar
+            # em parte das OS e "pronta" nas fechadas; só as últimas pendentes
+            pendente = feitas + j >= n_os * 0.998
+            if o["status"] == "aguardando aprovação" or (o["status"] in FINALIZADAS and rng.random() < 0.5):
+                notifs.append(fake_notificacao(rng, r["id"], o, "aguardando aprovação", "aguardando orçamento",
+                                               quando, pendente and o["status"] == "aguardando aprovação"))
+            if o["status"] == "fechada":
+                notifs.append(fake_notificacao(rng, r["id"], o, "fechada", "em execução", quando, pendente))
+        _inserir(cur, "os_historico", HIST_COLS, hist, lote * max(hist_por_os, 1))
+        if notifs:
+            _inserir(cur, "notificacoes", NOTIF_COLS, notifs, lote)
+        conn.commit()
+        feitas += n
+        log(f"  os: {feitas}/{n_os}")
+
+    devs = []
+    for i in range(n_devedores):
+        quando = inicio + timedelta(days=rng.randint(0, 3 * 365), minutes=rng.randint(0, 1440))
+        pago = rng.random() < 0.6
+        devs.append((_texto(quando),
+                     f"{rng.choice(NOMES)} {rng.choice(SOBRENOMES)}",
+                     f"(11) 9{_digits(rng, 4)}-{_digits(rng, 4)}",
+                     f"OS #{rng.randint(1, max(n_os, 1)):04d}",
+                     rng.choice([50, 80, 120, 200, 350]), "",
+                     "pago" if pago else "em aberto",
+                     _texto(quando + timedelta(days=rng.randint(1, 60))) if pago else None))
+    if devs:
+        _inserir(cur, "devedores", DEV_COLS, devs, lote)
+    conn.commit()
+
+    cur.execute("""
+        INSERT INTO usuarios (usuario, senha, role) VALUES (%s, %s, 'user')
+        ON CONFLICT (usuario) DO NOTHING
+    """, (BENCH_USUARIO, BENCH_SENHA))
+    conn.commit()
+
+    # VACUUM e não só ANALYZE: marca as páginas como all-visible, senão o
+    # planner não usa index-only scan (devedores_resumo) num banco recém-populado,
+    # coisa que o autovacuum faria em produção
+    conn.autocommit = True
+    for tabela in ("os", "os_historico", "devedores", "notificacoes"):
+        cur.execute(f"ANALYZE {tabela}" if db.SQLITE else f"VACUUM (ANALYZE) {tabela}")
+    conn.autocommit = False
+    log(f"  devedores: {len(devs)}")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--os", type=int, default=100000, help="quantidade de OS")
+    ap.add_argument("--hist", type=int, default=3, help="linhas de histórico por OS (média)")
+    ap.add_argument("--devedores", type=int, default=5000)
+    ap.add_argument("--seed", type=int, default=42, help="semente do gerador (reprodutível)")
+    ap.add_argument("--append", action="store_true", help="somar a um banco que já tem OS")
+    args = ap.parse_args(argv)
+
+    migrations.migrate()
+    conn = db.connect()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT EXISTS (SELECT 1 FROM os) AS tem")
+        if cur.fetchone()["tem"] and not args.append:
+            print("ERRO: o banco já tem OS. Use um banco descartável ou --append.")
+            return 1
+        print(f"Gerando {args.os} OS, {args.hist} históricos/OS, {args.devedores} devedores...")
+        seed(conn, args.os, args.hist, args.devedores, random.Random(args.seed))
+    finally:
+        conn.close()
+    print("✅ Seed concluído.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
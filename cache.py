@@ -0,0 +1,112 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Cache em memória do processo, com validade (ttl) e limite de itens (LRU).
+
+    Cada worker do gunicorn tem o seu; por isso o ttl deve ser curto o
+    bastante para o que outro worker alterou aparecer logo.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < time.monotonic():
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class LRUCache:
+    """Cache em memória do processo, sem validade, limitado pelo tamanho total.
+
+    Para valores grandes e de tamanho variável (HTML renderizado): cabe o
+    quanto couber em `max_bytes`, e o menos usado recentemente sai primeiro.
+    Quem muda de conteúdo muda de chave (versão da OS, mtime do template),
+    então a entrada velha nunca é servida; descartar() só libera memória.
+    """
+
+    def __init__(self, max_bytes=16 * 1024 * 1024, tamanho=len):
+        self.max_bytes = max_bytes
+        self.tamanho = tamanho
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value):
+        n = self.tamanho(value)
+        if n > self.max_bytes:
+            return
+        with self._lock:
+            velho = self._data.pop(key, None)
+            if velho is not None:
+                self.bytes -= velho[0]
+            self._data[key] = (n, value)
+            self.bytes += n
+            while self.bytes > self.max_bytes:
+                _, (m, _) = self._data.popitem(last=False)
+                self.bytes -= m
+
+    def pop(self, key):
+        with self._lock:
+            item = self._data.pop(key, None)
+            if item is not None:
+                self.bytes -= item[0]
+
+    def descartar(self, pred):
+        """Remove as chaves em que pred(chave) é verdadeiro."""
+        with self._lock:
+            for key in [k for k in self._data if pred(k)]:
+                self.bytes -= self._data.pop(key)[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,314 @@
+import os
+import sqlite3
+import time
+import threading
+
+import psycopg2
+from psycopg2 import pool as pg_pool
+from psycopg2.extras import RealDictCursor
+
+from flask import g, current_app, has_request_context, request
+
+# =========================
+# CONFIG
+# =========================
+DATABASE_URL = (os.environ.get("DATABASE_URL") or "").strip()
+
+# DATABASE_URL=sqlite:///lck.db (ou sqlite:////caminho/absoluto.db): SQLite
+# local no lugar do Postgres, para loja com uma máquina só, testes e
+# benchmarks sem servidor. Ver db_sqlite.py.
+SQLITE = DATABASE_URL.startswith("sqlite:")
+
+# tamanho do pool por processo (cada worker do gunicorn tem o seu)
+DB_POOL_MIN = int(os.environ.get("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.environ.get("DB_POOL_MAX", "5"))
+# quanto tempo um request espera por uma conexão livre antes de desistir
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "10"))
+# espera acima disso (ms) vai pro log como aviso
+DB_POOL_WAIT_WARN_MS = float(os.environ.get("DB_POOL_WAIT_WARN_MS", "50"))
+
+# fuso das datas: as antigas, gravadas em texto com a hora local do servidor
+# (now_str(), UTC no Render), e o de exibição nas telas
+APP_TZ = os.environ.get("APP_TZ", "UTC").strip()
+
+# PREPARE/EXECUTE nas consultas quentes (queries.py). O endpoint "-pooler" do
+# Neon passa por pgbouncer em modo transação, onde PREPARE de SQL não
+# sobrevive entre transações: lá fica desligado, a não ser que DB_PREPARE=1.
+DB_PREPARE = os.environ.get("DB_PREPARE", "auto").strip().lower()
+if DB_PREPARE == "auto":
+    DB_PREPARE = "0" if "-pooler" in DATABASE_URL else "1"
+DB_PREPARE = DB_PREPARE in ("1", "true", "sim") and not SQLITE
+
+# erros de banco dos dois backends (quem trata erro sem se importar com qual é)
+ERROS_DB = (psycopg2.Error, sqlite3.Error)
+
+# comando acima disso (ms) num request é anotado como lento (lentas.py);
+# 0 desliga. No máximo DB_LENTAS_POR_REQUEST por request.
+DB_LENTA_MS = float(os.environ.get("DB_LENTA_MS", "250"))
+DB_LENTAS_POR_REQUEST = int(os.environ.get("DB_LENTAS_POR_REQUEST", "5"))
+
+
+class Connection(psycopg2.extensions.connection):
+    """Conexão que lembra quais prepared statements já criou na sessão
+    (nome -> SQL preparado).
+
+    Também soma quantos comandos rodou e o tempo gasto neles (CursorMedido);
+    get_db() zera no início de cada request.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = {}
+        self.comandos = 0
+        self.tempo_db = 0.0
+
+
+def medir(conn, t0, query, vars, explicavel=True):
+    """Soma a ida ao banco na conexão e anota no request se passou de DB_LENTA_MS."""
+    dur = time.perf_counter() - t0
+    conn.comandos += 1
+    conn.tempo_db += dur
+    if DB_LENTA_MS and dur * 1000 >= DB_LENTA_MS and has_request_context():
+        lentas = g.setdefault("db_lentas", [])
+        if len(lentas) < DB_LENTAS_POR_REQUEST:
+            lentas.append((query, vars, dur, explicavel))
+
+
+class CursorMedido(RealDictCursor):
+    """RealDictCursor que mede cada ida ao banco na conexão (métricas por rota).
+
+    Comando de request acima de DB_LENTA_MS fica anotado em g.db_lentas
+    (SQL, parâmetros, duração) para o lentas.py gravar no fim do request.
+    """
+
+    def execute(self, query, vars=None):
+        t0 = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            medir(self.connection, t0, query, vars)
+
+    def executemany(self, query, vars_list):
+        t0 = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            medir(self.connection, t0, query, None, explicavel=False)
+
+    def copy_expert(self, sql, file, size=8192):
+        t0 = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            medir(self.connection, t0, sql, None, explicavel=False)
+
+
+# =========================
+# Pool
+# =========================
+class Pool:
+    """ThreadedConnectionPool que espera por conexão livre em vez de estourar.
+
+    O pool do psycopg2 levanta PoolError quando todas as conexões estão em uso;
+    aqui um semáforo segura o request até alguém devolver (ou até o timeout) e
+    o tempo de espera fica registrado para dimensionar DB_POOL_MAX.
+    """
+
+    def __init__(self, dsn, minconn, maxconn):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self._pool = pg_pool.ThreadedConnectionPool(
+            minconn, maxconn, dsn, connection_factory=Connection, cursor_factory=CursorMedido
+        )
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+
+        self.checkouts = 0
+        self.in_use = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def getconn(self, timeout=DB_POOL_TIMEOUT):
+        t0 = time.perf_counter()
+        if not self._slots.acquire(timeout=timeout):
+            with self._lock:
+                self.timeouts += 1
+            raise pg_pool.PoolError(
+                f"Nenhuma conexão livre no pool após {timeout:.1f}s (DB_POOL_MAX={self.maxconn})."
+            )
+        waited = time.perf_counter() - t0
+
+        try:
+            conn = self._pool.getconn()
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self.wait_total += waited
+            if waited > self.wait_max:
+                self.wait_max = waited
+        return conn, waited
+
+    def putconn(self, conn, close=False):
+        try:
+            self._pool.putconn(conn, close=close)
+        finally:
+            with self._lock:
+                self.in_use -= 1
+            self._slots.release()
+
+    def closeall(self):
+        self._pool.closeall()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "min": self.minconn,
+                "max": self.maxconn,
+                "in_use": self.in_use,
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_total_ms": round(self.wait_total * 1000, 3),
+                "wait_avg_ms": round(self.wait_total * 1000 / self.checkouts, 3) if self.checkouts else 0.0,
+                "wait_max_ms": round(self.wait_max * 1000, 3),
+            }
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> Pool:
+    """Pool do processo atual, criado na primeira chamada.
+
+    Guardamos o pid junto: se o processo foi forkado depois de criar o pool
+    (gunicorn), o filho não pode reaproveitar os sockets do pai e cria o seu.
+    """
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is None or _pool_pid != pid:
+        with _pool_lock:
+            if _pool is None or _pool_pid != pid:
+                if not DATABASE_URL:
+                    raise RuntimeError("DATABASE_URL não configurada no Render.")
+                _pool = Pool(DATABASE_URL, DB_POOL_MIN, DB_POOL_MAX)
+                _pool_pid = pid
+    return _pool
+
+
+# pools herdados do processo pai: nunca fechados nem coletados no filho (o
+# PQfinish mandaria o Terminate pelo socket que ainda é do pai)
+_herdados = []
+
+
+def apos_fork():
+    """Estado de banco do worker recém-forkado (gunicorn post_fork).
+
+    Com preload_app o app é importado no master; o que ele tiver aberto fica
+    para trás, e o worker cria o próprio pool (get_pool), sem compartilhar
+    socket com ninguém.
+    """
+    global _pool, _pool_pid, _pool_lock
+    _pool_lock = threading.Lock()
+    if _pool is not None and _pool_pid != os.getpid():
+        _herdados.append(_pool)
+    _pool = None
+    _pool_pid = None
+
+
+def fechar_pool():
+    """Fecha o pool deste processo (master do gunicorn antes de forkar)."""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.closeall()
+        _pool = None
+        _pool_pid = None
+
+
+def connect(**kwargs):
+    """Conexão avulsa, fora do pool (migrações, scripts, workers de linha de comando)."""
+    if not DATABASE_URL:
+        raise RuntimeError("DATABASE_URL não configurada no Render.")
+    if SQLITE:
+        import db_sqlite
+        return db_sqlite.conectar(DATABASE_URL)
+    kwargs.setdefault("connection_factory", Connection)
+    kwargs.setdefault("cursor_factory", RealDictCursor)
+    return psycopg2.connect(DATABASE_URL, **kwargs)
+
+
+def pool_stats() -> dict:
+    if _pool is None or _pool_pid != os.getpid():
+        return {}
+    return _pool.stats()
+
+
+# =========================
+# Conexão por request
+# =========================
+def get_db():
+    """Conexão do request atual (a mesma em todas as chamadas do request).
+
+    Quem chama NÃO fecha: a conexão volta pro pool no teardown do app.
+    """
+    if "db" not in g:
+        if SQLITE:
+            # SQLite: uma conexão por thread, aberta na primeira vez e reusada
+            import db_sqlite
+            conn, waited = db_sqlite.da_thread(DATABASE_URL), 0.0
+            # POST já começa com o lock de escrita (BEGIN IMMEDIATE): leitura
+            # seguida de escrita na mesma transação não esbarra em outro writer
+            conn.imediato = has_request_context() and request.method not in ("GET", "HEAD")
+        else:
+            conn, waited = get_pool().getconn()
+        conn.comandos = 0
+        conn.tempo_db = 0.0
+        g.db = conn
+        g.db_pool_wait = waited
+        # SQLite não tem pool: nada para esperar nem para reportar
+        if not SQLITE and waited * 1000 >= DB_POOL_WAIT_WARN_MS:
+            current_app.logger.warning(
+                "db pool: esperou %.1f ms por conexão (%s)", waited * 1000, get_pool().stats()
+            )
+    return g.db
+
+
+def close_db(exc=None):
+    conn = g.pop("db", None)
+    if conn is None:
+        return
+
+    if SQLITE:
+        # a conexão é da thread e continua aberta; só desfaz o que sobrou
+        conn.rollback()
+        return
+
+    # o que não foi commitado pela rota (erro no meio, abort...) é desfeito
+    # aqui; conexão quebrada não volta pro pool
+    discard = bool(conn.closed) or isinstance(exc, (psycopg2.OperationalError, psycopg2.InterfaceError))
+    if not discard:
+        try:
+            conn.rollback()
+        except psycopg2.Error:
+            discard = True
+    get_pool().putconn(conn, close=discard)
+
+
+def add_server_timing(response):
+    waited = g.get("db_pool_wait")
+    if waited is not None:
+        response.headers.add("Server-Timing", f"db-pool;dur={waited * 1000:.2f}")
+        conn = g.db
+        response.headers.add("Server-Timing", f'db;dur={conn.tempo_db * 1000:.2f};desc="{conn.comandos} comandos"')
+    return response
+
+
+def init_app(app):
+    app.teardown_appcontext(close_db)
+    app.after_request(add_server_timing)
@@ -0,0 +1,308 @@
+"""Backend SQLite: a mesma interface de conexão/cursor que o psycopg2 dá ao resto do código.
+
+Com DATABASE_URL=sqlite:///lck.db as rotas, o queries.py, os scripts e o
+notificador rodam num arquivo local, sem ida à rede por consulta. O que muda
+de um banco para o outro fica em três lugares:
+
+- aqui: parâmetros %(nome)s / %s viram :nome / ?, casts ::tipo somem, as
+  linhas voltam como dict e os tipos (timestamptz, date, jsonb) fazem o
+  caminho de ida e volta como no Postgres;
+- queries_sqlite.py: as consultas que não têm tradução direta (CTE com
+  INSERT/UPDATE, ANY(array), tsvector, jsonb @>, SKIP LOCKED...);
+- migrations_sqlite.py: o schema.
+
+Conexão: uma por thread (o gunicorn gthread reaproveita as threads), aberta
+na primeira vez e mantida, com WAL (leitores não esperam o writer),
+synchronous=NORMAL, cache e mmap maiores e busy_timeout para esperar o lock
+de escrita em vez de falhar. Transação como no psycopg2: começa no primeiro
+comando e vai até commit/rollback; BEGIN IMMEDIATE quando o comando escreve
+(ou a conexão está marcada como `imediato`, ver db.get_db).
+
+Datas: timestamptz é gravado como texto ISO em UTC com milissegundos
+("2026-02-15 13:05:00.000+00:00"), então comparar texto é comparar data.
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+
+from psycopg2.extras import Json
+
+import db
+
+# espera pelo lock de escrita antes de desistir com "database is locked"
+DB_SQLITE_BUSY_MS = int(os.environ.get("DB_SQLITE_BUSY_MS", "5000"))
+# cache de páginas por conexão e quanto do arquivo mapear em memória
+DB_SQLITE_CACHE_MB = int(os.environ.get("DB_SQLITE_CACHE_MB", "32"))
+DB_SQLITE_MMAP_MB = int(os.environ.get("DB_SQLITE_MMAP_MB", "256"))
+
+
+def caminho(url) -> str:
+    """sqlite:///lck.db -> lck.db; sqlite:////var/lck/lck.db -> /var/lck/lck.db."""
+    resto = url[len("sqlite:"):]
+    return resto[3:] if resto.startswith("///") else resto
+
+
+# =========================
+# Tipos
+# =========================
+def _texto_data(v) -> str:
+    """datetime com fuso -> UTC com milissegundos; sem fuso fica como está (timestamp)."""
+    if isinstance(v, datetime):
+        if v.tzinfo is not None:
+            return v.astimezone(timezone.utc).isoformat(sep=" ", timespec="milliseconds")
+        return v.isoformat(sep=" ")
+    return v.isoformat()
+
+
+def _json_padrao(v):
+    if isinstance(v, (datetime, date)):
+        return _texto_data(v)
+    if isinstance(v, Decimal):
+        return float(v)
+    raise TypeError(f"{type(v).__name__} não vai para JSON")
+
+
+def _json(v) -> str:
+    return json.dumps(v, ensure_ascii=False, default=_json_padrao)
+
+
+def _timestamptz(b):
+    v = datetime.fromisoformat(b.decode())
+    return v if v.tzinfo else v.replace(tzinfo=timezone.utc)
+
+
+sqlite3.register_adapter(datetime, _texto_data)
+sqlite3.register_adapter(date, _texto_data)
+sqlite3.register_adapter(Decimal, float)
+sqlite3.register_adapter(Json, lambda j: _json(j.adapted))
+# listas (ids de ANY) e dicts vão como JSON: json_each() no SQL
+sqlite3.register_adapter(list, _json)
+sqlite3.register_adapter(tuple, _json)
+sqlite3.register_adapter(dict, _json)
+
+sqlite3.register_converter("TIMESTAMPTZ", _timestamptz)
+sqlite3.register_converter("TIMESTAMP", lambda b: datetime.fromisoformat(b.decode()))
+sqlite3.register_converter("DATE", lambda b: date.fromisoformat(b.decode()[:10]))
+sqlite3.register_converter("JSONB", lambda b: json.loads(b))
+
+
+# =========================
+# Funções SQL que o Postgres tem e o SQLite não
+# =========================
+def agora_texto() -> str:
+    return datetime.now(timezone.utc).isoformat(sep=" ", timespec="milliseconds")
+
+
+def _sem_acento(t) -> str:
+    t = unicodedata.normalize("NFKD", (t or "").lower())
+    return "".join(c for c in t if not unicodedata.combining(c))
+
+
+def _sufixos(t) -> str:
+    d = re.sub(r"\D", "", t or "")
+    return " ".join(d[i:] for i in range(len(d) - 3))
+
+
+def os_busca_doc(nome, fone, cpf, tipo, equipamento, checklist) -> str:
+    """Texto indexado na os_busca (FTS5): o mesmo que o os_busca_doc do Postgres."""
+    try:
+        ck = json.loads(checklist) if checklist else {}
+    except ValueError:
+        ck = {}
+    if not isinstance(ck, dict):
+        ck = {}
+    return " ".join([
+        _sem_acento(" ".join(filter(None, (nome, tipo, equipamento)))),
+        _sufixos(fone), _sufixos(cpf),
+        _sufixos(ck.get("ck_cel_imei1")), _sufixos(ck.get("ck_cel_imei2")),
+    ])
+
+
+def date_trunc(unidade, valor, fuso):
+    """date_trunc(unidade, valor AT TIME ZONE fuso): início do período, hora local sem fuso."""
+    if valor is None:
+        return None
+    dt = datetime.fromisoformat(valor)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    dt = dt.astimezone(ZoneInfo(fuso)).replace(tzinfo=None, hour=0, minute=0, second=0, microsecond=0)
+    if unidade == "week":
+        dt -= timedelta(days=dt.weekday())
+    elif unidade == "month":
+        dt = dt.replace(day=1)
+    return dt.isoformat(sep=" ")
+
+
+# =========================
+# Conexão e cursor
+# =========================
+_PARAM_NOME = re.compile(r"%\((\w+)\)s")
+_CAST = re.compile(r"::\w+(?:\[\])?")
+_ESCRITA = re.compile(r"\s*(INSERT|UPDATE|DELETE|REPLACE|CREATE|DROP|ALTER)\b", re.I)
+
+
+@lru_cache(maxsize=1024)
+def traduzir(sql, nomeado):
+    """SQL no formato do psycopg2 -> SQLite (nomeado: parâmetros em dict)."""
+    sql = _CAST.sub("", sql)
+    if nomeado is None:
+        return sql  # sem parâmetros: o psycopg2 não mexe nos %
+    sql = _PARAM_NOME.sub(r":\1", sql) if nomeado else sql.replace("%s", "?")
+    return sql.replace("%%", "%")
+
+
+class Cursor:
+    """Cursor com a interface do RealDictCursor (medido, como o db.CursorMedido)."""
+
+    def __init__(self, conn, medido=True):
+        self.connection = conn
+        self._cur = conn.raw.cursor()
+        self.medido = medido
+        self.itersize = 1000
+
+    @staticmethod
+    def _params(vars):
+        if vars is None:
+            return None, ()
+        return isinstance(vars, dict), vars
+
+    def _linha(self, r):
+        return None if r is None else dict(zip((d[0] for d in self._cur.description), r))
+
+    def execute(self, query, vars=None):
+        t0 = time.perf_counter()
+        try:
+            nomeado, params = self._params(vars)
+            sql = traduzir(query, nomeado)
+            self.connection._comecar(sql)
+            self._cur.execute(sql, params)
+            return self
+        finally:
+            if self.medido:
+                db.medir(self.connection, t0, query, vars)
+
+    def executemany(self, query, vars_list):
+        t0 = time.perf_counter()
+        try:
+            vars_list = list(vars_list)
+            if not vars_list:
+                return self
+            nomeado, _ = self._params(vars_list[0])
+            sql = traduzir(query, nomeado)
+            self.connection._comecar(sql)
+            self._cur.executemany(sql, vars_list)
+            return self
+        finally:
+            if self.medido:
+                db.medir(self.connection, t0, query, None, explicavel=False)
+
+    def fetchone(self):
+        return self._linha(self._cur.fetchone())
+
+    def fetchmany(self, size=None):
+        return [self._linha(r) for r in self._cur.fetchmany(size or self.itersize)]
+
+    def fetchall(self):
+        return [self._linha(r) for r in self._cur.fetchall()]
+
+    def __iter__(self):
+        while True:
+            lote = self.fetchmany()
+            if not lote:
+                return
+            yield from lote
+
+    @property
+    def rowcount(self):
+        return self._cur.rowcount
+
+    def close(self):
+        self._cur.close()
+
+
+class Conexao:
+    """sqlite3 com a cara de uma conexão psycopg2 (db.Connection)."""
+
+    def __init__(self, arquivo):
+        self.raw = sqlite3.connect(
+            arquivo,
+            detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES,
+            isolation_level=None,  # BEGIN/COMMIT por nossa conta, como o psycopg2
+            check_same_thread=False,
+            timeout=DB_SQLITE_BUSY_MS / 1000,
+            cached_statements=256,
+        )
+        for pragma in (
+            "journal_mode = WAL",
+            "synchronous = NORMAL",
+            f"busy_timeout = {DB_SQLITE_BUSY_MS}",
+            f"cache_size = -{DB_SQLITE_CACHE_MB * 1024}",
+            f"mmap_size = {DB_SQLITE_MMAP_MB * 1024 * 1024}",
+            "temp_store = MEMORY",
+        ):
+            self.raw.execute(f"PRAGMA {pragma}")
+        # as triggers da os chamam os_busca_doc: toda conexão que escreve
+        # precisa delas registradas
+        self.raw.create_function("now", 0, agora_texto)
+        self.raw.create_function("os_busca_doc", 6, os_busca_doc, deterministic=True)
+        self.raw.create_function("busca_normaliza", 1, _sem_acento, deterministic=True)
+        self.raw.create_function("date_trunc", 3, date_trunc, deterministic=True)
+
+        self.pid = os.getpid()
+        self.prepared = {}
+        self.comandos = 0
+        self.tempo_db = 0.0
+        self.autocommit = False
+        self.imediato = False
+
+    @property
+    def closed(self):
+        return 0 if self.raw is not None else 1
+
+    def _comecar(self, sql):
+        if not self.autocommit and not self.raw.in_transaction:
+            escrita = self.imediato or _ESCRITA.match(sql)
+            self.raw.execute("BEGIN IMMEDIATE" if escrita else "BEGIN")
+
+    def cursor(self, name=None, cursor_factory=None):
+        # cursor_factory explícito (lentas.py) = cursor que não entra na medição
+        return Cursor(self, medido=cursor_factory is None)
+
+    def commit(self):
+        if self.raw.in_transaction:
+            self.raw.execute("COMMIT")
+
+    def rollback(self):
+        if self.raw.in_transaction:
+            self.raw.execute("ROLLBACK")
+
+    def close(self):
+        if self.raw is not None:
+            self.raw.close()
+            self.raw = None
+
+
+def conectar(url) -> Conexao:
+    return Conexao(caminho(url))
+
+
+_local = threading.local()
+
+
+def da_thread(url) -> Conexao:
+    """Conexão desta thread, aberta na primeira chamada.
+
+    Processo forkado (gunicorn) não usa a conexão herdada do pai: abre a sua.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None or conn.pid != os.getpid() or conn.closed:
+        conn = _local.conn = conectar(url)
+    return conn
@@ -0,0 +1,133 @@
+"""Exportação das OS com histórico, em CSV ou JSON Lines, sem carregar tudo na memória.
+
+A leitura é queries.os_exportar (cursor nomeado, em lotes); aqui só viram
+texto, em pedaços de ~64 KB, para a rota /exportar (resposta em streaming)
+ou para a linha de comando:
+
+    python exportar.py --formato csv [--de 2026-01-01] [--ate 2026-06-30] [-o os.csv]
+
+No CSV cada linha do histórico é uma linha, com os campos da OS repetidos
+(OS sem histórico sai numa linha com os campos hist_* vazios). No JSONL cada
+linha é uma OS com a lista "historico".
+"""
+import argparse
+import csv
+import io
+import json
+import sys
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from zoneinfo import ZoneInfo
+
+import db
+import queries
+
+FORMATOS = {"csv": "text/csv", "jsonl": "application/x-ndjson"}
+
+COLUNAS_OS = [
+    "id", "data_entrada", "status",
+    "cliente_nome", "cliente_fone", "cliente_cpf", "cliente_endereco", "cliente_email",
+    "tipo", "equipamento", "checklist_json", "relato_cliente", "diagnostico_tecnico",
+    "valor_orcado", "valor_pago", "data_pagamento", "data_pagamento_texto", "codigo_consulta",
+]
+COLUNAS_HIST = [
+    "id", "data", "acao", "obs", "visivel_cliente",
+    "valor_orcado", "valor_pago", "data_pagamento", "data_pagamento_texto",
+]
+
+# tamanho de cada pedaço entregue ao cliente/arquivo
+PEDACO = 64 * 1024
+
+
+def _json_valor(v):
+    if isinstance(v, (datetime, date)):
+        return v.isoformat()
+    if isinstance(v, Decimal):
+        return float(v)
+    raise TypeError(f"{type(v).__name__} não serializável")
+
+
+def _csv_valor(v):
+    if v is None:
+        return ""
+    if isinstance(v, (datetime, date)):
+        return v.isoformat()
+    if isinstance(v, (dict, list)):
+        return json.dumps(v, ensure_ascii=False)
+    return v
+
+
+def _em_pedacos(linhas):
+    """Junta as linhas de texto em pedaços de ~PEDACO caracteres."""
+    buf, tam = [], 0
+    for linha in linhas:
+        buf.append(linha)
+        tam += len(linha)
+        if tam >= PEDACO:
+            yield "".join(buf)
+            buf, tam = [], 0
+    if buf:
+        yield "".join(buf)
+
+
+def _linhas_jsonl(rows):
+    for r in rows:
+        yield json.dumps(r, ensure_ascii=False, default=_json_valor) + "\n"
+
+
+def _linhas_csv(rows):
+    out = io.StringIO()
+    w = csv.writer(out)
+
+    def tira():
+        texto = out.getvalue()
+        out.seek(0)
+        out.truncate()
+        return texto
+
+    w.writerow(COLUNAS_OS + ["hist_" + c for c in COLUNAS_HIST])
+    yield tira()
+    vazio = [""] * len(COLUNAS_HIST)
+    for r in rows:
+        base = [_csv_valor(r[c]) for c in COLUNAS_OS]
+        for h in r["historico"] or [None]:
+            w.writerow(base + ([_csv_valor(h[c]) for c in COLUNAS_HIST] if h else vazio))
+        yield tira()
+
+
+def gerar(conn, formato, de=None, ate=None):
+    """Texto da exportação em pedaços. Lê do banco conforme é consumido."""
+    rows = queries.os_exportar(conn, de, ate)
+    linhas = _linhas_csv(rows) if formato == "csv" else _linhas_jsonl(rows)
+    return _em_pedacos(linhas)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--formato", choices=sorted(FORMATOS), default="csv")
+    ap.add_argument("--de", help="data_entrada a partir de (AAAA-MM-DD, no APP_TZ)")
+    ap.add_argument("--ate", help="data_entrada até (AAAA-MM-DD, inclusive)")
+    ap.add_argument("-o", "--saida", help="arquivo de saída (padrão: stdout)")
+    args = ap.parse_args(argv)
+
+    tz = ZoneInfo(db.APP_TZ)
+    dia = lambda v: datetime.strptime(v, "%Y-%m-%d").replace(tzinfo=tz) if v else None
+    de, ate = dia(args.de), dia(args.ate)
+    if ate:
+        ate += timedelta(days=1)
+
+    conn = db.connect()
+    saida = open(args.saida, "w", encoding="utf-8", newline="") if args.saida else sys.stdout
+    try:
+        for pedaco in gerar(conn, args.formato, de, ate):
+            saida.write(pedaco)
+        conn.rollback()
+    finally:
+        if saida is not sys.stdout:
+            saida.close()
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,94 @@
+"""Perfil de produção do gunicorn (lido sozinho: `gunicorn app:app` na raiz).
+
+Workers gthread: cada worker é um processo com GUNICORN_THREADS threads e um
+pool de conexões do mesmo tamanho (db.py), então nenhuma thread espera por
+conexão. O número de workers sai dos CPUs, limitado pelo orçamento de
+conexões do banco:
+
+    workers * DB_POOL_MAX <= DB_CONEXOES_MAX
+
+DB_CONEXOES_MAX é o que o web pode usar do limite do Postgres/Neon (deixe
+folga para migrações, notificador.py e scripts). WEB_CONCURRENCY, se
+definido, manda no número de workers.
+
+preload_app: o app (e as migrações do boot) roda uma vez no master e os
+workers nascem por fork, já com tudo importado. Cada worker cria o próprio
+pool depois do fork (post_fork -> db.apos_fork); nada de socket do master
+vai para os filhos.
+"""
+import os
+
+
+def _cpus():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+CPUS = _cpus()
+DB_CONEXOES_MAX = int(os.environ.get("DB_CONEXOES_MAX", "20"))
+
+threads = int(os.environ.get("GUNICORN_THREADS", "4"))
+
+# uma conexão por thread, dentro do orçamento; o db.py lê DB_POOL_MAX ao ser
+# importado, o que com preload acontece depois deste arquivo
+_pool = min(int(os.environ.get("DB_POOL_MAX") or threads), DB_CONEXOES_MAX)
+os.environ["DB_POOL_MAX"] = str(_pool)
+
+if os.environ.get("WEB_CONCURRENCY"):
+    workers = int(os.environ["WEB_CONCURRENCY"])
+else:
+    workers = max(1, min(2 * CPUS + 1, DB_CONEXOES_MAX // _pool))
+
+worker_class = "gthread"
+preload_app = True
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '10000')}"
+
+# gthread: o timeout é o heartbeat do worker, não a duração do request
+# (exportação em streaming pode passar disso sem problema)
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "60"))
+graceful_timeout = 30
+keepalive = 5
+
+# recicla workers de tempos em tempos (com preload o fork é barato)
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", "2000"))
+max_requests_jitter = max_requests // 10
+
+# heartbeat em memória, não no disco do container
+if os.path.isdir("/dev/shm"):
+    worker_tmp_dir = "/dev/shm"
+
+errorlog = "-"
+loglevel = os.environ.get("GUNICORN_LOGLEVEL", "info")
+
+
+# =========================
+# Hooks
+# =========================
+def when_ready(server):
+    server.log.info(
+        "gunicorn: %d worker(s) gthread x %d thread(s), pool %d/worker (%d de %d conexões, %d CPU)",
+        workers, threads, _pool, workers * _pool, DB_CONEXOES_MAX, CPUS,
+    )
+
+
+def pre_fork(server, worker):
+    # o master não atende request; se algo abriu pool nele, fecha antes do fork
+    import db
+    db.fechar_pool()
+
+
+def post_fork(server, worker):
+    import db
+    db.apos_fork()
+
+
+def post_worker_init(worker):
+    # DB_AQUECER=1: abre as DB_POOL_MIN conexões antes do primeiro request
+    # (boot do worker mais lento, primeiro request mais rápido)
+    if os.environ.get("DB_AQUECER") == "1":
+        import db
+        if db.DATABASE_URL and not db.SQLITE:  # SQLite não tem pool
+            db.get_pool()
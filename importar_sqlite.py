@@ -0,0 +1,388 @@
+"""Importa o database.db (SQLite da versão antiga) para o Postgres.
+
+    python importar_sqlite.py [--sqlite database.db] [--lote 5000] [--deslocamento N]
+
+Cada tabela é lida do SQLite em lotes por id e carregada com COPY FROM STDIN
+numa tabela temporária; de lá um INSERT ... SELECT converte para o schema
+atual (datas em texto -> timestamptz/date com texto_para_timestamp, checklist
+-> jsonb, valores -> numeric). O INSERT passa pelas triggers da os, então a
+busca e os contadores do painel ficam certos.
+
+Cada lote é uma transação que grava também até que id já foi importado
+(tabela importacao_sqlite, migração 18): se cair no meio, rodar de novo
+continua do lote seguinte. No fim as sequências SERIAL são acertadas para
+depois do maior id.
+
+Mapeamento:
+- usuarios: pelo nome; quem já existe no Postgres (usuarios fixos) fica como está;
+- os, devedores: mesmos ids (+ --deslocamento);
+- ordens + clientes (schema do migrar_db.py): viram os, com ids depois das os
+  do próprio SQLite; marca/modelo viram "equipamento", IMEI e serial entram
+  no checklist, serviço realizado e observações no diagnóstico;
+- os_historico: nos dois formatos. autor/usuario e status_novo não têm
+  coluna no Postgres e vão para o fim do obs. Linha de OS que não foi
+  importada é ignorada.
+
+Se o Postgres já tem OS/histórico/devedores com os mesmos ids, a importação
+para antes de começar: use --deslocamento (ex.: o maior id atual).
+"""
+import argparse
+import io
+import json
+import os
+import sqlite3
+import sys
+from collections import namedtuple
+
+import db
+import migrations
+import queries
+
+DATABASE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "database.db")
+
+# migração que cria importacao_sqlite
+VERSAO_MINIMA = 18
+
+# tabelas temporárias (tudo em texto, convertido no INSERT ... SELECT);
+# ON COMMIT DELETE ROWS: cada lote começa com a tabela vazia
+STAGE = {
+    "imp_usuarios": ["id", "usuario", "senha", "role"],
+    "imp_os": [
+        "id", "data_entrada", "status",
+        "cliente_nome", "cliente_fone", "cliente_cpf", "cliente_endereco", "cliente_email",
+        "tipo", "equipamento", "checklist_json", "relato_cliente", "diagnostico_tecnico",
+        "valor_orcado", "valor_pago", "data_pagamento", "codigo_consulta",
+    ],
+    "imp_historico": [
+        "id", "os_id", "data", "acao", "obs", "visivel_cliente",
+        "valor_orcado", "valor_pago", "data_pagamento",
+    ],
+    "imp_devedores": [
+        "id", "criado_em", "cliente_nome", "cliente_fone", "referencia",
+        "valor", "obs", "status", "pago_em",
+    ],
+}
+
+
+def _num(col):
+    return f"nullif(btrim({col}), '')::numeric"
+
+
+def _inserts(cur):
+    """INSERT ... SELECT de cada tabela temporária para a tabela de verdade."""
+    data = lambda col: migrations._converte(cur, col, "timestamptz")
+    dia = lambda col: migrations._converte(cur, col, "date")
+    return {
+        "imp_usuarios": """
+            INSERT INTO usuarios (usuario, senha, role)
+            SELECT usuario, senha, coalesce(nullif(role, ''), 'user')
+            FROM imp_usuarios
+            ON CONFLICT (usuario) DO NOTHING
+        """,
+        "imp_os": f"""
+            INSERT INTO os (
+                id, data_entrada, status,
+                cliente_nome, cliente_fone, cliente_cpf, cliente_endereco, cliente_email,
+                tipo, equipamento, checklist_json, relato_cliente, diagnostico_tecnico,
+                valor_orcado, valor_pago, data_pagamento, data_pagamento_texto, codigo_consulta
+            )
+            SELECT id::bigint + %(desloc)s, {data("data_entrada")}, coalesce(nullif(status, ''), 'aberta'),
+                   cliente_nome, cliente_fone, cliente_cpf, cliente_endereco, cliente_email,
+                   tipo, equipamento, texto_para_jsonb(checklist_json), relato_cliente, diagnostico_tecnico,
+                   coalesce({_num("valor_orcado")}, 0), coalesce({_num("valor_pago")}, 0),
+                   {dia("data_pagamento")}, data_pagamento, nullif(codigo_consulta, '')
+            FROM imp_os
+            ON CONFLICT DO NOTHING
+        """,
+        "imp_historico": f"""
+            INSERT INTO os_historico (
+                id, os_id, data, acao, obs, visivel_cliente,
+                valor_orcado, valor_pago, data_pagamento, data_pagamento_texto
+            )
+            SELECT h.id::bigint + %(desloc)s, h.os_id::bigint + %(desloc)s, {data("h.data")},
+                   h.acao, h.obs, coalesce(nullif(h.visivel_cliente, '')::int, 1),
+                   {_num("h.valor_orcado")}, {_num("h.valor_pago")},
+                   {dia("h.data_pagamento")}, h.data_pagamento
+            FROM imp_historico h
+            WHERE EXISTS (SELECT 1 FROM os WHERE os.id = h.os_id::bigint + %(desloc)s)
+            ON CONFLICT DO NOTHING
+        """,
+        "imp_devedores": f"""
+            INSERT INTO devedores (id, criado_em, cliente_nome, cliente_fone, referencia, valor, obs, status, pago_em)
+            SELECT id::bigint + %(desloc)s, {data("criado_em")}, cliente_nome, cliente_fone, referencia,
+                   coalesce({_num("valor")}, 0), obs, coalesce(nullif(status, ''), 'em aberto'), {data("pago_em")}
+            FROM imp_devedores
+            ON CONFLICT DO NOTHING
+        """,
+    }
+
+
+# =========================
+# Leitura do SQLite
+# =========================
+# tabela no SQLite, tabela temporária, SELECT (paginado por id na leitura),
+# linha do SQLite -> tupla na ordem de STAGE, e quanto o id da linha é
+# deslocado antes do --deslocamento (ordens vão para depois das os)
+Fonte = namedtuple("Fonte", "tabela stage select linha desloc_id", defaults=(0,))
+
+
+def _colunas(sq, tabela):
+    return {r["name"] for r in sq.execute(f"PRAGMA table_info({tabela})")}
+
+
+def _tabelas(sq):
+    return {r["name"] for r in sq.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+
+def _select(sq, tabela, colunas, alias=None):
+    """Lista de colunas para o SELECT; a que o banco antigo não tem vem NULL."""
+    existentes = _colunas(sq, tabela)
+    pref = f"{alias}." if alias else ""
+    return ", ".join(
+        f"{pref}{c}" if c in existentes else f"NULL AS {c}" for c in colunas
+    )
+
+
+def _obs_com_autor(obs, autor=None, status_novo=None):
+    extras = "; ".join(x for x in (
+        f"por {autor}" if autor else None,
+        f"status: {status_novo}" if status_novo else None,
+    ) if x)
+    if not extras:
+        return obs
+    return f"{obs} ({extras})" if obs else extras
+
+
+def _ordem_para_os(r, desloc_ordens):
+    """Uma linha de ordens (+ clientes) no formato de imp_os."""
+    checklist = r["equipamento_dados_json"]
+    extras = {k: v for k, v in (("ck_cel_imei1", r["imei"]), ("serial", r["serial"])) if v}
+    if extras:
+        try:
+            dados = json.loads(checklist) if checklist else {}
+        except ValueError:
+            dados = None
+        if isinstance(dados, dict):
+            for k, v in extras.items():
+                dados.setdefault(k, v)
+            checklist = json.dumps(dados, ensure_ascii=False)
+
+    status = r["status"]
+    if not status and r["encerrada"]:
+        status = "fechada"
+
+    diagnostico = "\n".join(
+        f"{rotulo}{r[c]}" for c, rotulo in (
+            ("diagnostico_tecnico", ""), ("servico_realizado", "Serviço realizado: "),
+            ("observacoes", "Observações: "),
+        ) if r[c]
+    )
+    equipamento = " ".join(x for x in (r["equip_marca"], r["equip_modelo"]) if x)
+
+    return (
+        r["id"] + desloc_ordens, r["criado_em"], status,
+        r["nome"], r["telefone"], r["cpf"], r["endereco"], r["email"],
+        r["equipamento_tipo"], equipamento, checklist,
+        r["relato_cliente"] or r["defeito"], diagnostico,
+        r["valor_orcado"], r["valor_pago"], r["data_pagamento"], r["codigo_cliente"],
+    )
+
+
+def fontes(sq):
+    """Fontes presentes no SQLite, na ordem de importação.
+
+    A ordem importa: o histórico só entra para OS que já estão no Postgres.
+    """
+    tabelas = _tabelas(sq)
+    out = []
+
+    if "usuarios" in tabelas:
+        out.append(Fonte("usuarios", "imp_usuarios",
+                         f"SELECT {_select(sq, 'usuarios', STAGE['imp_usuarios'])} FROM usuarios",
+                         tuple))
+
+    desloc_ordens = 0
+    if "os" in tabelas:
+        out.append(Fonte("os", "imp_os",
+                         f"SELECT {_select(sq, 'os', STAGE['imp_os'])} FROM os",
+                         tuple))
+        desloc_ordens = sq.execute("SELECT coalesce(max(id), 0) FROM os").fetchone()[0]
+
+    if "ordens" in tabelas:
+        cols = _select(sq, "ordens", [
+            "id", "criado_em", "status", "encerrada", "equipamento_tipo", "equip_marca",
+            "equip_modelo", "imei", "serial", "equipamento_dados_json", "relato_cliente",
+            "defeito", "diagnostico_tecnico", "servico_realizado", "observacoes",
+            "valor_orcado", "valor_pago", "data_pagamento", "codigo_cliente", "cliente_id",
+        ], alias="o")
+        if "clientes" in tabelas:
+            clientes = _select(sq, "clientes", ["nome", "telefone", "cpf", "endereco", "email"], alias="c")
+            join = "LEFT JOIN clientes c ON c.id = o.cliente_id"
+        else:
+            clientes = "NULL AS nome, NULL AS telefone, NULL AS cpf, NULL AS endereco, NULL AS email"
+            join = ""
+        out.append(Fonte("ordens", "imp_os",
+                         f"SELECT {cols}, {clientes} FROM ordens o {join}",
+                         lambda r: _ordem_para_os(r, desloc_ordens), desloc_ordens))
+
+    if "os_historico" in tabelas:
+        existentes = _colunas(sq, "os_historico")
+        if "data_hora" in existentes:
+            # formato do migrar_db.py: histórico das ordens
+            out.append(Fonte("os_historico", "imp_historico", """
+                SELECT id, os_id, data_hora, usuario, evento, descricao, ocultar_cliente
+                FROM os_historico
+            """, lambda r: (
+                r["id"], r["os_id"] + desloc_ordens, r["data_hora"], r["evento"],
+                _obs_com_autor(r["descricao"], r["usuario"]),
+                0 if r["ocultar_cliente"] else 1, None, None, None,
+            )))
+        else:
+            cols = _select(sq, "os_historico", STAGE["imp_historico"] + ["autor", "status_novo"])
+            out.append(Fonte("os_historico", "imp_historico",
+                             f"SELECT {cols} FROM os_historico",
+                             lambda r: (
+                                 r["id"], r["os_id"], r["data"], r["acao"],
+                                 _obs_com_autor(r["obs"], r["autor"], r["status_novo"]),
+                                 r["visivel_cliente"], r["valor_orcado"], r["valor_pago"], r["data_pagamento"],
+                             )))
+
+    if "devedores" in tabelas:
+        out.append(Fonte("devedores", "imp_devedores",
+                         f"SELECT {_select(sq, 'devedores', STAGE['imp_devedores'])} FROM devedores",
+                         tuple))
+    return out
+
+
+# =========================
+# Carga no Postgres
+# =========================
+def _copy_texto(v):
+    """Valor no formato text do COPY (\\N é NULL)."""
+    if v is None:
+        return r"\N"
+    return (str(v).replace("\\", "\\\\").replace("\t", "\\t")
+            .replace("\n", "\\n").replace("\r", "\\r"))
+
+
+def _copy(cur, stage, linhas):
+    buf = io.StringIO()
+    for linha in linhas:
+        buf.write("\t".join(_copy_texto(v) for v in linha))
+        buf.write("\n")
+    buf.seek(0)
+    cur.copy_expert(f"COPY {stage} ({', '.join(STAGE[stage])}) FROM STDIN", buf)
+
+
+def _marca(cur, tabela):
+    cur.execute("SELECT ultimo_id FROM importacao_sqlite WHERE tabela = %s", (tabela,))
+    r = cur.fetchone()
+    return r["ultimo_id"] if r else 0
+
+
+def _checa_colisao(cur, sq, tabela, destino, desde, desloc):
+    """Para se o Postgres já tem linhas com os ids que ainda vão ser importados."""
+    lo, hi = sq.execute(f"SELECT min(id), max(id) FROM {tabela} WHERE id > ?", (desde,)).fetchone()
+    if lo is None:
+        return
+    cur.execute(f"SELECT count(*) AS n FROM {destino} WHERE id BETWEEN %s AND %s",
+                (lo + desloc, hi + desloc))
+    r = cur.fetchone()
+    if r["n"]:
+        cur.execute(f"SELECT max(id) AS m FROM {destino}")
+        raise SystemExit(
+            f"ERRO: {destino} no Postgres já tem {r['n']} linha(s) com ids de {tabela} "
+            f"({lo + desloc}..{hi + desloc}). Rode de novo com --deslocamento {cur.fetchone()['m']}."
+        )
+
+
+# tabela de destino de cada temporária (para colisão de ids e sequências)
+DESTINO = {"imp_usuarios": "usuarios", "imp_os": "os", "imp_historico": "os_historico", "imp_devedores": "devedores"}
+
+
+def importar(sq, conn, lote=5000, desloc=0, log=print):
+    """Importa tudo o que ainda não foi importado. Devolve {tabela: linhas inseridas}."""
+    cur = conn.cursor()
+    for stage, cols in STAGE.items():
+        tipos = ", ".join(f"{c} {'bigint' if c in ('id', 'os_id') else 'text'}" for c in cols)
+        cur.execute(f"CREATE TEMP TABLE IF NOT EXISTS {stage} ({tipos}) ON COMMIT DELETE ROWS")
+    inserts = _inserts(cur)
+    conn.commit()
+
+    lista = fontes(sq)
+    for f in lista:
+        if f.stage != "imp_usuarios":  # usuarios entram pelo nome, sem id
+            _checa_colisao(cur, sq, f.tabela, DESTINO[f.stage], _marca(cur, f.tabela), desloc + f.desloc_id)
+    conn.rollback()
+
+    total = {}
+    for tabela, stage, select, linha, _ in lista:
+        ultimo = _marca(cur, tabela)
+        conn.rollback()
+        inseridas = lidas = 0
+        while True:
+            rows = sq.execute(
+                f"SELECT * FROM ({select}) WHERE id > ? ORDER BY id LIMIT ?", (ultimo, lote)
+            ).fetchall()
+            if not rows:
+                break
+            _copy(cur, stage, (linha(r) for r in rows))
+            cur.execute(inserts[stage], {"desloc": desloc})
+            inseridas += cur.rowcount
+            lidas += len(rows)
+            ultimo = rows[-1]["id"]
+            cur.execute("""
+                INSERT INTO importacao_sqlite (tabela, ultimo_id) VALUES (%s, %s)
+                ON CONFLICT (tabela) DO UPDATE SET ultimo_id = EXCLUDED.ultimo_id, atualizado_em = now()
+            """, (tabela, ultimo))
+            conn.commit()
+        if lidas:
+            log(f"[importação] {tabela}: {inseridas} de {lidas} linha(s) inserida(s) em {DESTINO[stage]}")
+        total[tabela] = inseridas
+
+    # próximos ids do app depois dos importados
+    for destino in DESTINO.values():
+        cur.execute(f"""
+            SELECT setval(pg_get_serial_sequence('{destino}', 'id'), coalesce(max(id), 0) + 1, false)
+            FROM {destino}
+        """)
+    # pagamentos antigos mudam períodos já fechados do relatório de receita
+    if total.get("os_historico"):
+        queries.receita_cache_limpar(cur)
+    # estatísticas do planner depois de uma carga grande
+    for destino in DESTINO.values():
+        cur.execute(f"ANALYZE {destino}")
+    conn.commit()
+    return total
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--sqlite", default=DATABASE, help="arquivo SQLite (padrão: database.db ao lado do app)")
+    ap.add_argument("--lote", type=int, default=5000, help="linhas por COPY/commit")
+    ap.add_argument("--deslocamento", type=int, default=0,
+                    help="soma aos ids de os, os_historico e devedores (Postgres que já tem dados)")
+    args = ap.parse_args(argv)
+
+    if not os.path.exists(args.sqlite):
+        print(f"ERRO: {args.sqlite} não existe.")
+        return 1
+
+    sq = sqlite3.connect(args.sqlite)
+    sq.row_factory = sqlite3.Row
+    conn = db.connect()
+    try:
+        if VERSAO_MINIMA not in migrations.applied_versions(conn):
+            print("ERRO: schema desatualizado. Rode antes: python migrations.py")
+            return 1
+        conn.rollback()
+        total = importar(sq, conn, args.lote, args.deslocamento)
+    finally:
+        conn.close()
+        sq.close()
+    print(f"✅ Importação concluída ({sum(total.values())} linha(s) nova(s)).")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,161 @@
+"""Registro de consultas lentas, para achar qual SQL pesa numa página lenta.
+
+O db.CursorMedido anota no request todo comando acima de DB_LENTA_MS. No
+fim do request (teardown, na mesma conexão, já fora da transação da rota)
+cada um vira uma linha em consultas_lentas com:
+
+- o SQL normalizado (literais viram ?, espaços colapsados; um EXECUTE de
+  prepared statement volta a ser o SQL que foi preparado);
+- a forma dos parâmetros (nomes e tipos, nunca os valores: tem CPF e
+  telefone de cliente ali);
+- o endpoint e a duração.
+
+A tabela guarda no máximo DB_LENTAS_MAX linhas; /admin/consultas-lentas
+lista as piores, agrupadas pelo SQL.
+
+DB_LENTA_EXPLAIN=1 grava também o plano: EXPLAIN (ANALYZE, BUFFERS) para
+SELECT (roda a consulta de novo, com statement_timeout, e desfaz) e EXPLAIN
+simples para escrita, que não pode rodar duas vezes (no SQLite, EXPLAIN
+QUERY PLAN para os dois). O mesmo SQL só ganha plano novo a cada
+DB_LENTA_EXPLAIN_INTERVALO_S por processo, para o diagnóstico não dobrar a
+carga justo quando o banco já está sofrendo.
+
+Só quem já foi lento paga: um INSERT a mais no fim do request (e o EXPLAIN,
+se ligado).
+"""
+import hashlib
+import os
+import re
+import threading
+import time
+
+import psycopg2
+from flask import current_app, g, request
+from psycopg2.extras import RealDictCursor
+
+import db
+import queries
+from metricas import SEM_ROTA
+
+DB_LENTAS_MAX = int(os.environ.get("DB_LENTAS_MAX", "2000"))
+DB_LENTA_EXPLAIN = os.environ.get("DB_LENTA_EXPLAIN", "0").strip().lower() in ("1", "true", "sim")
+DB_LENTA_EXPLAIN_INTERVALO_S = float(os.environ.get("DB_LENTA_EXPLAIN_INTERVALO_S", "300"))
+
+_EXECUTE = re.compile(r"\s*EXECUTE\s+(q_\w+)", re.I)
+_LITERAL = re.compile(r"'(?:[^']|'')*'|(?<![\w$])\d+(?:\.\d+)?\b")
+_ESPACOS = re.compile(r"\s+")
+_ESCRITA = re.compile(r"\b(INSERT|UPDATE|DELETE|MERGE|FOR\s+(NO\s+KEY\s+)?UPDATE|FOR\s+(KEY\s+)?SHARE)\b", re.I)
+
+# sql_hash -> último EXPLAIN neste processo
+_explicados = {}
+_explicados_lock = threading.Lock()
+
+
+def texto_sql(conn, query) -> str:
+    """O SQL como foi escrito (EXECUTE q_... vira o texto do PREPARE)."""
+    if isinstance(query, bytes):
+        query = query.decode("utf-8", "replace")
+    elif not isinstance(query, str):
+        query = query.as_string(conn)  # psycopg2.sql.Composed
+    m = _EXECUTE.match(query)
+    if m and m.group(1) in conn.prepared:
+        return conn.prepared[m.group(1)]
+    return query
+
+
+def normalizar(sql) -> str:
+    return _ESPACOS.sub(" ", _LITERAL.sub("?", sql)).strip()
+
+
+def _tipo(v) -> str:
+    if v is None:
+        return "null"
+    if isinstance(v, (list, tuple)):
+        return f"{type(v).__name__}[{len(v)}]"
+    return type(v).__name__
+
+
+def forma(params) -> str:
+    """Nomes e tipos dos parâmetros, sem os valores."""
+    if not params:
+        return ""
+    if isinstance(params, dict):
+        return ", ".join(f"{k}: {_tipo(v)}" for k, v in params.items())
+    return ", ".join(_tipo(v) for v in params)
+
+
+def _pode_explicar(sql_hash) -> bool:
+    agora = time.monotonic()
+    with _explicados_lock:
+        ultimo = _explicados.get(sql_hash)
+        if ultimo is not None and agora - ultimo < DB_LENTA_EXPLAIN_INTERVALO_S:
+            return False
+        _explicados[sql_hash] = agora
+        return True
+
+
+def explicar(cur, query, params, normal, dur) -> str:
+    """Plano do comando; ANALYZE só para leitura. Sempre desfeito no fim."""
+    conn = cur.connection
+    analyze = not _ESCRITA.search(normal)
+    try:
+        if db.SQLITE:
+            # SQLite: só o plano escolhido, sem rodar de novo
+            cur.execute("EXPLAIN QUERY PLAN " + query, params)
+            return "\n".join(r["detail"] for r in cur.fetchall())
+        if analyze:
+            # a consulta roda de novo: no máximo 3x o que levou da primeira vez
+            cur.execute("SET LOCAL statement_timeout = %s", (int(max(dur * 3, 1.0) * 1000),))
+        cur.execute(("EXPLAIN (ANALYZE, BUFFERS) " if analyze else "EXPLAIN ") + query, params)
+        return "\n".join(next(iter(r.values())) for r in cur.fetchall())
+    except db.ERROS_DB as e:
+        return f"(EXPLAIN falhou: {getattr(e, 'pgerror', None) or e})".strip()
+    finally:
+        conn.rollback()
+
+
+def gravar(conn, anotadas, endpoint):
+    """Grava as lentas do request. Erro aqui não derruba o request."""
+    # cursor comum: o que roda aqui não é medido nem anotado de novo
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        conn.rollback()  # o que a rota não comitou o teardown desfaria de qualquer jeito
+        linhas = []
+        for query, params, dur, explicavel in anotadas:
+            sql = texto_sql(conn, query)
+            normal = normalizar(sql)
+            sql_hash = hashlib.sha1(normal.encode("utf-8")).hexdigest()[:16]
+            plano = None
+            if DB_LENTA_EXPLAIN and explicavel and _pode_explicar(sql_hash):
+                plano = explicar(cur, query, params, normal, dur)
+            linhas.append({
+                "sql_hash": sql_hash, "sql": normal, "parametros": forma(params),
+                "endpoint": endpoint, "duracao_ms": round(dur * 1000, 3), "plano": plano,
+            })
+        queries.consultas_lentas_gravar(cur, linhas, DB_LENTAS_MAX)
+        conn.commit()
+    except db.ERROS_DB as e:
+        try:
+            conn.rollback()
+        except db.ERROS_DB:
+            pass  # conexão quebrada: o db.close_db descarta
+        current_app.logger.warning("consultas lentas: não gravou (%s)", e)
+    finally:
+        cur.close()
+
+
+def _fim(exc=None):
+    anotadas = g.pop("db_lentas", None)
+    conn = g.get("db")
+    if not anotadas or conn is None or conn.closed:
+        return
+    if isinstance(exc, (psycopg2.OperationalError, psycopg2.InterfaceError)):
+        return
+    gravar(conn, anotadas, request.endpoint or SEM_ROTA)
+
+
+def init_app(app):
+    # teardown_request roda antes do teardown_appcontext que devolve a
+    # conexão ao pool (db.close_db)
+    if db.DB_LENTA_MS:
+        app.teardown_request(_fim)
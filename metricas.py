@@ -0,0 +1,130 @@
+"""Tempo por rota e tempo de banco, em histogramas no formato do Prometheus.
+
+Cada request soma, no endpoint Flask que atendeu (painel, os_detalhe,
+consultar_post...): a duração total, o tempo gasto no banco e quantos
+comandos rodou (medidos pelo db.CursorMedido). /metrics devolve o texto
+para o Prometheus.
+
+Os contadores ficam numa memória compartilhada (RawArray) criada no import
+do app. Com preload_app (gunicorn.conf.py) isso acontece no master, e todos
+os workers forkados somam no mesmo lugar: /metrics mostra o total do
+servidor, seja qual for o worker que respondeu. Sem preload cada processo
+tem os seus.
+
+Custo por request: dois perf_counter e umas somas sob um lock de processo.
+"""
+import bisect
+import multiprocessing
+import time
+
+from flask import g, request
+
+# limites dos buckets, em segundos (os mesmos para request e banco)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# endpoint de quem não casou com rota nenhuma (404, 405)
+SEM_ROTA = "sem_rota"
+
+# por endpoint: [buckets do request (+Inf), soma] [buckets do banco (+Inf), soma] comandos erros
+_NB = len(BUCKETS) + 1
+_REQ, _DB = 0, _NB + 1
+_COMANDOS = 2 * (_NB + 1)
+_ERROS = _COMANDOS + 1
+_TAM = _ERROS + 1
+
+
+class Metricas:
+    def __init__(self, endpoints):
+        self.endpoints = sorted(set(endpoints) | {SEM_ROTA})
+        self._pos = {e: i * _TAM for i, e in enumerate(self.endpoints)}
+        self._dados = multiprocessing.RawArray("d", len(self.endpoints) * _TAM)
+        self._lock = multiprocessing.Lock()
+
+    def registrar(self, endpoint, duracao, tempo_db=0.0, comandos=0, erro=False):
+        base = self._pos.get(endpoint, self._pos[SEM_ROTA])
+        b_req = bisect.bisect_left(BUCKETS, duracao)
+        b_db = bisect.bisect_left(BUCKETS, tempo_db)
+        d = self._dados
+        with self._lock:
+            d[base + _REQ + b_req] += 1
+            d[base + _REQ + _NB] += duracao
+            d[base + _DB + b_db] += 1
+            d[base + _DB + _NB] += tempo_db
+            d[base + _COMANDOS] += comandos
+            if erro:
+                d[base + _ERROS] += 1
+
+    def _copia(self):
+        with self._lock:
+            return self._dados[:]
+
+    def texto(self) -> str:
+        """Exposição no formato texto do Prometheus (0.0.4)."""
+        d = self._copia()
+        linhas = []
+
+        def histograma(nome, ajuda, off):
+            linhas.append(f"# HELP {nome} {ajuda}")
+            linhas.append(f"# TYPE {nome} histogram")
+            for e in self.endpoints:
+                base = self._pos[e] + off
+                if not any(d[base:base + _NB]):
+                    continue
+                acum = 0
+                for le, n in zip(BUCKETS + ("+Inf",), d[base:base + _NB]):
+                    acum += n
+                    linhas.append(f'{nome}_bucket{{endpoint="{e}",le="{le}"}} {acum:.0f}')
+                linhas.append(f'{nome}_sum{{endpoint="{e}"}} {d[base + _NB]:.6f}')
+                linhas.append(f'{nome}_count{{endpoint="{e}"}} {acum:.0f}')
+
+        def contador(nome, ajuda, off):
+            linhas.append(f"# HELP {nome} {ajuda}")
+            linhas.append(f"# TYPE {nome} counter")
+            for e in self.endpoints:
+                base = self._pos[e]
+                if any(d[base + _REQ:base + _REQ + _NB]):
+                    linhas.append(f'{nome}{{endpoint="{e}"}} {d[base + off]:.0f}')
+
+        histograma("lck_http_request_duration_seconds", "Duração do request, por endpoint.", _REQ)
+        histograma("lck_db_time_seconds", "Tempo no banco por request, por endpoint.", _DB)
+        contador("lck_db_queries_total", "Comandos SQL executados, por endpoint.", _COMANDOS)
+        contador("lck_http_errors_total", "Respostas 5xx ou exceções, por endpoint.", _ERROS)
+        return "\n".join(linhas) + "\n"
+
+
+def _inicio():
+    g.metricas_t0 = time.perf_counter()
+
+
+def _fim(metricas):
+    def fim(exc=None):
+        t0 = g.pop("metricas_t0", None)
+        if t0 is None:
+            return
+        conn = g.get("db")
+        status = g.pop("metricas_status", 500)
+        metricas.registrar(
+            request.endpoint or SEM_ROTA,
+            time.perf_counter() - t0,
+            conn.tempo_db if conn is not None else 0.0,
+            conn.comandos if conn is not None else 0,
+            erro=exc is not None or status >= 500,
+        )
+    return fim
+
+
+def _status(response):
+    g.metricas_status = response.status_code
+    return response
+
+
+def init_app(app):
+    """Liga as medições. Chamar depois de registrar todas as rotas."""
+    metricas = Metricas(app.view_functions)
+    app.before_request(_inicio)
+    app.after_request(_status)
+    # teardown_request roda antes do teardown_appcontext que devolve a
+    # conexão ao pool, e depois do fim de uma resposta em streaming
+    app.teardown_request(_fim(metricas))
+    app.extensions["metricas"] = metricas
+    return metricas
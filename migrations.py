@@ -0,0 +1,707 @@
+"""Migrações do schema Postgres (o SQLite tem as suas: migrations_sqlite.py).
+
+Cada migração tem um número; as aplicadas ficam em schema_version. Um
+advisory lock garante que só um processo migra por vez (vários workers do
+gunicorn subindo juntos, deploy + worker...). Os outros esperam o lock e
+depois encontram tudo aplicado.
+
+Uso no deploy:  python migrations.py
+"""
+import os
+import sys
+import time
+from collections import namedtuple
+
+import db
+
+# chave fixa do pg_advisory_lock (qualquer bigint; só precisa ser sempre a mesma)
+LOCK_ID = 7_305_512_001
+
+# backfills: linhas por lote e pausa entre lotes (dar fôlego ao banco em produção)
+MIGRACAO_LOTE = int(os.environ.get("MIGRACAO_LOTE", "5000"))
+MIGRACAO_PAUSA_MS = float(os.environ.get("MIGRACAO_PAUSA_MS", "0"))
+
+# transacional=False para DDL que não roda dentro de transação
+# (ex.: CREATE INDEX CONCURRENTLY); sql pode ser texto ou função(cur)
+Migration = namedtuple("Migration", "version nome sql transacional", defaults=(True,))
+
+
+# usuários fixos: a migração 2 cria, e o migrate() reaplica em todo boot
+# (sync_usuarios_fixos), como fazia o ensure_tables(); mudar senha ou role
+# aqui vale no próximo deploy, sem migração nova
+def _usuarios_fixos(cur):
+    def upsert_user(usuario, senha, role):
+        cur.execute("""
+            INSERT INTO usuarios (usuario, senha, role)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (usuario)
+            DO UPDATE SET senha = EXCLUDED.senha, role = EXCLUDED.role;
+        """, (usuario, senha, role))
+
+    upsert_user("Lucas", "0904", "admin")
+    upsert_user("Carol", "2858", "admin")
+    upsert_user("Natan", "0000", "user")
+    upsert_user("Tiago", "1234", "user")
+
+
+def _indices(*ddls):
+    """Cria índices com CONCURRENTLY (não trava escrita na os em produção).
+
+    Um CREATE INDEX CONCURRENTLY que falha deixa o índice INVALID para trás;
+    nesse caso ele é removido antes de tentar de novo.
+    """
+    def run(cur):
+        for nome, ddl in ddls:
+            cur.execute("""
+                SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+                WHERE c.relname = %s AND NOT i.indisvalid
+            """, (nome,))
+            if cur.fetchone():
+                cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {nome}")
+            cur.execute(ddl)
+    return run
+
+
+# busca de OS: nome/equipamento sem acento + dígitos de telefone, CPF e IMEI.
+# Os dígitos entram com todos os sufixos (>= 4 dígitos) no tsvector, então a
+# busca por prefixo ('1234':*) acha qualquer trecho do número, inclusive o
+# final do telefone. Só recursos nativos do Postgres (sem pg_trgm/unaccent).
+_BUSCA_FUNCOES = """
+CREATE OR REPLACE FUNCTION busca_normaliza(t text) RETURNS text
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT translate(lower(coalesce(t, '')),
+                     'áàâãäéèêëíìîïóòôõöúùûüç', 'aaaaaeeeeiiiiooooouuuuc')
+$$;
+
+CREATE OR REPLACE FUNCTION busca_sufixos(t text) RETURNS text
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT string_agg(substr(d, i), ' ')
+    FROM (SELECT regexp_replace(coalesce(t, ''), '\\D', '', 'g') AS d) s,
+         generate_series(1, length(d) - 3) AS i
+$$;
+
+-- checklist_json é texto; JSON quebrado não pode impedir o INSERT da OS
+CREATE OR REPLACE FUNCTION busca_json_campo(t text, campo text) RETURNS text
+LANGUAGE plpgsql IMMUTABLE AS $$
+BEGIN
+    RETURN t::jsonb ->> campo;
+EXCEPTION WHEN others THEN
+    RETURN NULL;
+END
+$$;
+
+CREATE OR REPLACE FUNCTION os_busca_doc(
+    nome text, fone text, cpf text, tipo text, equipamento text, checklist text
+) RETURNS tsvector
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT to_tsvector('simple', busca_normaliza(concat_ws(' ', nome, tipo, equipamento)))
+        || to_tsvector('simple', concat_ws(' ',
+               busca_sufixos(fone),
+               busca_sufixos(cpf),
+               busca_sufixos(busca_json_campo(checklist, 'ck_cel_imei1')),
+               busca_sufixos(busca_json_campo(checklist, 'ck_cel_imei2'))))
+$$;
+
+CREATE OR REPLACE FUNCTION os_busca_atualiza() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    NEW.busca := os_busca_doc(NEW.cliente_nome, NEW.cliente_fone, NEW.cliente_cpf,
+                              NEW.tipo, NEW.equipamento, NEW.checklist_json);
+    RETURN NEW;
+END
+$$;
+"""
+
+
+def _em_lotes(tabela, update, lote=None):
+    """Backfill em lotes por faixa de id, para rodar com transacional=False.
+
+    `update` é o UPDATE com "{faixa}" no WHERE; em autocommit cada lote é um
+    commit, então nenhuma transação longa segura lock nas linhas da tabela.
+    """
+    def run(cur):
+        n = lote or MIGRACAO_LOTE
+        cur.execute(f"SELECT coalesce(max(id), 0) AS m FROM {tabela}")
+        maximo = cur.fetchone()["m"]
+        for inicio in range(0, maximo, n):
+            cur.execute(update.format(faixa="id > %s AND id <= %s"), (inicio, inicio + n))
+            if MIGRACAO_PAUSA_MS:
+                time.sleep(MIGRACAO_PAUSA_MS / 1000)
+    return run
+
+
+def _busca_indice(cur):
+    _em_lotes("os", """
+        UPDATE os
+        SET busca = os_busca_doc(cliente_nome, cliente_fone, cliente_cpf, tipo, equipamento, checklist_json)
+        WHERE {faixa} AND busca IS NULL
+    """)(cur)
+    _indices(
+        ("os_busca_idx", "CREATE INDEX CONCURRENTLY IF NOT EXISTS os_busca_idx ON os USING gin (busca)"),
+    )(cur)
+
+
+def _checklist_jsonb(cur):
+    _em_lotes("os", """
+        UPDATE os SET checklist = texto_para_jsonb(checklist_json)
+        WHERE {faixa} AND checklist IS NULL AND checklist_json IS NOT NULL
+    """)(cur)
+
+
+# colunas de data gravadas como TEXT (now_str(), "15/02/2026" digitado...) e o
+# tipo de verdade de cada uma. A troca é feita em etapas, sem reescrever as
+# tabelas de uma vez: coluna "_novo" mantida por trigger, backfill em lotes e
+# depois a troca de nomes.
+_DATAS = {
+    "os": [("data_entrada", "timestamptz"), ("data_pagamento", "date")],
+    "os_historico": [("data", "timestamptz"), ("data_pagamento", "date")],
+    "devedores": [("criado_em", "timestamptz"), ("pago_em", "timestamptz")],
+}
+
+# aceita o formato do now_str() (AAAA-MM-DD HH:MM:SS) e o que as pessoas
+# digitam (DD/MM/AAAA, DD/MM/AA, com / . ou -); o resto vira NULL
+_TEXTO_PARA_TIMESTAMP = r"""
+CREATE OR REPLACE FUNCTION texto_para_timestamp(t text) RETURNS timestamp
+LANGUAGE plpgsql IMMUTABLE AS $$
+DECLARE
+    v text := btrim(coalesce(t, ''));
+BEGIN
+    IF v ~ '^\d{4}-\d{1,2}-\d{1,2}([ T]\d{1,2}:\d{2}(:\d{2}(\.\d+)?)?)?$' THEN
+        RETURN v::timestamp;
+    ELSIF v ~ '^\d{1,2}[/.-]\d{1,2}[/.-]\d{4}$' THEN
+        RETURN to_date(translate(v, '.-', '//'), 'DD/MM/YYYY');
+    ELSIF v ~ '^\d{1,2}[/.-]\d{1,2}[/.-]\d{2}$' THEN
+        RETURN to_date(translate(v, '.-', '//'), 'DD/MM/YY');
+    ELSIF v ~ '^\d{1,2}/\d{1,2}/\d{4}\s+\d{1,2}:\d{2}(:\d{2})?$' THEN
+        RETURN to_timestamp(v, 'DD/MM/YYYY HH24:MI:SS')::timestamp;
+    END IF;
+    RETURN NULL;
+EXCEPTION WHEN others THEN
+    -- data impossível (31/02, mês 13...)
+    RETURN NULL;
+END
+$$;
+"""
+
+
+def _converte(cur, expr, tipo):
+    """SQL que converte o texto `expr` para `tipo`.
+
+    O texto antigo é hora local do servidor (now_str()), sem fuso: vale o
+    APP_TZ. Um date não tem fuso.
+    """
+    if tipo == "date":
+        return f"texto_para_timestamp({expr})::date"
+    return cur.mogrify(f"texto_para_timestamp({expr}) AT TIME ZONE %s", (db.APP_TZ,)).decode()
+
+
+def _datas_colunas(cur):
+    cur.execute(_TEXTO_PARA_TIMESTAMP)
+    for tabela, colunas in _DATAS.items():
+        for col, tipo in colunas:
+            cur.execute(f"ALTER TABLE {tabela} ADD COLUMN IF NOT EXISTS {col}_novo {tipo}")
+        sets = "\n".join(
+            f"    NEW.{col}_novo := {_converte(cur, 'NEW.' + col, tipo)};" for col, tipo in colunas
+        )
+        cur.execute(f"""
+            CREATE OR REPLACE FUNCTION {tabela}_datas_sincroniza() RETURNS trigger
+            LANGUAGE plpgsql AS $$
+            BEGIN
+            {sets}
+                RETURN NEW;
+            END
+            $$;
+
+            DROP TRIGGER IF EXISTS {tabela}_datas_sincroniza ON {tabela};
+            CREATE TRIGGER {tabela}_datas_sincroniza
+                BEFORE INSERT OR UPDATE OF {", ".join(c for c, _ in colunas)}
+                ON {tabela} FOR EACH ROW EXECUTE FUNCTION {tabela}_datas_sincroniza();
+        """)
+
+
+def _datas_backfill(cur):
+    for tabela, colunas in _DATAS.items():
+        sets = ", ".join(f"{col}_novo = {_converte(cur, col, tipo)}" for col, tipo in colunas)
+        _em_lotes(tabela, f"UPDATE {tabela} SET {sets} WHERE {{faixa}}")(cur)
+
+
+def _datas_troca(cur):
+    for tabela, colunas in _DATAS.items():
+        cur.execute(f"""
+            DROP TRIGGER {tabela}_datas_sincroniza ON {tabela};
+            DROP FUNCTION {tabela}_datas_sincroniza();
+        """)
+        for col, tipo in colunas:
+            if col == "data_pagamento":
+                # digitado à mão: o texto original fica guardado (linhas antigas)
+                cur.execute(f"ALTER TABLE {tabela} RENAME COLUMN {col} TO {col}_texto")
+            else:
+                cur.execute(f"ALTER TABLE {tabela} DROP COLUMN {col}")
+            cur.execute(f"ALTER TABLE {tabela} RENAME COLUMN {col}_novo TO {col}")
+
+
+MIGRATIONS = [
+    # IF NOT EXISTS: bancos que já rodavam o ensure_tables() antigo adotam
+    # a numeração sem recriar nada
+    Migration(1, "tabelas iniciais", """
+    CREATE TABLE IF NOT EXISTS usuarios (
+        id SERIAL PRIMARY KEY,
+        usuario TEXT UNIQUE NOT NULL,
+        senha TEXT NOT NULL,
+        role TEXT DEFAULT 'user'
+    );
+
+    CREATE TABLE IF NOT EXISTS os (
+        id SERIAL PRIMARY KEY,
+        data_entrada TEXT,
+        status TEXT DEFAULT 'aberta',
+
+        cliente_nome TEXT,
+        cliente_fone TEXT,
+        cliente_cpf TEXT,
+        cliente_endereco TEXT,
+        cliente_email TEXT,
+
+        tipo TEXT,
+        equipamento TEXT,
+
+        checklist_json TEXT,
+        relato_cliente TEXT,
+        diagnostico_tecnico TEXT,
+
+        valor_orcado NUMERIC DEFAULT 0,
+        valor_pago NUMERIC DEFAULT 0,
+        data_pagamento TEXT,
+
+        codigo_consulta TEXT
+    );
+
+    CREATE TABLE IF NOT EXISTS os_historico (
+        id SERIAL PRIMARY KEY,
+        os_id INTEGER NOT NULL,
+        data TEXT,
+        acao TEXT,
+        obs TEXT,
+        visivel_cliente INTEGER DEFAULT 1,
+
+        valor_orcado NUMERIC DEFAULT NULL,
+        valor_pago NUMERIC DEFAULT NULL,
+        data_pagamento TEXT DEFAULT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS devedores (
+        id SERIAL PRIMARY KEY,
+        criado_em TEXT,
+        cliente_nome TEXT,
+        cliente_fone TEXT,
+        referencia TEXT,
+        valor NUMERIC DEFAULT 0,
+        obs TEXT,
+        status TEXT DEFAULT 'em aberto',
+        pago_em TEXT
+    );
+    """),
+
+    Migration(2, "usuarios fixos", _usuarios_fixos),
+
+    Migration(3, "indices das consultas quentes", _indices(
+        # painel: status IN (abertas) ORDER BY id DESC LIMIT 80
+        ("os_abertas_id_idx", """
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS os_abertas_id_idx ON os (id DESC)
+            WHERE status IN ('aberta','aguardando orçamento','aguardando aprovação','em execução')
+        """),
+        # listas por status (finalizadas etc.)
+        ("os_status_id_idx", """
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS os_status_id_idx ON os (status, id DESC)
+        """),
+        # consulta pública e gen_codigo_consulta
+        ("os_codigo_consulta_key", """
+            CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS os_codigo_consulta_key ON os (codigo_consulta)
+        """),
+        # histórico de uma OS (detalhe, impressão, consulta)
+        ("os_historico_os_id_idx", """
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS os_historico_os_id_idx ON os_historico (os_id, id DESC)
+        """),
+        ("devedores_status_id_idx", """
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS devedores_status_id_idx ON devedores (status, id DESC)
+        """),
+        # ordem da lista de devedores: em aberto primeiro, mais novos antes
+        ("devedores_abertos_primeiro_idx", """
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS devedores_abertos_primeiro_idx
+            ON devedores ((status <> 'em aberto'), id DESC)
+        """),
+    ), transacional=False),
+
+    Migration(4, "coluna de busca da os", _BUSCA_FUNCOES + """
+    ALTER TABLE os ADD COLUMN IF NOT EXISTS busca tsvector;
+
+    DROP TRIGGER IF EXISTS os_busca ON os;
+    CREATE TRIGGER os_busca
+        BEFORE INSERT OR UPDATE OF cliente_nome, cliente_fone, cliente_cpf, tipo, equipamento, checklist_json
+        ON os FOR EACH ROW EXECUTE FUNCTION os_busca_atualiza();
+    """),
+
+    Migration(5, "indice de busca da os", _busca_indice, transacional=False),
+
+    # checklist_json TEXT -> JSONB sem reescrever a tabela de uma vez: coluna
+    # nova mantida pela trigger enquanto o backfill roda em lotes, depois troca
+    Migration(6, "checklist jsonb: coluna nova", """
+    -- checklist que não é JSON válido vira NULL em vez de travar a migração
+    CREATE OR REPLACE FUNCTION texto_para_jsonb(t text) RETURNS jsonb
+    LANGUAGE plpgsql IMMUTABLE AS $$
+    BEGIN
+        RETURN t::jsonb;
+    EXCEPTION WHEN others THEN
+        RETURN NULL;
+    END
+    $$;
+
+    ALTER TABLE os ADD COLUMN IF NOT EXISTS checklist jsonb;
+
+    CREATE OR REPLACE FUNCTION os_checklist_sincroniza() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+        NEW.checklist := texto_para_jsonb(NEW.checklist_json);
+        RETURN NEW;
+    END
+    $$;
+
+    DROP TRIGGER IF EXISTS os_checklist_sincroniza ON os;
+    CREATE TRIGGER os_checklist_sincroniza
+        BEFORE INSERT OR UPDATE OF checklist_json
+        ON os FOR EACH ROW EXECUTE FUNCTION os_checklist_sincroniza();
+    """),
+
+    Migration(7, "checklist jsonb: backfill", _checklist_jsonb, transacional=False),
+
+    Migration(8, "checklist jsonb: troca de coluna", """
+    DROP TRIGGER os_checklist_sincroniza ON os;
+    DROP FUNCTION os_checklist_sincroniza();
+
+    -- o que escapou do backfill (normalmente nada)
+    UPDATE os SET checklist = texto_para_jsonb(checklist_json)
+    WHERE checklist IS NULL AND checklist_json IS NOT NULL;
+
+    DROP TRIGGER os_busca ON os;
+    ALTER TABLE os DROP COLUMN checklist_json;
+    ALTER TABLE os RENAME COLUMN checklist TO checklist_json;
+
+    DROP FUNCTION os_busca_doc(text, text, text, text, text, text);
+    DROP FUNCTION busca_json_campo(text, text);
+
+    CREATE FUNCTION os_busca_doc(
+        nome text, fone text, cpf text, tipo text, equipamento text, checklist jsonb
+    ) RETURNS tsvector
+    LANGUAGE sql IMMUTABLE AS $$
+        SELECT to_tsvector('simple', busca_normaliza(concat_ws(' ', nome, tipo, equipamento)))
+            || to_tsvector('simple', concat_ws(' ',
+                   busca_sufixos(fone),
+                   busca_sufixos(cpf),
+                   busca_sufixos(checklist ->> 'ck_cel_imei1'),
+                   busca_sufixos(checklist ->> 'ck_cel_imei2')))
+    $$;
+
+    CREATE TRIGGER os_busca
+        BEFORE INSERT OR UPDATE OF cliente_nome, cliente_fone, cliente_cpf, tipo, equipamento, checklist_json
+        ON os FOR EACH ROW EXECUTE FUNCTION os_busca_atualiza();
+    """),
+
+    # jsonb_ops (e não jsonb_path_ops) para servir também o "?" (chave existe)
+    Migration(9, "indice do checklist", _indices(
+        ("os_checklist_idx", "CREATE INDEX CONCURRENTLY IF NOT EXISTS os_checklist_idx ON os USING gin (checklist_json)"),
+    ), transacional=False),
+
+    # contadores do painel: uma linha por status, mantida pelas triggers de
+    # comando (uma atualização por status por comando, não por linha da os)
+    Migration(10, "resumo por status", """
+    CREATE TABLE IF NOT EXISTS os_resumo (
+        status TEXT PRIMARY KEY,
+        qtd BIGINT NOT NULL DEFAULT 0,
+        valor_orcado NUMERIC NOT NULL DEFAULT 0,
+        valor_pago NUMERIC NOT NULL DEFAULT 0
+    );
+
+    CREATE OR REPLACE FUNCTION os_resumo_aplica() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    DECLARE
+        partes text[] := '{}';
+        d record;
+    BEGIN
+        -- velhas só existe no UPDATE/DELETE e novas no INSERT/UPDATE: o SQL
+        -- é montado só com as que o comando tem
+        IF TG_OP <> 'INSERT' THEN
+            partes := array_append(partes, 'SELECT status, -1 AS qtd, -coalesce(valor_orcado, 0) AS vo,
+                                        -coalesce(valor_pago, 0) AS vp FROM velhas');
+        END IF;
+        IF TG_OP <> 'DELETE' THEN
+            partes := array_append(partes, 'SELECT status, 1 AS qtd, coalesce(valor_orcado, 0) AS vo,
+                                        coalesce(valor_pago, 0) AS vp FROM novas');
+        END IF;
+
+        -- ORDER BY: comandos concorrentes travam as linhas do resumo sempre
+        -- na mesma ordem (sem deadlock)
+        FOR d IN EXECUTE format($q$
+            SELECT coalesce(status, '') AS status, sum(qtd) AS qtd, sum(vo) AS vo, sum(vp) AS vp
+            FROM (%s) delta
+            GROUP BY 1
+            HAVING sum(qtd) <> 0 OR sum(vo) <> 0 OR sum(vp) <> 0
+            ORDER BY 1
+        $q$, array_to_string(partes, ' UNION ALL '))
+        LOOP
+            INSERT INTO os_resumo AS r (status, qtd, valor_orcado, valor_pago)
+            VALUES (d.status, d.qtd, d.vo, d.vp)
+            ON CONFLICT (status) DO UPDATE SET
+                qtd = r.qtd + EXCLUDED.qtd,
+                valor_orcado = r.valor_orcado + EXCLUDED.valor_orcado,
+                valor_pago = r.valor_pago + EXCLUDED.valor_pago;
+        END LOOP;
+        RETURN NULL;
+    END
+    $$;
+
+    -- segura escrita na os enquanto cria as triggers e conta o que já existe
+    LOCK TABLE os IN SHARE ROW EXCLUSIVE MODE;
+
+    DROP TRIGGER IF EXISTS os_resumo_ins ON os;
+    DROP TRIGGER IF EXISTS os_resumo_upd ON os;
+    DROP TRIGGER IF EXISTS os_resumo_del ON os;
+    CREATE TRIGGER os_resumo_ins AFTER INSERT ON os
+        REFERENCING NEW TABLE AS novas
+        FOR EACH STATEMENT EXECUTE FUNCTION os_resumo_aplica();
+    CREATE TRIGGER os_resumo_upd AFTER UPDATE ON os
+        REFERENCING OLD TABLE AS velhas NEW TABLE AS novas
+        FOR EACH STATEMENT EXECUTE FUNCTION os_resumo_aplica();
+    CREATE TRIGGER os_resumo_del AFTER DELETE ON os
+        REFERENCING OLD TABLE AS velhas
+        FOR EACH STATEMENT EXECUTE FUNCTION os_resumo_aplica();
+
+    DELETE FROM os_resumo;
+    INSERT INTO os_resumo (status, qtd, valor_orcado, valor_pago)
+    SELECT coalesce(status, ''), count(*), coalesce(sum(valor_orcado), 0), coalesce(sum(valor_pago), 0)
+    FROM os
+    GROUP BY 1;
+    """),
+
+    # totais e aging dos devedores: index-only scan, sem ler a tabela
+    Migration(11, "indice do resumo de devedores", _indices(
+        ("devedores_status_criado_idx", """
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS devedores_status_criado_idx
+            ON devedores (status, criado_em) INCLUDE (valor)
+        """),
+    ), transacional=False),
+
+    Migration(12, "datas: colunas novas", _datas_colunas),
+    Migration(13, "datas: backfill", _datas_backfill, transacional=False),
+    Migration(14, "datas: troca de colunas", _datas_troca),
+
+    # a troca derruba o índice que usava criado_em em texto
+    Migration(15, "indices de data", _indices(
+        ("devedores_status_criado_idx", """
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS devedores_status_criado_idx
+            ON devedores (status, criado_em) INCLUDE (valor)
+        """),
+        # filtro "entrada de/até" das finalizadas
+        ("os_data_entrada_idx", """
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS os_data_entrada_idx ON os (data_entrada)
+        """),
+    ), transacional=False),
+
+    # relatório de receita: períodos fechados não mudam, ficam guardados aqui
+    # (compartilhado entre os workers; apagar histórico limpa tudo)
+    Migration(16, "cache do relatorio de receita", """
+    CREATE TABLE IF NOT EXISTS receita_cache (
+        granularidade TEXT NOT NULL,
+        fuso TEXT NOT NULL,
+        inicio TIMESTAMP NOT NULL,
+        linhas JSONB NOT NULL,
+        calculado_em TIMESTAMPTZ NOT NULL DEFAULT now(),
+        PRIMARY KEY (granularidade, fuso, inicio)
+    );
+    """),
+
+    # snapshots de pagamento por data (as OS com pagamento no período)
+    Migration(17, "indice de pagamentos do historico", _indices(
+        ("os_historico_pagamentos_idx", """
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS os_historico_pagamentos_idx
+            ON os_historico (data) INCLUDE (os_id) WHERE valor_pago IS NOT NULL
+        """),
+    ), transacional=False),
+
+    # importar_sqlite.py: até que id de cada tabela do database.db já foi
+    # carregado (a importação continua de onde parou)
+    Migration(18, "marcas da importacao do sqlite", """
+    CREATE TABLE IF NOT EXISTS importacao_sqlite (
+        tabela TEXT PRIMARY KEY,
+        ultimo_id BIGINT NOT NULL,
+        atualizado_em TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+    """),
+
+    # ETag das telas da OS: toda escrita na OS (ou no histórico dela) soma 1;
+    # default não volátil, então o ADD COLUMN não reescreve a tabela
+    Migration(19, "versao da os", """
+    ALTER TABLE os
+        ADD COLUMN IF NOT EXISTS versao BIGINT NOT NULL DEFAULT 1,
+        ADD COLUMN IF NOT EXISTS atualizado_em TIMESTAMPTZ NOT NULL DEFAULT now();
+    """),
+
+    # outbox dos avisos ao cliente: gravado junto com a mudança de status
+    # (os_registrar_atualizacao), enviado pelo notificador.py
+    Migration(20, "fila de notificacoes", """
+    CREATE TABLE IF NOT EXISTS notificacoes (
+        id BIGSERIAL PRIMARY KEY,
+        os_id INTEGER NOT NULL,
+        evento TEXT NOT NULL,
+        dados JSONB NOT NULL DEFAULT '{}',
+        criado_em TIMESTAMPTZ NOT NULL DEFAULT now(),
+        proxima_tentativa TIMESTAMPTZ NOT NULL DEFAULT now(),
+        tentativas INTEGER NOT NULL DEFAULT 0,
+        ultimo_erro TEXT,
+        enviado_em TIMESTAMPTZ,
+        desistido_em TIMESTAMPTZ
+    );
+
+    -- o que o notificador procura: pendentes por ordem de vencimento
+    CREATE INDEX IF NOT EXISTS notificacoes_pendentes_idx ON notificacoes (proxima_tentativa, id)
+        WHERE enviado_em IS NULL AND desistido_em IS NULL;
+    """),
+    Migration(21, "consultas lentas", """
+    -- limitada a DB_LENTAS_MAX linhas (as mais antigas saem); ver lentas.py
+    CREATE TABLE IF NOT EXISTS consultas_lentas (
+        id BIGSERIAL PRIMARY KEY,
+        criado_em TIMESTAMPTZ NOT NULL DEFAULT now(),
+        sql_hash TEXT NOT NULL,
+        sql TEXT NOT NULL,
+        parametros TEXT NOT NULL DEFAULT '',
+        endpoint TEXT NOT NULL,
+        duracao_ms DOUBLE PRECISION NOT NULL,
+        plano TEXT
+    );
+    """),
+]
+
+
+def _ensure_version_table(conn):
+    cur = conn.cursor()
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        nome TEXT NOT NULL,
+        aplicado_em TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+    """)
+    conn.commit()
+
+
+def applied_versions(conn) -> set:
+    cur = conn.cursor()
+    cur.execute("SELECT version FROM schema_version")
+    return {r["version"] for r in cur.fetchall()}
+
+
+def _apply(conn, m: Migration):
+    conn.autocommit = not m.transacional
+    try:
+        cur = conn.cursor()
+        if callable(m.sql):
+            m.sql(cur)
+        else:
+            cur.execute(m.sql)
+        cur.execute(
+            "INSERT INTO schema_version (version, nome) VALUES (%s, %s)",
+            (m.version, m.nome),
+        )
+        if m.transacional:
+            conn.commit()
+    except Exception:
+        if m.transacional:
+            conn.rollback()
+        raise
+    finally:
+        conn.autocommit = False
+
+
+def sync_usuarios_fixos(conn):
+    """Reaplica senha e role dos usuários fixos (idempotente, fora da numeração)."""
+    _usuarios_fixos(conn.cursor())
+    conn.commit()
+
+
+def _lock(conn, log):
+    """Pega o advisory lock de sessão, tentando de tempos em tempos.
+
+    Não usamos pg_advisory_lock() bloqueante: quem fica esperando nele segura
+    um snapshot aberto, e o CREATE INDEX CONCURRENTLY de quem tem o lock espera
+    esse snapshot terminar (deadlock).
+    """
+    cur = conn.cursor()
+    avisou = False
+    while True:
+        cur.execute("SELECT pg_try_advisory_lock(%s) AS ok", (LOCK_ID,))
+        if cur.fetchone()["ok"]:
+            return
+        if not avisou:
+            log("[migração] outro processo está migrando; aguardando...")
+            avisou = True
+        time.sleep(0.5)
+
+
+def migrate(target=None, log=print) -> list:
+    """Aplica as migrações pendentes (até `target`, se informado).
+
+    Devolve a lista de versões aplicadas nesta chamada. Com DATABASE_URL
+    sqlite:... o schema é o do migrations_sqlite.py.
+    """
+    if db.SQLITE:
+        import migrations_sqlite
+        conn = db.connect()
+        try:
+            return migrations_sqlite.migrate(conn, target, log)
+        finally:
+            conn.close()
+
+    versions = [m.version for m in MIGRATIONS]
+    assert versions == sorted(set(versions)), "MIGRATIONS fora de ordem ou com número repetido"
+
+    conn = db.connect()
+    aplicadas = []
+    try:
+        # lock de sessão: fica com a gente até o unlock (ou a conexão cair)
+        conn.autocommit = True
+        _lock(conn, log)
+        conn.autocommit = False
+        try:
+            _ensure_version_table(conn)
+            feitas = applied_versions(conn)
+            conn.commit()
+
+            for m in MIGRATIONS:
+                if m.version in feitas or (target is not None and m.version > target):
+                    continue
+                log(f"[migração] {m.version:04d} {m.nome}")
+                _apply(conn, m)
+                aplicadas.append(m.version)
+
+            if target is None or target >= 2:
+                sync_usuarios_fixos(conn)
+        finally:
+            conn.rollback()
+            conn.autocommit = True
+            conn.cursor().execute("SELECT pg_advisory_unlock(%s)", (LOCK_ID,))
+    finally:
+        conn.close()
+    return aplicadas
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    target = int(argv[0]) if argv else None
+    aplicadas = migrate(target)
+    if aplicadas:
+        print(f"✅ {len(aplicadas)} migração(ões) aplicada(s).")
+    else:
+        print("✅ Schema já está atualizado.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+"""Schema do backend SQLite (DATABASE_URL=sqlite:..., ver db_sqlite.py).
+
+O SQLite não passa pelo histórico do Postgres (colunas TEXT -> timestamptz,
+checklist -> jsonb, CONCURRENTLY...): banco novo já nasce no estado final
+do migrations.py. Numeração própria, também em schema_version; mudança de
+schema daqui para frente entra nas duas listas.
+
+Tipos declarados (TIMESTAMPTZ, DATE, JSONB) são os que o db_sqlite converte
+na leitura; dinheiro fica NUMERIC, como no Postgres.
+
+Roda pelo migrations.py (python migrations.py), que delega para cá.
+"""
+import sqlite3
+
+from migrations import Migration, _usuarios_fixos
+
+_AGORA = "(strftime('%Y-%m-%d %H:%M:%f+00:00', 'now'))"
+
+# status que o painel mostra como abertas (mesma lista do os_abertas_id_idx)
+_ABERTAS = "('aberta','aguardando orçamento','aguardando aprovação','em execução')"
+
+_TABELAS = f"""
+CREATE TABLE IF NOT EXISTS usuarios (
+    id INTEGER PRIMARY KEY,
+    usuario TEXT UNIQUE NOT NULL,
+    senha TEXT NOT NULL,
+    role TEXT DEFAULT 'user'
+);
+
+CREATE TABLE IF NOT EXISTS os (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    data_entrada TIMESTAMPTZ,
+    status TEXT DEFAULT 'aberta',
+
+    cliente_nome TEXT,
+    cliente_fone TEXT,
+    cliente_cpf TEXT,
+    cliente_endereco TEXT,
+    cliente_email TEXT,
+
+    tipo TEXT,
+    equipamento TEXT,
+
+    checklist_json JSONB,
+    relato_cliente TEXT,
+    diagnostico_tecnico TEXT,
+
+    valor_orcado NUMERIC DEFAULT 0,
+    valor_pago NUMERIC DEFAULT 0,
+    data_pagamento DATE,
+    data_pagamento_texto TEXT,
+
+    codigo_consulta TEXT,
+    versao INTEGER NOT NULL DEFAULT 1,
+    atualizado_em TIMESTAMPTZ NOT NULL DEFAULT {_AGORA}
+);
+
+CREATE TABLE IF NOT EXISTS os_historico (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    os_id INTEGER NOT NULL,
+    data TIMESTAMPTZ,
+    acao TEXT,
+    obs TEXT,
+    visivel_cliente INTEGER DEFAULT 1,
+
+    valor_orcado NUMERIC DEFAULT NULL,
+    valor_pago NUMERIC DEFAULT NULL,
+    data_pagamento DATE DEFAULT NULL,
+    data_pagamento_texto TEXT
+);
+
+CREATE TABLE IF NOT EXISTS devedores (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    criado_em TIMESTAMPTZ,
+    cliente_nome TEXT,
+    cliente_fone TEXT,
+    referencia TEXT,
+    valor NUMERIC DEFAULT 0,
+    obs TEXT,
+    status TEXT DEFAULT 'em aberto',
+    pago_em TIMESTAMPTZ
+);
+
+CREATE TABLE IF NOT EXISTS receita_cache (
+    granularidade TEXT NOT NULL,
+    fuso TEXT NOT NULL,
+    inicio TIMESTAMP NOT NULL,
+    linhas JSONB NOT NULL,
+    calculado_em TIMESTAMPTZ NOT NULL DEFAULT {_AGORA},
+    PRIMARY KEY (granularidade, fuso, inicio)
+);
+
+CREATE TABLE IF NOT EXISTS notificacoes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    os_id INTEGER NOT NULL,
+    evento TEXT NOT NULL,
+    dados JSONB NOT NULL DEFAULT '{{}}',
+    criado_em TIMESTAMPTZ NOT NULL DEFAULT {_AGORA},
+    proxima_tentativa TIMESTAMPTZ NOT NULL DEFAULT {_AGORA},
+    tentativas INTEGER NOT NULL DEFAULT 0,
+    ultimo_erro TEXT,
+    enviado_em TIMESTAMPTZ,
+    desistido_em TIMESTAMPTZ
+);
+
+CREATE TABLE IF NOT EXISTS consultas_lentas (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    criado_em TIMESTAMPTZ NOT NULL DEFAULT {_AGORA},
+    sql_hash TEXT NOT NULL,
+    sql TEXT NOT NULL,
+    parametros TEXT NOT NULL DEFAULT '',
+    endpoint TEXT NOT NULL,
+    duracao_ms REAL NOT NULL,
+    plano TEXT
+);
+"""
+
+_INDICES = f"""
+CREATE INDEX IF NOT EXISTS os_abertas_id_idx ON os (id DESC) WHERE status IN {_ABERTAS};
+CREATE INDEX IF NOT EXISTS os_status_id_idx ON os (status, id DESC);
+CREATE UNIQUE INDEX IF NOT EXISTS os_codigo_consulta_key ON os (codigo_consulta);
+CREATE INDEX IF NOT EXISTS os_data_entrada_idx ON os (data_entrada);
+CREATE INDEX IF NOT EXISTS os_historico_os_id_idx ON os_historico (os_id, id DESC);
+CREATE INDEX IF NOT EXISTS os_historico_pagamentos_idx ON os_historico (data, os_id)
+    WHERE valor_pago IS NOT NULL;
+CREATE INDEX IF NOT EXISTS devedores_status_id_idx ON devedores (status, id DESC);
+CREATE INDEX IF NOT EXISTS devedores_abertos_primeiro_idx ON devedores ((status <> 'em aberto'), id DESC);
+CREATE INDEX IF NOT EXISTS devedores_status_criado_idx ON devedores (status, criado_em, valor);
+CREATE INDEX IF NOT EXISTS notificacoes_pendentes_idx ON notificacoes (proxima_tentativa, id)
+    WHERE enviado_em IS NULL AND desistido_em IS NULL;
+
+-- os_por_imei: a consulta usa exatamente estas expressões
+CREATE INDEX IF NOT EXISTS os_imei1_idx ON os (json_extract(checklist_json, '$.ck_cel_imei1'));
+CREATE INDEX IF NOT EXISTS os_imei2_idx ON os (json_extract(checklist_json, '$.ck_cel_imei2'));
+"""
+
+# contadores do painel: sem trigger de comando no SQLite, cada linha soma e
+# subtrai a sua parte
+_RESUMO = """
+CREATE TABLE IF NOT EXISTS os_resumo (
+    status TEXT PRIMARY KEY,
+    qtd INTEGER NOT NULL DEFAULT 0,
+    valor_orcado NUMERIC NOT NULL DEFAULT 0,
+    valor_pago NUMERIC NOT NULL DEFAULT 0
+);
+
+CREATE TRIGGER IF NOT EXISTS os_resumo_ins AFTER INSERT ON os BEGIN
+    INSERT INTO os_resumo (status, qtd, valor_orcado, valor_pago)
+    VALUES (coalesce(NEW.status, ''), 1, coalesce(NEW.valor_orcado, 0), coalesce(NEW.valor_pago, 0))
+    ON CONFLICT (status) DO UPDATE SET
+        qtd = qtd + excluded.qtd,
+        valor_orcado = valor_orcado + excluded.valor_orcado,
+        valor_pago = valor_pago + excluded.valor_pago;
+END;
+
+CREATE TRIGGER IF NOT EXISTS os_resumo_upd AFTER UPDATE OF status, valor_orcado, valor_pago ON os BEGIN
+    UPDATE os_resumo SET
+        qtd = qtd - 1,
+        valor_orcado = valor_orcado - coalesce(OLD.valor_orcado, 0),
+        valor_pago = valor_pago - coalesce(OLD.valor_pago, 0)
+    WHERE status = coalesce(OLD.status, '');
+    INSERT INTO os_resumo (status, qtd, valor_orcado, valor_pago)
+    VALUES (coalesce(NEW.status, ''), 1, coalesce(NEW.valor_orcado, 0), coalesce(NEW.valor_pago, 0))
+    ON CONFLICT (status) DO UPDATE SET
+        qtd = qtd + excluded.qtd,
+        valor_orcado = valor_orcado + excluded.valor_orcado,
+        valor_pago = valor_pago + excluded.valor_pago;
+END;
+
+CREATE TRIGGER IF NOT EXISTS os_resumo_del AFTER DELETE ON os BEGIN
+    UPDATE os_resumo SET
+        qtd = qtd - 1,
+        valor_orcado = valor_orcado - coalesce(OLD.valor_orcado, 0),
+        valor_pago = valor_pago - coalesce(OLD.valor_pago, 0)
+    WHERE status = coalesce(OLD.status, '');
+END;
+"""
+
+# busca de OS: FTS5 com o mesmo texto do tsvector do Postgres (nome e
+# equipamento sem acento + sufixos dos dígitos), rowid = os.id. O documento
+# é montado pela função Python os_busca_doc, registrada em toda conexão
+# (db_sqlite.Conexao). prefix: índice para os termos curtos ('1234'*)
+_BUSCA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS os_busca USING fts5(
+    doc, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3 4'
+);
+
+CREATE TRIGGER IF NOT EXISTS os_busca_ins AFTER INSERT ON os BEGIN
+    INSERT INTO os_busca (rowid, doc)
+    VALUES (NEW.id, os_busca_doc(NEW.cliente_nome, NEW.cliente_fone, NEW.cliente_cpf,
+                                 NEW.tipo, NEW.equipamento, NEW.checklist_json));
+END;
+
+CREATE TRIGGER IF NOT EXISTS os_busca_upd
+AFTER UPDATE OF cliente_nome, cliente_fone, cliente_cpf, tipo, equipamento, checklist_json ON os BEGIN
+    UPDATE os_busca
+    SET doc = os_busca_doc(NEW.cliente_nome, NEW.cliente_fone, NEW.cliente_cpf,
+                           NEW.tipo, NEW.equipamento, NEW.checklist_json)
+    WHERE rowid = NEW.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS os_busca_del AFTER DELETE ON os BEGIN
+    DELETE FROM os_busca WHERE rowid = OLD.id;
+END;
+"""
+
+MIGRATIONS = [
+    Migration(1, "schema inicial (sqlite)", _TABELAS + _INDICES + _RESUMO + _BUSCA),
+    Migration(2, "usuarios fixos", _usuarios_fixos),
+]
+
+
+def _comandos(sql):
+    """Separa o script em comandos (o ; dentro de BEGIN...END da trigger não conta)."""
+    atual = ""
+    for linha in sql.splitlines(keepends=True):
+        atual += linha
+        if sqlite3.complete_statement(atual):
+            yield atual.strip()
+            atual = ""
+    if atual.strip():
+        yield atual.strip()
+
+
+def migrate(conn, target=None, log=print) -> list:
+    """Aplica as migrações pendentes numa transação só.
+
+    BEGIN IMMEDIATE: o primeiro processo pega o lock de escrita; os outros
+    (workers subindo juntos) esperam o busy_timeout e depois acham tudo
+    aplicado. Devolve a lista de versões aplicadas nesta chamada.
+    """
+    versions = [m.version for m in MIGRATIONS]
+    assert versions == sorted(set(versions)), "MIGRATIONS fora de ordem ou com número repetido"
+
+    cur = conn.cursor()
+    conn.imediato = True
+    aplicadas = []
+    try:
+        cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            nome TEXT NOT NULL,
+            aplicado_em TIMESTAMPTZ NOT NULL DEFAULT {_AGORA}
+        )
+        """)
+        cur.execute("SELECT version FROM schema_version")
+        feitas = {r["version"] for r in cur.fetchall()}
+
+        for m in MIGRATIONS:
+            if m.version in feitas or (target is not None and m.version > target):
+                continue
+            log(f"[migração] {m.version:04d} {m.nome}")
+            if callable(m.sql):
+                m.sql(cur)
+            else:
+                for comando in _comandos(m.sql):
+                    cur.execute(comando)
+            cur.execute("INSERT INTO schema_version (version, nome) VALUES (%s, %s)", (m.version, m.nome))
+            aplicadas.append(m.version)
+
+        # mesma regra do Postgres: usuários fixos reaplicados em todo boot,
+        # ainda dentro do BEGIN IMMEDIATE
+        if target is None or target >= 2:
+            _usuarios_fixos(cur)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.imediato = False
+
+    if aplicadas:
+        conn.raw.execute("PRAGMA optimize")
+    return aplicadas
@@ -0,0 +1,148 @@
+"""Envia os avisos ao cliente que o app deixa na fila (tabela notificacoes).
+
+O app só grava o aviso, na mesma transação da mudança de status (ver
+queries.os_registrar_atualizacao); o envio roda aqui, num processo à parte,
+para um serviço lento ou fora do ar não atrasar nenhum request.
+
+    python notificador.py            # fica rodando (worker do Render)
+    python notificador.py --uma-vez  # esvazia o que está vencido e sai
+
+Cada rodada trava um lote com FOR UPDATE SKIP LOCKED (dá para rodar mais de
+um notificador), envia, e marca cada aviso como enviado ou agenda a próxima
+tentativa com backoff exponencial; depois de NOTIF_TENTATIVAS falhas desiste
+(fica com desistido_em e o último erro).
+
+Quem envia vem de NOTIF_ENVIO:
+- "stdout" (padrão): escreve a mensagem na saída, para testar;
+- "arquivo:/caminho/avisos.jsonl": uma linha JSON por aviso;
+- "pacote.modulo:funcao": função(aviso, mensagem) que levanta exceção se falhar.
+"""
+import argparse
+import importlib
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timezone
+
+import db
+import queries
+
+NOTIF_ENVIO = os.environ.get("NOTIF_ENVIO", "stdout").strip()
+NOTIF_LOTE = int(os.environ.get("NOTIF_LOTE", "20"))
+NOTIF_TENTATIVAS = int(os.environ.get("NOTIF_TENTATIVAS", "8"))
+# espera antes da 2ª tentativa; dobra a cada falha, até NOTIF_BACKOFF_MAX_S
+NOTIF_BACKOFF_S = float(os.environ.get("NOTIF_BACKOFF_S", "30"))
+NOTIF_BACKOFF_MAX_S = float(os.environ.get("NOTIF_BACKOFF_MAX_S", "3600"))
+# fila vazia: quanto dormir antes de olhar de novo
+NOTIF_INTERVALO_S = float(os.environ.get("NOTIF_INTERVALO_S", "5"))
+
+SITE_CONSULTA = os.environ.get("SITE_CONSULTA", "https://sistema-lck.onrender.com/").strip()
+
+MENSAGENS = {
+    "fechada": "Olá, {nome}! Sua OS #{os} está pronta para retirada na LCK Tecnologia.",
+    "aguardando aprovação": "Olá, {nome}! O orçamento da sua OS #{os} está pronto: R$ {valor}. "
+                            "Aguardamos sua aprovação.",
+}
+
+
+def mensagem(aviso) -> str:
+    d = aviso["dados"] or {}
+    texto = MENSAGENS.get(aviso["evento"], "Olá, {nome}! Sua OS #{os} foi atualizada.").format(
+        nome=d.get("cliente_nome") or "cliente",
+        os=str(aviso["os_id"]).zfill(4),
+        valor=f"{float(d.get('valor_orcado') or 0):.2f}",
+    )
+    return f"{texto} Consulte em {SITE_CONSULTA} com o código {d.get('codigo_consulta') or '-'}."
+
+
+# =========================
+# Envio
+# =========================
+def envio_stdout(aviso, texto):
+    d = aviso["dados"] or {}
+    print(f"[aviso {aviso['id']}] para {d.get('cliente_fone') or d.get('cliente_email') or '?'}: {texto}",
+          flush=True)
+
+
+def envio_arquivo(caminho):
+    def enviar(aviso, texto):
+        linha = {
+            "id": aviso["id"], "os_id": aviso["os_id"], "evento": aviso["evento"],
+            "dados": aviso["dados"], "mensagem": texto,
+            "enviado_em": datetime.now(timezone.utc).isoformat(),
+        }
+        with open(caminho, "a", encoding="utf-8") as f:
+            f.write(json.dumps(linha, ensure_ascii=False) + "\n")
+    return enviar
+
+
+def carregar_envio(spec):
+    """NOTIF_ENVIO -> função(aviso, mensagem)."""
+    if spec == "stdout":
+        return envio_stdout
+    if spec.startswith("arquivo:"):
+        return envio_arquivo(spec.split(":", 1)[1])
+    modulo, _, nome = spec.partition(":")
+    if not nome:
+        raise ValueError(f"NOTIF_ENVIO inválido: {spec!r} (use stdout, arquivo:CAMINHO ou modulo:funcao)")
+    return getattr(importlib.import_module(modulo), nome)
+
+
+# =========================
+# Worker
+# =========================
+def espera(tentativas):
+    """Backoff exponencial com jitter (avisos que falharam juntos não voltam juntos)."""
+    base = min(NOTIF_BACKOFF_S * 2 ** max(tentativas - 1, 0), NOTIF_BACKOFF_MAX_S)
+    return base * random.uniform(0.8, 1.2)
+
+
+def rodada(conn, enviar, lote=NOTIF_LOTE, log=print):
+    """Pega um lote, envia e grava o resultado. Devolve quantos avisos pegou."""
+    cur = conn.cursor()
+    avisos = queries.notificacoes_pegar(cur, lote)
+    for aviso in avisos:
+        try:
+            enviar(aviso, mensagem(aviso))
+        except Exception as e:
+            feitas = aviso["tentativas"] + 1
+            desistir = feitas >= NOTIF_TENTATIVAS
+            queries.notificacao_falhou(cur, aviso["id"], f"{type(e).__name__}: {e}"[:500],
+                                       espera(feitas), desistir=desistir)
+            log(f"[notificador] aviso {aviso['id']} (OS {aviso['os_id']}) falhou "
+                f"({feitas}/{NOTIF_TENTATIVAS}){' — desistindo' if desistir else ''}: {e}")
+        else:
+            queries.notificacao_enviada(cur, aviso["id"])
+    conn.commit()
+    return len(avisos)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--uma-vez", action="store_true", help="esvazia a fila vencida e sai")
+    args = ap.parse_args(argv)
+
+    enviar = carregar_envio(NOTIF_ENVIO)
+    conn = db.connect()
+    try:
+        while True:
+            try:
+                n = rodada(conn, enviar)
+            except Exception:
+                conn.rollback()
+                raise
+            if n == 0:
+                if args.uma_vez:
+                    break
+                time.sleep(NOTIF_INTERVALO_S)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
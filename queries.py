@@ -0,0 +1,798 @@
+"""Consultas do sistema, com nome e projeção explícita.
+
+As rotas do app.py não escrevem SQL: chamam as funções daqui passando o
+cursor da conexão do request. Quem comita é a rota.
+
+Cada tela busca só as colunas que usa (lista, detalhe, impressão...). As
+leituras quentes rodam como prepared statement: o PREPARE acontece uma vez
+por conexão do pool e depois é só EXECUTE, sem o Postgres reanalisar o SQL.
+"""
+import hashlib
+import re
+
+from psycopg2.extras import Json
+
+import db
+
+# =========================
+# Projeções
+# =========================
+OS_LISTA = "id, data_entrada, status, cliente_nome, cliente_fone, tipo, equipamento, codigo_consulta"
+
+OS_DETALHE = """
+    id, data_entrada, status,
+    cliente_nome, cliente_fone, cliente_cpf, cliente_endereco, cliente_email,
+    tipo, equipamento,
+    checklist_json, relato_cliente, diagnostico_tecnico,
+    valor_orcado, valor_pago, data_pagamento, data_pagamento_texto,
+    codigo_consulta
+"""
+# a folha impressa mostra o mesmo que o detalhe
+OS_IMPRESSAO = OS_DETALHE
+
+OS_COMPROVANTE = "id, data_entrada, cliente_nome, cliente_fone, tipo, equipamento, valor_orcado, codigo_consulta"
+
+# o que o cliente vê na consulta pública (sem CPF, endereço, diagnóstico...)
+OS_CLIENTE = """
+    id, status, data_entrada, cliente_nome, cliente_fone, tipo, equipamento,
+    relato_cliente, valor_orcado, valor_pago, data_pagamento, data_pagamento_texto, codigo_consulta
+"""
+
+OS_DEVEDOR = "id, cliente_nome, cliente_fone, valor_orcado, valor_pago"
+
+HIST_DETALHE = "id, data, acao, obs, visivel_cliente"
+HIST_CLIENTE = "id, data, acao, obs, valor_orcado, valor_pago, data_pagamento, data_pagamento_texto"
+
+DEVEDOR_LISTA = "id, criado_em, cliente_nome, cliente_fone, referencia, valor, obs, status, pago_em"
+
+
+# =========================
+# Execução
+# =========================
+_PARAM = re.compile(r"%\((\w+)\)s")
+
+
+def run(cur, sql, params=None, prepare=True):
+    """Executa `sql` (parâmetros no formato %(nome)s) e devolve o cursor.
+
+    Com prepare (e DB_PREPARE ligado), o SQL vira um prepared statement da
+    conexão, nomeado pelo hash do texto: consultas montadas com filtros
+    diferentes viram statements diferentes, cada um preparado uma vez.
+    """
+    params = params or {}
+    if not (prepare and db.DB_PREPARE):
+        cur.execute(sql, params)
+        return cur
+
+    ordem = list(dict.fromkeys(_PARAM.findall(sql)))
+    nome = "q_" + hashlib.sha1(sql.encode("utf-8")).hexdigest()[:16]
+    conn = cur.connection
+    if nome not in conn.prepared:
+        pos = {n: i + 1 for i, n in enumerate(ordem)}
+        texto = _PARAM.sub(lambda m: f"${pos[m.group(1)]}", sql).replace("%%", "%")
+        cur.execute(f"PREPARE {nome} AS {texto}")
+        conn.prepared[nome] = texto
+
+    if ordem:
+        cur.execute(f"EXECUTE {nome} ({', '.join(['%s'] * len(ordem))})", [params[n] for n in ordem])
+    else:
+        cur.execute(f"EXECUTE {nome}")
+    return cur
+
+
+def one(cur, sql, params=None, prepare=True):
+    return run(cur, sql, params, prepare).fetchone()
+
+
+def many(cur, sql, params=None, prepare=True):
+    return run(cur, sql, params, prepare).fetchall()
+
+
+def em_lista(coluna, param, tipo="int"):
+    """SQL de "`coluna` está na lista passada em %(param)s".
+
+    ANY(array) no Postgres; no SQLite a lista vai como JSON (db_sqlite) e
+    sai do json_each.
+    """
+    if db.SQLITE:
+        return f"{coluna} IN (SELECT value FROM json_each(%({param})s))"
+    return f"{coluna} = ANY(%({param})s::{tipo}[])"
+
+
+def pagina_keyset(cur, sql, filtros, params, segmentos, antes=None, depois=None, n=30):
+    """Paginação por cursor (WHERE id < :ultimo LIMIT n), sem OFFSET.
+
+    A lista é a concatenação dos `segmentos` (cada um ordenado por id DESC e
+    passado à consulta como %(segmento)s); o cursor é "segmento.id" da última
+    linha (`antes`, próxima página) ou da primeira (`depois`, página anterior).
+    Cada página custa uma busca no índice, não importa a profundidade.
+    """
+    def cursor(v):
+        try:
+            seg, ultimo = (v or "").split(".")
+            seg, ultimo = int(seg), int(ultimo)
+        except ValueError:
+            return None
+        return (seg, ultimo) if 0 <= seg < len(segmentos) else None
+
+    voltar = cursor(depois)
+    inicio = voltar or cursor(antes)
+    seg, ultimo = inicio if inicio else (0, None)
+
+    rows = []
+    while 0 <= seg < len(segmentos) and len(rows) <= n:
+        conds = list(filtros)
+        if ultimo is not None:
+            conds.append("id > %(ultimo)s" if voltar else "id < %(ultimo)s")
+        texto = (
+            sql.format(filtros=" AND ".join(conds) or "TRUE")
+            + (" ORDER BY id ASC" if voltar else " ORDER BY id DESC")
+            + " LIMIT %(limite)s"
+        )
+        rows += [
+            dict(r, _seg=seg)
+            for r in many(cur, texto, dict(params, segmento=segmentos[seg], ultimo=ultimo, limite=n + 1 - len(rows)))
+        ]
+        seg, ultimo = (seg - 1 if voltar else seg + 1), None
+
+    tem_mais = len(rows) > n
+    rows = rows[:n]
+    if voltar:
+        rows.reverse()
+    chave = lambda r: f"{r['_seg']}.{r['id']}"
+
+    tem_proxima = bool(voltar) or tem_mais
+    tem_anterior = tem_mais if voltar else inicio is not None
+    return {
+        "rows": rows,
+        "antes": chave(rows[-1]) if rows and tem_proxima else None,
+        "depois": chave(rows[0]) if rows and tem_anterior else None,
+    }
+
+
+# =========================
+# Usuários
+# =========================
+def usuario_por_nome(cur, usuario):
+    return one(cur, "SELECT id, usuario, senha, role FROM usuarios WHERE usuario = %(usuario)s",
+               {"usuario": usuario})
+
+
+# =========================
+# OS — leitura
+# =========================
+def os_abertas(cur, limite=80):
+    return many(cur, f"""
+        SELECT {OS_LISTA}
+        FROM os
+        WHERE status IN ('aberta','aguardando orçamento','aguardando aprovação','em execução')
+        ORDER BY id DESC
+        LIMIT %(limite)s
+    """, {"limite": limite})
+
+
+def os_resumo(cur):
+    """Contadores por status (tabela os_resumo, mantida por trigger)."""
+    return many(cur, "SELECT status, qtd, valor_orcado, valor_pago FROM os_resumo WHERE qtd <> 0")
+
+
+def os_finalizadas_pagina(cur, status=None, de=None, ate=None, antes=None, depois=None):
+    filtros = ["status IN ('fechada','sem conserto')"]
+    params = {}
+    if status:
+        filtros.append("status = %(status)s")
+        params["status"] = status
+    if de:
+        filtros.append("data_entrada >= %(de)s")
+        params["de"] = de
+    if ate:
+        filtros.append("data_entrada < %(ate)s")
+        params["ate"] = ate
+
+    return pagina_keyset(cur, f"""
+        SELECT {OS_LISTA}
+        FROM os
+        WHERE {{filtros}}
+    """, filtros, params, [None], antes, depois)
+
+
+def termos_de(texto):
+    """Texto digitado -> termos da busca (cada um vale como prefixo).
+
+    Telefone/CPF/IMEI digitado com pontuação ("(11) 99999-1234") vira um termo
+    só de dígitos. Os acentos são tirados no banco (busca_normaliza), igual ao
+    que é feito na coluna os.busca.
+    """
+    texto = (texto or "").strip()
+    if re.fullmatch(r"[\d\s().+/-]+", texto):
+        termos = [re.sub(r"\D", "", texto)]
+    else:
+        termos = re.findall(r"[^\W_]+", texto.lower())
+    return [t for t in termos if len(t) >= (3 if t.isdigit() else 2)]
+
+
+def termos_busca(texto):
+    """Texto digitado -> tsquery ('silva':* & '1234':*), ou None se não sobrar termo."""
+    termos = termos_de(texto)
+    if not termos:
+        return None
+    return " & ".join(f"'{t}':*" for t in termos)
+
+
+def mais_novas_gin(cur, where, params, limite=50, teto=500):
+    """As `limite` OS mais novas que batem com `where` (condição servida por GIN).
+
+    O planner não estima bem @@ com prefixo nem @> no jsonb e às vezes varre a
+    os_pkey de trás pra frente filtrando linha a linha: ótimo para termo comum
+    (acha `limite` logo), péssimo para termo raro (varre a tabela toda). Por
+    isso primeiro vai pelo índice GIN, com no máximo `teto` linhas, e ordena
+    em memória; só se estourar o teto (termo comum) vai pela ordem do id.
+    """
+    params = dict(params, limite=limite, teto=teto)
+    rows = many(cur, f"""
+        WITH achadas AS MATERIALIZED (
+            SELECT id FROM os WHERE {where} LIMIT %(teto)s
+        )
+        SELECT {OS_LISTA}, (SELECT count(*) FROM achadas) AS achadas
+        FROM os
+        WHERE id IN (SELECT id FROM achadas)
+        ORDER BY id DESC
+        LIMIT %(limite)s
+    """, params)
+    if not rows or rows[0]["achadas"] < teto:
+        for r in rows:
+            del r["achadas"]
+        return rows
+
+    return many(cur, f"""
+        SELECT {OS_LISTA}
+        FROM os
+        WHERE {where}
+        ORDER BY id DESC
+        LIMIT %(limite)s
+    """, params)
+
+
+def os_buscar(cur, texto, limite=50):
+    """OS por nome, telefone, CPF, equipamento ou IMEI (GIN em os.busca)."""
+    termos = termos_busca(texto)
+    if not termos:
+        return []
+    return mais_novas_gin(cur, "busca @@ to_tsquery('simple', busca_normaliza(%(termos)s))",
+                          {"termos": termos}, limite)
+
+
+def os_por_checklist(cur, contem=None, chave=None, limite=50):
+    """OS cujo checklist contém os pares de `contem` e/ou tem `chave` preenchida.
+
+    Ex.: os_por_checklist(cur, chave="ck_cel_agua") -> celulares que chegaram
+    com o item "molhou/oxidou" informado. Usa o GIN os_checklist_idx.
+    """
+    filtros = []
+    params = {}
+    if contem:
+        filtros.append("checklist_json @> %(contem)s")
+        params["contem"] = Json(contem)
+    if chave:
+        filtros.append("checklist_json ? %(chave)s")
+        params["chave"] = chave
+    if not filtros:
+        return []
+    return mais_novas_gin(cur, " AND ".join(filtros), params, limite)
+
+
+def os_por_imei(cur, imei):
+    return many(cur, f"""
+        SELECT {OS_LISTA}
+        FROM os
+        WHERE checklist_json @> %(imei1)s OR checklist_json @> %(imei2)s
+        ORDER BY id DESC
+    """, {"imei1": Json({"ck_cel_imei1": imei}), "imei2": Json({"ck_cel_imei2": imei})})
+
+
+def os_detalhe(cur, os_id):
+    return one(cur, f"SELECT {OS_DETALHE} FROM os WHERE id = %(id)s", {"id": os_id})
+
+
+def os_impressao(cur, os_id):
+    return one(cur, f"SELECT {OS_IMPRESSAO} FROM os WHERE id = %(id)s", {"id": os_id})
+
+
+def os_comprovante(cur, os_id):
+    return one(cur, f"SELECT {OS_COMPROVANTE} FROM os WHERE id = %(id)s", {"id": os_id})
+
+
+def os_impressao_lote(cur, ids):
+    """Várias OS numa consulta só (impressão em lote), por id."""
+    return many(cur, f"SELECT {OS_IMPRESSAO} FROM os WHERE {em_lista('id', 'ids')} ORDER BY id", {"ids": ids})
+
+
+def os_comprovante_lote(cur, ids):
+    return many(cur, f"SELECT {OS_COMPROVANTE} FROM os WHERE {em_lista('id', 'ids')} ORDER BY id", {"ids": ids})
+
+
+def os_cliente(cur, os_id):
+    return one(cur, f"SELECT {OS_CLIENTE} FROM os WHERE id = %(id)s", {"id": os_id})
+
+
+def os_para_devedor(cur, os_id):
+    return one(cur, f"SELECT {OS_DEVEDOR} FROM os WHERE id = %(id)s", {"id": os_id})
+
+
+def historico(cur, os_id):
+    return many(cur, f"""
+        SELECT {HIST_DETALHE} FROM os_historico
+        WHERE os_id = %(os_id)s
+        ORDER BY id DESC
+    """, {"os_id": os_id})
+
+
+def historico_cliente(cur, os_id):
+    return many(cur, f"""
+        SELECT {HIST_CLIENTE} FROM os_historico
+        WHERE os_id = %(os_id)s AND visivel_cliente = 1
+        ORDER BY id DESC
+    """, {"os_id": os_id})
+
+
+def os_versao(cur, os_id):
+    """Versão da OS para o ETag das telas (ver os_condicional no app).
+
+    Toda escrita na OS ou no histórico dela soma 1 em versao; quem já tem a
+    página na versão atual recebe 304 sem rodar as consultas da tela.
+    """
+    return one(cur, "SELECT id, versao, atualizado_em, codigo_consulta FROM os WHERE id = %(id)s", {"id": os_id})
+
+
+def historico_cliente_lote(cur, ids):
+    """Histórico visível ao cliente de várias OS: {os_id: [linhas, mais nova primeiro]}."""
+    rows = many(cur, f"""
+        SELECT os_id, {HIST_CLIENTE} FROM os_historico
+        WHERE {em_lista('os_id', 'ids')} AND visivel_cliente = 1
+        ORDER BY os_id, id DESC
+    """, {"ids": ids})
+    por_os = {}
+    for r in rows:
+        por_os.setdefault(r["os_id"], []).append(r)
+    return por_os
+
+
+def historico_os_id(cur, hist_id):
+    row = one(cur, "SELECT os_id FROM os_historico WHERE id = %(id)s", {"id": hist_id})
+    return row["os_id"] if row else None
+
+
+# =========================
+# OS — escrita
+# =========================
+def os_criar(cur, dados: dict):
+    """Insere a OS e o histórico "OS criada" num comando só (uma ida ao banco).
+
+    `checklist_json` é o dict do form (vai pro banco como jsonb). O código de
+    consulta é garantido pelo índice único: se colidir, o INSERT não faz nada
+    (ON CONFLICT DO NOTHING), nenhuma linha volta e quem chama tenta de novo
+    com outro código. Devolve o id da OS ou None na colisão.
+    """
+    dados = dict(dados, checklist_json=Json(dados["checklist_json"]))
+    row = one(cur, """
+        WITH nova AS (
+            INSERT INTO os (
+                data_entrada, status,
+                cliente_nome, cliente_fone, cliente_cpf, cliente_endereco, cliente_email,
+                tipo, equipamento,
+                checklist_json, relato_cliente, diagnostico_tecnico,
+                valor_orcado, valor_pago, data_pagamento,
+                codigo_consulta
+            )
+            VALUES (
+                %(data_entrada)s, 'aberta',
+                %(cliente_nome)s, %(cliente_fone)s, %(cliente_cpf)s, %(cliente_endereco)s, %(cliente_email)s,
+                %(tipo)s, %(equipamento)s,
+                %(checklist_json)s, %(relato_cliente)s, %(diagnostico_tecnico)s,
+                %(valor_orcado)s, %(valor_pago)s, %(data_pagamento)s,
+                %(codigo_consulta)s
+            )
+            ON CONFLICT (codigo_consulta) DO NOTHING
+            RETURNING id, data_entrada
+        ), hist AS (
+            INSERT INTO os_historico (os_id, data, acao, obs, visivel_cliente, valor_orcado, valor_pago, data_pagamento)
+            SELECT id, data_entrada, 'OS criada', 'Entrada registrada no sistema.', 1,
+                   %(hist_valor_orcado)s::numeric, %(hist_valor_pago)s::numeric, %(hist_data_pagamento)s::date
+            FROM nova
+        )
+        SELECT id FROM nova
+    """, dados)
+    return row["id"] if row else None
+
+
+def os_registrar_atualizacao(cur, os_id, data, acao, obs, visivel_cliente,
+                             status=None, valor_orcado=None, valor_pago=None, data_pagamento=None,
+                             notificar=()):
+    """Atualiza a OS e grava o histórico com o snapshot pós-update, num comando só.
+
+    Campo None = não enviado, fica como está. O UPDATE trava a linha da OS até
+    o fim da transação, então o snapshot gravado no histórico é exatamente o
+    estado que este comando deixou (outro técnico salvando ao mesmo tempo
+    espera). Devolve o id do histórico, ou None se a OS não existe.
+
+    Se o status mudou para um dos de `notificar`, o aviso ao cliente entra na
+    fila (notificacoes) no mesmo comando: só existe se a mudança for
+    commitada, e quem envia é o notificador.py, fora do request.
+    """
+    row = one(cur, """
+        WITH antes AS (
+            SELECT id, status FROM os WHERE id = %(id)s FOR UPDATE
+        ),
+        alvo AS (
+            UPDATE os SET
+                status = COALESCE(%(status)s::text, os.status),
+                valor_orcado = COALESCE(%(valor_orcado)s::numeric, valor_orcado),
+                valor_pago = COALESCE(%(valor_pago)s::numeric, valor_pago),
+                data_pagamento = COALESCE(%(data_pagamento)s::date, data_pagamento),
+                versao = versao + 1,
+                atualizado_em = now()
+            FROM antes
+            WHERE os.id = antes.id
+            RETURNING os.id, os.valor_orcado, os.valor_pago, os.data_pagamento,
+                      os.status, antes.status AS status_anterior,
+                      os.cliente_nome, os.cliente_fone, os.cliente_email, os.codigo_consulta
+        ),
+        aviso AS (
+            INSERT INTO notificacoes (os_id, evento, dados)
+            SELECT id, status, jsonb_build_object(
+                'status_anterior', status_anterior,
+                'cliente_nome', cliente_nome, 'cliente_fone', cliente_fone,
+                'cliente_email', cliente_email, 'codigo_consulta', codigo_consulta,
+                'valor_orcado', valor_orcado, 'valor_pago', valor_pago
+            )
+            FROM alvo
+            WHERE status IS DISTINCT FROM status_anterior AND status = ANY(%(notificar)s::text[])
+        )
+        INSERT INTO os_historico (os_id, data, acao, obs, visivel_cliente, valor_orcado, valor_pago, data_pagamento)
+        SELECT id, %(data)s::timestamptz, %(acao)s, %(obs)s, %(visivel_cliente)s, valor_orcado, valor_pago, data_pagamento
+        FROM alvo
+        RETURNING id
+    """, {
+        "id": os_id, "data": data, "acao": acao, "obs": obs, "visivel_cliente": visivel_cliente,
+        "status": status, "valor_orcado": valor_orcado, "valor_pago": valor_pago,
+        "data_pagamento": data_pagamento, "notificar": list(notificar),
+    })
+    return row["id"] if row else None
+
+
+def os_excluir(cur, os_id):
+    # a versão vai junto com a linha: o próximo GET não acha a OS e dá 404
+    # apaga histórico primeiro
+    run(cur, "DELETE FROM os_historico WHERE os_id = %(id)s", {"id": os_id}, prepare=False)
+    run(cur, "DELETE FROM os WHERE id = %(id)s", {"id": os_id}, prepare=False)
+
+
+def historico_inserir(cur, os_id, data, acao, obs, visivel_cliente,
+                      valor_orcado=None, valor_pago=None, data_pagamento=None):
+    """Histórico avulso (sem mexer nos campos da OS); a versão da OS sobe junto."""
+    run(cur, """
+        WITH alvo AS (
+            UPDATE os SET versao = versao + 1, atualizado_em = now()
+            WHERE id = %(os_id)s
+            RETURNING id
+        )
+        INSERT INTO os_historico (os_id, data, acao, obs, visivel_cliente, valor_orcado, valor_pago, data_pagamento)
+        SELECT id, %(data)s::timestamptz, %(acao)s, %(obs)s, %(visivel_cliente)s,
+               %(valor_orcado)s::numeric, %(valor_pago)s::numeric, %(data_pagamento)s::date
+        FROM alvo
+    """, {
+        "os_id": os_id, "data": data, "acao": acao, "obs": obs, "visivel_cliente": visivel_cliente,
+        "valor_orcado": valor_orcado, "valor_pago": valor_pago, "data_pagamento": data_pagamento,
+    }, prepare=False)
+
+
+def historico_excluir(cur, hist_id):
+    run(cur, """
+        WITH apagado AS (
+            DELETE FROM os_historico WHERE id = %(id)s RETURNING os_id
+        )
+        UPDATE os SET versao = versao + 1, atualizado_em = now()
+        FROM apagado
+        WHERE os.id = apagado.os_id
+    """, {"id": hist_id}, prepare=False)
+
+
+# =========================
+# Relatórios
+# =========================
+def receita_por_periodo(cur, granularidade, de, ate, fuso):
+    """Receita por período e por tipo de equipamento, em [de, ate).
+
+    Cada linha do histórico guarda o valor_pago da OS naquele momento; o que
+    entrou é a diferença para o snapshot anterior da mesma OS (lag). Entram
+    todas as snapshots das OS com pagamento no intervalo, para o lag ver o
+    valor de antes de `de`. `granularidade` é do date_trunc (day, week,
+    month), no `fuso` das telas. A linha com total=True soma os tipos.
+    """
+    return many(cur, """
+        WITH alvo AS (
+            -- as OS com pagamento no período: os_historico_pagamentos_idx (data)
+            SELECT DISTINCT os_id FROM os_historico
+            WHERE valor_pago IS NOT NULL AND data >= %(de)s AND data < %(ate)s
+        ), pagos AS (
+            -- tipo e histórico de cada OS pelo índice (os_pkey e
+            -- os_historico_os_id_idx). OFFSET 0: sem ele o planner achata os
+            -- LATERAL em hash join e varre os e os_historico inteiras
+            SELECT h.os_id, o.tipo, h.data,
+                   h.valor_pago - coalesce(lag(h.valor_pago) OVER (PARTITION BY h.os_id ORDER BY h.id), 0) AS recebido
+            FROM alvo a
+            CROSS JOIN LATERAL (
+                SELECT tipo FROM os WHERE id = a.os_id OFFSET 0
+            ) o
+            CROSS JOIN LATERAL (
+                SELECT id, os_id, data, valor_pago FROM os_historico
+                WHERE os_id = a.os_id AND valor_pago IS NOT NULL AND data < %(ate)s
+                OFFSET 0
+            ) h
+        )
+        SELECT date_trunc(%(granularidade)s, p.data AT TIME ZONE %(fuso)s) AS inicio,
+               p.tipo,
+               GROUPING(p.tipo) = 1 AS total,
+               sum(p.recebido) AS recebido,
+               count(DISTINCT p.os_id) AS os_qtd
+        FROM pagos p
+        WHERE p.data >= %(de)s AND p.data < %(ate)s AND p.recebido <> 0
+        GROUP BY GROUPING SETS ((inicio, p.tipo), (inicio))
+        ORDER BY inicio, total DESC, p.tipo
+    """, {"granularidade": granularidade, "de": de, "ate": ate, "fuso": fuso})
+
+
+def receita_cache_ler(cur, granularidade, fuso, inicios):
+    rows = many(cur, f"""
+        SELECT inicio, linhas FROM receita_cache
+        WHERE granularidade = %(granularidade)s AND fuso = %(fuso)s AND {em_lista('inicio', 'inicios', 'timestamp')}
+    """, {"granularidade": granularidade, "fuso": fuso, "inicios": list(inicios)})
+    return {r["inicio"]: r["linhas"] for r in rows}
+
+
+def receita_cache_gravar(cur, granularidade, fuso, periodos: dict):
+    """Guarda períodos fechados ({inicio: linhas}); quem chegar depois não sobrescreve."""
+    if not periodos:
+        return
+    run(cur, """
+        INSERT INTO receita_cache (granularidade, fuso, inicio, linhas)
+        SELECT %(granularidade)s, %(fuso)s, p.inicio, p.linhas
+        FROM unnest(%(inicios)s::timestamp[], %(linhas)s::jsonb[]) AS p(inicio, linhas)
+        ON CONFLICT DO NOTHING
+    """, {
+        "granularidade": granularidade, "fuso": fuso,
+        "inicios": list(periodos), "linhas": [Json(v) for v in periodos.values()],
+    }, prepare=False)
+
+
+def receita_cache_limpar(cur):
+    """Chamado quando o histórico muda para trás (linha ou OS excluída)."""
+    run(cur, "DELETE FROM receita_cache", prepare=False)
+
+
+# =========================
+# Exportação
+# =========================
+def os_exportar(conn, de=None, ate=None, itersize=1000):
+    """Todas as OS (ou as com data_entrada em [de, ate)) com o histórico, por id.
+
+    Gerador sobre um cursor nomeado (server-side): o Postgres entrega
+    `itersize` linhas por ida, então a memória do worker não cresce com o
+    tamanho do banco. O histórico de cada OS vem agregado em JSON, pelo
+    índice de os_id. A transação precisa ficar aberta até o fim da leitura.
+    """
+    filtros, params = [], {}
+    if de:
+        filtros.append("o.data_entrada >= %(de)s")
+        params["de"] = de
+    if ate:
+        filtros.append("o.data_entrada < %(ate)s")
+        params["ate"] = ate
+    where = ("WHERE " + " AND ".join(filtros)) if filtros else ""
+
+    cur = conn.cursor(name="os_exportar")
+    cur.itersize = itersize
+    try:
+        cur.execute(f"""
+            SELECT {OS_DETALHE},
+                   coalesce((
+                       SELECT json_agg(json_build_object(
+                           'id', h.id, 'data', h.data, 'acao', h.acao, 'obs', h.obs,
+                           'visivel_cliente', h.visivel_cliente,
+                           'valor_orcado', h.valor_orcado, 'valor_pago', h.valor_pago,
+                           'data_pagamento', h.data_pagamento,
+                           'data_pagamento_texto', h.data_pagamento_texto
+                       ) ORDER BY h.id)
+                       FROM os_historico h WHERE h.os_id = o.id
+                   ), '[]') AS historico
+            FROM os o
+            {where}
+            ORDER BY o.id
+        """, params)
+        yield from cur
+    finally:
+        cur.close()
+
+
+# =========================
+# Notificações (outbox)
+# =========================
+def notificacoes_pegar(cur, lote):
+    """Trava até `lote` avisos vencidos para este worker.
+
+    SKIP LOCKED: vários notificadores rodando juntos nunca pegam o mesmo
+    aviso nem esperam um pelo outro. As linhas ficam travadas até o commit
+    de quem pegou (depois de enviar e marcar o resultado).
+    """
+    return many(cur, """
+        SELECT id, os_id, evento, dados, tentativas, criado_em
+        FROM notificacoes
+        WHERE enviado_em IS NULL AND desistido_em IS NULL AND proxima_tentativa <= now()
+        ORDER BY proxima_tentativa, id
+        LIMIT %(lote)s
+        FOR UPDATE SKIP LOCKED
+    """, {"lote": lote})
+
+
+def notificacao_enviada(cur, notif_id):
+    run(cur, """
+        UPDATE notificacoes SET enviado_em = now(), tentativas = tentativas + 1, ultimo_erro = NULL
+        WHERE id = %(id)s
+    """, {"id": notif_id})
+
+
+def notificacao_falhou(cur, notif_id, erro, espera_s, desistir=False):
+    """Conta a tentativa; tenta de novo daqui a `espera_s` segundos ou desiste."""
+    run(cur, """
+        UPDATE notificacoes SET
+            tentativas = tentativas + 1,
+            ultimo_erro = %(erro)s,
+            proxima_tentativa = now() + make_interval(secs => %(espera)s),
+            desistido_em = CASE WHEN %(desistir)s THEN now() END
+        WHERE id = %(id)s
+    """, {"id": notif_id, "erro": erro, "espera": espera_s, "desistir": desistir})
+
+
+# =========================
+# Consultas lentas (diagnóstico)
+# =========================
+def consultas_lentas_gravar(cur, linhas, maximo):
+    """Grava as lentas de um request e descarta as mais antigas além de `maximo`."""
+    run(cur, """
+        WITH novas AS (
+            INSERT INTO consultas_lentas (sql_hash, sql, parametros, endpoint, duracao_ms, plano)
+            SELECT sql_hash, sql, parametros, endpoint, duracao_ms, plano
+            FROM jsonb_to_recordset(%(linhas)s) AS l(
+                sql_hash text, sql text, parametros text, endpoint text, duracao_ms float8, plano text
+            )
+            RETURNING id
+        )
+        DELETE FROM consultas_lentas WHERE id <= (SELECT max(id) FROM novas) - %(maximo)s
+    """, {"linhas": Json(linhas), "maximo": maximo}, prepare=False)
+
+
+def consultas_lentas_top(cur, desde, n=50):
+    """As piores desde `desde`, agrupadas pelo SQL normalizado, por tempo total."""
+    return many(cur, """
+        SELECT sql_hash,
+               (array_agg(sql ORDER BY id DESC))[1] AS sql,
+               (array_agg(parametros ORDER BY id DESC))[1] AS parametros,
+               array_agg(DISTINCT endpoint) AS endpoints,
+               count(*) AS vezes,
+               sum(duracao_ms) AS total_ms,
+               avg(duracao_ms) AS media_ms,
+               max(duracao_ms) AS max_ms,
+               max(criado_em) AS ultima,
+               max(id) FILTER (WHERE plano IS NOT NULL) AS plano_id
+        FROM consultas_lentas
+        WHERE criado_em >= %(desde)s
+        GROUP BY sql_hash
+        ORDER BY total_ms DESC
+        LIMIT %(n)s
+    """, {"desde": desde, "n": n}, prepare=False)
+
+
+def consulta_lenta(cur, lenta_id):
+    return one(cur, """
+        SELECT id, criado_em, sql_hash, sql, parametros, endpoint, duracao_ms, plano
+        FROM consultas_lentas WHERE id = %(id)s
+    """, {"id": lenta_id}, prepare=False)
+
+
+def consultas_lentas_limpar(cur):
+    run(cur, "DELETE FROM consultas_lentas", prepare=False)
+
+
+# =========================
+# Devedores
+# =========================
+def devedores_pagina(cur, status=None, de=None, ate=None, antes=None, depois=None):
+    # em aberto primeiro, depois os quitados; cada grupo do mais novo pro mais velho
+    grupos = [False, True]
+    if status == "em aberto":
+        grupos = [False]
+    elif status == "pago":
+        grupos = [True]
+
+    filtros = []
+    params = {}
+    if de:
+        filtros.append("criado_em >= %(de)s")
+        params["de"] = de
+    if ate:
+        filtros.append("criado_em < %(ate)s")
+        params["ate"] = ate
+
+    return pagina_keyset(cur, f"""
+        SELECT {DEVEDOR_LISTA} FROM devedores
+        WHERE (status <> 'em aberto') = %(segmento)s AND {{filtros}}
+    """, filtros, params, grupos, antes, depois)
+
+
+def devedores_resumo(cur, d30, d60, status=None, de=None, ate=None):
+    """Totais por status com aging pela data de criação, direto no banco.
+
+    `d30`/`d60` são os limites das faixas (início do dia, há 30 e 60 dias):
+    até 30 dias, 31 a 60 e mais de 60. Sai do índice devedores_status_criado_idx
+    (status, criado_em) INCLUDE (valor), sem ler a tabela.
+    """
+    filtros = []
+    params = {"d30": d30, "d60": d60}
+    if status:
+        filtros.append("status = %(status)s")
+        params["status"] = status
+    if de:
+        filtros.append("criado_em >= %(de)s")
+        params["de"] = de
+    if ate:
+        filtros.append("criado_em < %(ate)s")
+        params["ate"] = ate
+
+    return many(cur, f"""
+        SELECT status,
+               count(*) AS qtd,
+               coalesce(sum(valor), 0) AS total,
+               count(*) FILTER (WHERE criado_em >= %(d30)s) AS qtd_30,
+               coalesce(sum(valor) FILTER (WHERE criado_em >= %(d30)s), 0) AS total_30,
+               count(*) FILTER (WHERE criado_em >= %(d60)s AND criado_em < %(d30)s) AS qtd_60,
+               coalesce(sum(valor) FILTER (WHERE criado_em >= %(d60)s AND criado_em < %(d30)s), 0) AS total_60,
+               count(*) FILTER (WHERE criado_em < %(d60)s) AS qtd_mais,
+               coalesce(sum(valor) FILTER (WHERE criado_em < %(d60)s), 0) AS total_mais
+        FROM devedores
+        WHERE {" AND ".join(filtros) or "TRUE"}
+        GROUP BY status
+        ORDER BY status <> 'em aberto', status
+    """, params)
+
+
+def devedor_inserir(cur, criado_em, cliente_nome, cliente_fone, referencia, valor, obs):
+    run(cur, """
+        INSERT INTO devedores (criado_em, cliente_nome, cliente_fone, referencia, valor, obs, status, pago_em)
+        VALUES (%(criado_em)s, %(cliente_nome)s, %(cliente_fone)s, %(referencia)s, %(valor)s, %(obs)s, 'em aberto', NULL)
+    """, {
+        "criado_em": criado_em, "cliente_nome": cliente_nome, "cliente_fone": cliente_fone,
+        "referencia": referencia, "valor": valor, "obs": obs,
+    }, prepare=False)
+
+
+def devedor_pagar(cur, dev_id, pago_em):
+    run(cur, "UPDATE devedores SET status='pago', pago_em=%(pago_em)s WHERE id=%(id)s",
+        {"id": dev_id, "pago_em": pago_em}, prepare=False)
+
+
+def devedor_reabrir(cur, dev_id):
+    run(cur, "UPDATE devedores SET status='em aberto', pago_em=NULL WHERE id=%(id)s",
+        {"id": dev_id}, prepare=False)
+
+
+def devedor_excluir(cur, dev_id):
+    run(cur, "DELETE FROM devedores WHERE id=%(id)s", {"id": dev_id}, prepare=False)
+
+
+# =========================
+# SQLite
+# =========================
+# o que acima só existe no dialeto do Postgres (CTE com INSERT/UPDATE,
+# tsvector, jsonb @>, SKIP LOCKED...) é trocado pela versão do SQLite
+if db.SQLITE:
+    from queries_sqlite import *  # noqa: E402,F401,F403
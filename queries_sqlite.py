@@ -0,0 +1,342 @@
+"""As consultas do queries.py que mudam no SQLite (DATABASE_URL=sqlite:...).
+
+Mesmos nomes, parâmetros e retorno das originais; o queries.py importa este
+módulo por cima das versões do Postgres quando o backend é SQLite. O resto
+do queries.py roda igual nos dois (o db_sqlite traduz parâmetros e casts).
+
+O que muda:
+- CTE com INSERT/UPDATE/DELETE (os_criar, os_registrar_atualizacao...) vira
+  uma sequência de comandos na mesma transação; com um writer só por vez, o
+  snapshot do histórico continua sendo o estado que a própria transação
+  deixou;
+- busca: FTS5 (tabela os_busca, mantida por trigger) no lugar do tsvector;
+- checklist: json_extract no lugar do @> / ? do jsonb;
+- receita: date_trunc com fuso é uma função Python (db_sqlite.date_trunc) e
+  o GROUPING SETS vira UNION ALL;
+- notificações: sem SKIP LOCKED, o lote é reservado por um UPDATE e comitado
+  antes de enviar.
+"""
+import json
+from datetime import datetime, timedelta, timezone
+
+from queries import (
+    OS_LISTA, OS_DETALHE,
+    many, mais_novas_gin, one, run, termos_de,
+)
+
+__all__ = [
+    "os_buscar", "os_por_checklist", "os_por_imei",
+    "os_criar", "os_registrar_atualizacao", "historico_inserir", "historico_excluir",
+    "receita_por_periodo", "receita_cache_gravar",
+    "os_exportar",
+    "notificacoes_pegar", "notificacao_falhou",
+    "consultas_lentas_gravar", "consultas_lentas_top",
+]
+
+# enquanto o notificador envia, ninguém mais pega o mesmo aviso
+NOTIF_RESERVA_S = 300
+
+
+def _json(v):
+    # colunas JSONB que voltam de RETURNING ou de expressão chegam como texto
+    return json.loads(v) if isinstance(v, (str, bytes)) else v
+
+
+# =========================
+# OS — leitura
+# =========================
+def os_buscar(cur, texto, limite=50):
+    """OS por nome, telefone, CPF, equipamento ou IMEI (FTS5 em os_busca)."""
+    termos = termos_de(texto)
+    if not termos:
+        return []
+    consulta = " AND ".join(f'"{t}"*' for t in termos)
+    return mais_novas_gin(cur, "id IN (SELECT rowid FROM os_busca WHERE os_busca MATCH %(termos)s)",
+                          {"termos": consulta}, limite)
+
+
+def os_por_checklist(cur, contem=None, chave=None, limite=50):
+    filtros = []
+    params = {}
+    for i, (k, v) in enumerate((contem or {}).items()):
+        filtros.append(f"json_extract(checklist_json, %(ck{i})s) = %(v{i})s")
+        params[f"ck{i}"], params[f"v{i}"] = f'$."{k}"', v
+    if chave:
+        filtros.append("json_type(checklist_json, %(chave)s) IS NOT NULL")
+        params["chave"] = f'$."{chave}"'
+    if not filtros:
+        return []
+    return mais_novas_gin(cur, " AND ".join(filtros), params, limite)
+
+
+def os_por_imei(cur, imei):
+    # mesmas expressões dos índices os_imei1_idx / os_imei2_idx
+    return many(cur, f"""
+        SELECT {OS_LISTA}
+        FROM os
+        WHERE json_extract(checklist_json, '$.ck_cel_imei1') = %(imei)s
+           OR json_extract(checklist_json, '$.ck_cel_imei2') = %(imei)s
+        ORDER BY id DESC
+    """, {"imei": imei})
+
+
+# =========================
+# OS — escrita
+# =========================
+def os_criar(cur, dados: dict):
+    row = one(cur, """
+        INSERT INTO os (
+            data_entrada, status,
+            cliente_nome, cliente_fone, cliente_cpf, cliente_endereco, cliente_email,
+            tipo, equipamento,
+            checklist_json, relato_cliente, diagnostico_tecnico,
+            valor_orcado, valor_pago, data_pagamento,
+            codigo_consulta
+        )
+        VALUES (
+            %(data_entrada)s, 'aberta',
+            %(cliente_nome)s, %(cliente_fone)s, %(cliente_cpf)s, %(cliente_endereco)s, %(cliente_email)s,
+            %(tipo)s, %(equipamento)s,
+            %(checklist_json)s, %(relato_cliente)s, %(diagnostico_tecnico)s,
+            %(valor_orcado)s, %(valor_pago)s, %(data_pagamento)s,
+            %(codigo_consulta)s
+        )
+        ON CONFLICT (codigo_consulta) DO NOTHING
+        RETURNING id
+    """, dados)
+    if not row:
+        return None
+    run(cur, """
+        INSERT INTO os_historico (os_id, data, acao, obs, visivel_cliente, valor_orcado, valor_pago, data_pagamento)
+        VALUES (%(os_id)s, %(data_entrada)s, 'OS criada', 'Entrada registrada no sistema.', 1,
+                %(hist_valor_orcado)s, %(hist_valor_pago)s, %(hist_data_pagamento)s)
+    """, dict(dados, os_id=row["id"]))
+    return row["id"]
+
+
+def os_registrar_atualizacao(cur, os_id, data, acao, obs, visivel_cliente,
+                             status=None, valor_orcado=None, valor_pago=None, data_pagamento=None,
+                             notificar=()):
+    antes = one(cur, "SELECT status FROM os WHERE id = %(id)s", {"id": os_id})
+    if not antes:
+        return None
+    alvo = one(cur, """
+        UPDATE os SET
+            status = COALESCE(%(status)s, status),
+            valor_orcado = COALESCE(%(valor_orcado)s, valor_orcado),
+            valor_pago = COALESCE(%(valor_pago)s, valor_pago),
+            data_pagamento = COALESCE(%(data_pagamento)s, data_pagamento),
+            versao = versao + 1,
+            atualizado_em = now()
+        WHERE id = %(id)s
+        RETURNING id, valor_orcado, valor_pago, data_pagamento, status,
+                  cliente_nome, cliente_fone, cliente_email, codigo_consulta
+    """, {
+        "id": os_id, "status": status, "valor_orcado": valor_orcado,
+        "valor_pago": valor_pago, "data_pagamento": data_pagamento,
+    })
+    if alvo["status"] != antes["status"] and alvo["status"] in notificar:
+        run(cur, "INSERT INTO notificacoes (os_id, evento, dados) VALUES (%(os_id)s, %(evento)s, %(dados)s)", {
+            "os_id": os_id, "evento": alvo["status"],
+            "dados": {
+                "status_anterior": antes["status"],
+                "cliente_nome": alvo["cliente_nome"], "cliente_fone": alvo["cliente_fone"],
+                "cliente_email": alvo["cliente_email"], "codigo_consulta": alvo["codigo_consulta"],
+                "valor_orcado": alvo["valor_orcado"], "valor_pago": alvo["valor_pago"],
+            },
+        })
+    row = one(cur, """
+        INSERT INTO os_historico (os_id, data, acao, obs, visivel_cliente, valor_orcado, valor_pago, data_pagamento)
+        VALUES (%(os_id)s, %(data)s, %(acao)s, %(obs)s, %(visivel_cliente)s,
+                %(valor_orcado)s, %(valor_pago)s, %(data_pagamento)s)
+        RETURNING id
+    """, {
+        "os_id": os_id, "data": data, "acao": acao, "obs": obs, "visivel_cliente": visivel_cliente,
+        "valor_orcado": alvo["valor_orcado"], "valor_pago": alvo["valor_pago"],
+        "data_pagamento": alvo["data_pagamento"],
+    })
+    return row["id"]
+
+
+def historico_inserir(cur, os_id, data, acao, obs, visivel_cliente,
+                      valor_orcado=None, valor_pago=None, data_pagamento=None):
+    alvo = one(cur, """
+        UPDATE os SET versao = versao + 1, atualizado_em = now()
+        WHERE id = %(os_id)s
+        RETURNING id
+    """, {"os_id": os_id}, prepare=False)
+    if not alvo:
+        return
+    run(cur, """
+        INSERT INTO os_historico (os_id, data, acao, obs, visivel_cliente, valor_orcado, valor_pago, data_pagamento)
+        VALUES (%(os_id)s, %(data)s, %(acao)s, %(obs)s, %(visivel_cliente)s,
+                %(valor_orcado)s, %(valor_pago)s, %(data_pagamento)s)
+    """, {
+        "os_id": os_id, "data": data, "acao": acao, "obs": obs, "visivel_cliente": visivel_cliente,
+        "valor_orcado": valor_orcado, "valor_pago": valor_pago, "data_pagamento": data_pagamento,
+    }, prepare=False)
+
+
+def historico_excluir(cur, hist_id):
+    apagado = one(cur, "DELETE FROM os_historico WHERE id = %(id)s RETURNING os_id", {"id": hist_id},
+                  prepare=False)
+    if apagado:
+        run(cur, "UPDATE os SET versao = versao + 1, atualizado_em = now() WHERE id = %(id)s",
+            {"id": apagado["os_id"]}, prepare=False)
+
+
+# =========================
+# Relatórios
+# =========================
+def receita_por_periodo(cur, granularidade, de, ate, fuso):
+    return many(cur, """
+        WITH alvo AS (
+            SELECT DISTINCT os_id FROM os_historico
+            WHERE valor_pago IS NOT NULL AND data >= %(de)s AND data < %(ate)s
+        ), pagos AS (
+            SELECT h.os_id, h.data,
+                   h.valor_pago - coalesce(lag(h.valor_pago) OVER (PARTITION BY h.os_id ORDER BY h.id), 0) AS recebido
+            FROM alvo a
+            JOIN os_historico h ON h.os_id = a.os_id
+            WHERE h.valor_pago IS NOT NULL AND h.data < %(ate)s
+        ), periodo AS (
+            SELECT date_trunc(%(granularidade)s, p.data, %(fuso)s) AS inicio, o.tipo, p.os_id, p.recebido
+            FROM pagos p
+            JOIN os o ON o.id = p.os_id
+            WHERE p.data >= %(de)s AND p.data < %(ate)s AND p.recebido <> 0
+        )
+        SELECT inicio AS "inicio [TIMESTAMP]", tipo, 0 AS total,
+               sum(recebido) AS recebido, count(DISTINCT os_id) AS os_qtd
+        FROM periodo GROUP BY inicio, tipo
+        UNION ALL
+        SELECT inicio, NULL, 1, sum(recebido), count(DISTINCT os_id)
+        FROM periodo GROUP BY inicio
+        ORDER BY 1, 3 DESC, 2
+    """, {"granularidade": granularidade, "de": de, "ate": ate, "fuso": fuso})
+
+
+def receita_cache_gravar(cur, granularidade, fuso, periodos: dict):
+    if not periodos:
+        return
+    cur.executemany("""
+        INSERT INTO receita_cache (granularidade, fuso, inicio, linhas)
+        VALUES (%(granularidade)s, %(fuso)s, %(inicio)s, %(linhas)s)
+        ON CONFLICT DO NOTHING
+    """, [
+        {"granularidade": granularidade, "fuso": fuso, "inicio": inicio, "linhas": linhas}
+        for inicio, linhas in periodos.items()
+    ])
+
+
+# =========================
+# Exportação
+# =========================
+def os_exportar(conn, de=None, ate=None, itersize=1000):
+    """Como a do Postgres: o cursor do SQLite já lê sob demanda, `itersize` por vez."""
+    filtros, params = [], {}
+    if de:
+        filtros.append("o.data_entrada >= %(de)s")
+        params["de"] = de
+    if ate:
+        filtros.append("o.data_entrada < %(ate)s")
+        params["ate"] = ate
+    where = ("WHERE " + " AND ".join(filtros)) if filtros else ""
+
+    cur = conn.cursor()
+    cur.itersize = itersize
+    try:
+        cur.execute(f"""
+            SELECT {OS_DETALHE},
+                   (SELECT json_group_array(json_object(
+                       'id', h.id, 'data', h.data, 'acao', h.acao, 'obs', h.obs,
+                       'visivel_cliente', h.visivel_cliente,
+                       'valor_orcado', h.valor_orcado, 'valor_pago', h.valor_pago,
+                       'data_pagamento', h.data_pagamento,
+                       'data_pagamento_texto', h.data_pagamento_texto
+                   )) FROM (SELECT * FROM os_historico WHERE os_id = o.id ORDER BY id) h) AS "historico [JSONB]"
+            FROM os o
+            {where}
+            ORDER BY o.id
+        """, params or None)
+        yield from cur
+    finally:
+        cur.close()
+
+
+# =========================
+# Notificações (outbox)
+# =========================
+def notificacoes_pegar(cur, lote):
+    """Reserva até `lote` avisos vencidos e comita a reserva.
+
+    Sem FOR UPDATE SKIP LOCKED: o aviso pego tem a proxima_tentativa
+    empurrada NOTIF_RESERVA_S para frente, e a reserva é comitada aqui para
+    o lock de escrita do SQLite não ficar preso enquanto o envio acontece.
+    Outro notificador não pega o mesmo aviso; se este cair no meio, o aviso
+    volta sozinho depois da reserva.
+    """
+    rows = many(cur, """
+        UPDATE notificacoes SET proxima_tentativa = %(reserva)s
+        WHERE id IN (
+            SELECT id FROM notificacoes
+            WHERE enviado_em IS NULL AND desistido_em IS NULL AND proxima_tentativa <= now()
+            ORDER BY proxima_tentativa, id
+            LIMIT %(lote)s
+        )
+        RETURNING id, os_id, evento, dados, tentativas, criado_em
+    """, {"lote": lote, "reserva": datetime.now(timezone.utc) + timedelta(seconds=NOTIF_RESERVA_S)})
+    cur.connection.commit()
+    for r in rows:
+        r["dados"] = _json(r["dados"])
+    return sorted(rows, key=lambda r: r["id"])
+
+
+def notificacao_falhou(cur, notif_id, erro, espera_s, desistir=False):
+    run(cur, """
+        UPDATE notificacoes SET
+            tentativas = tentativas + 1,
+            ultimo_erro = %(erro)s,
+            proxima_tentativa = %(proxima)s,
+            desistido_em = CASE WHEN %(desistir)s THEN now() END
+        WHERE id = %(id)s
+    """, {"id": notif_id, "erro": erro, "desistir": desistir,
+          "proxima": datetime.now(timezone.utc) + timedelta(seconds=espera_s)})
+
+
+# =========================
+# Consultas lentas (diagnóstico)
+# =========================
+def consultas_lentas_gravar(cur, linhas, maximo):
+    cur.executemany("""
+        INSERT INTO consultas_lentas (sql_hash, sql, parametros, endpoint, duracao_ms, plano)
+        VALUES (%(sql_hash)s, %(sql)s, %(parametros)s, %(endpoint)s, %(duracao_ms)s, %(plano)s)
+    """, linhas)
+    run(cur, "DELETE FROM consultas_lentas WHERE id <= (SELECT max(id) FROM consultas_lentas) - %(maximo)s",
+        {"maximo": maximo}, prepare=False)
+
+
+def consultas_lentas_top(cur, desde, n=50):
+    rows = many(cur, """
+        SELECT g.sql_hash, u.sql, u.parametros, g.endpoints, g.vezes, g.total_ms, g.media_ms, g.max_ms,
+               g.ultima AS "ultima [TIMESTAMPTZ]", g.plano_id
+        FROM (
+            SELECT sql_hash,
+                   group_concat(DISTINCT endpoint) AS endpoints,
+                   count(*) AS vezes,
+                   sum(duracao_ms) AS total_ms,
+                   avg(duracao_ms) AS media_ms,
+                   max(duracao_ms) AS max_ms,
+                   max(criado_em) AS ultima,
+                   max(CASE WHEN plano IS NOT NULL THEN id END) AS plano_id,
+                   max(id) AS ultimo_id
+            FROM consultas_lentas
+            WHERE criado_em >= %(desde)s
+            GROUP BY sql_hash
+        ) g
+        JOIN consultas_lentas u ON u.id = g.ultimo_id
+        ORDER BY g.total_ms DESC
+        LIMIT %(n)s
+    """, {"desde": desde, "n": n}, prepare=False)
+    for r in rows:
+        r["endpoints"] = sorted((r["endpoints"] or "").split(","))
+    return rows
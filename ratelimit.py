@@ -0,0 +1,35 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class TokenBucket:
+    """Balde de fichas por chave (ex.: IP).
+
+    Cada chave começa com `capacidade` fichas e recupera todas em `janela`
+    segundos. Quem está sem ficha é barrado antes de chegar no banco. Guarda
+    no máximo `max_chaves` baldes (os mais antigos saem primeiro).
+    """
+
+    def __init__(self, capacidade=10, janela=600.0, max_chaves=10000):
+        self.capacidade = float(capacidade)
+        self.taxa = self.capacidade / float(janela)  # fichas por segundo
+        self.max_chaves = max_chaves
+        self._baldes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _fichas(self, chave, agora):
+        fichas, visto = self._baldes.get(chave, (self.capacidade, agora))
+        return min(self.capacidade, fichas + (agora - visto) * self.taxa)
+
+    def disponivel(self, chave) -> bool:
+        with self._lock:
+            return self._fichas(chave, time.monotonic()) >= 1
+
+    def consumir(self, chave):
+        with self._lock:
+            agora = time.monotonic()
+            self._baldes[chave] = (max(0.0, self._fichas(chave, agora) - 1), agora)
+            self._baldes.move_to_end(chave)
+            while len(self._baldes) > self.max_chaves:
+                self._baldes.popitem(last=False)
@@ -0,0 +1,101 @@
+"""Relatório de receita por período (dia, semana ou mês) e por tipo.
+
+A conta pesada (window function sobre o histórico) está em
+queries.receita_por_periodo. Aqui ficam os períodos: quais cabem no
+intervalo pedido, quais já fecharam (não mudam mais e vão para a tabela
+receita_cache) e qual é o atual (sempre recalculado).
+"""
+from datetime import datetime, timedelta
+
+import queries
+
+# nome na tela -> unidade do date_trunc
+GRANULARIDADES = {"dia": "day", "semana": "week", "mes": "month"}
+
+# o bastante para um ano por dia; evita um intervalo enorme por engano
+MAX_PERIODOS = 400
+
+
+def inicio_periodo(dt: datetime, granularidade: str) -> datetime:
+    """Início do período que contém `dt` (datetime local, sem fuso)."""
+    dt = dt.replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=None)
+    if granularidade == "week":
+        return dt - timedelta(days=dt.weekday())
+    if granularidade == "month":
+        return dt.replace(day=1)
+    return dt
+
+
+def proximo_periodo(inicio: datetime, granularidade: str) -> datetime:
+    if granularidade == "week":
+        return inicio + timedelta(days=7)
+    if granularidade == "month":
+        return (inicio.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return inicio + timedelta(days=1)
+
+
+def periodos(de: datetime, ate: datetime, granularidade: str) -> list:
+    """Inícios dos períodos que tocam [de, ate), no máximo MAX_PERIODOS (os mais recentes)."""
+    p = inicio_periodo(de, granularidade)
+    fim = ate.replace(tzinfo=None)
+    lista = []
+    while p < fim:
+        lista.append(p)
+        p = proximo_periodo(p, granularidade)
+    return lista[-MAX_PERIODOS:]
+
+
+def _linhas(rows) -> dict:
+    """Linhas da consulta -> {inicio: [{tipo, recebido, os_qtd, total}]} (serializável em JSON)."""
+    por_periodo = {}
+    for r in rows:
+        por_periodo.setdefault(r["inicio"], []).append({
+            "tipo": r["tipo"],
+            "total": r["total"],
+            "recebido": float(r["recebido"]),
+            "os_qtd": r["os_qtd"],
+        })
+    return por_periodo
+
+
+def receita(cur, granularidade, de, ate, tz, agora) -> list:
+    """Receita de cada período em [de, ate), do mais antigo para o mais novo.
+
+    Períodos fechados (terminam antes do período atual) saem da
+    receita_cache quando já foram calculados; os que faltam, e o atual, são
+    calculados numa consulta só e os fechados vão para o cache. Quem chama
+    comita.
+    """
+    fuso = str(tz)
+    inicios = periodos(de.astimezone(tz), ate.astimezone(tz), granularidade)
+    if not inicios:
+        return []
+    atual = inicio_periodo(agora.astimezone(tz), granularidade)
+
+    fechados = [p for p in inicios if p < atual]
+    dados = queries.receita_cache_ler(cur, granularidade, fuso, fechados) if fechados else {}
+
+    faltando = [p for p in inicios if p not in dados]
+    if faltando:
+        calculado = _linhas(queries.receita_por_periodo(
+            cur, granularidade,
+            faltando[0].replace(tzinfo=tz),
+            proximo_periodo(faltando[-1], granularidade).replace(tzinfo=tz),
+            fuso,
+        ))
+        novos = {p: calculado.get(p, []) for p in faltando}
+        queries.receita_cache_gravar(cur, granularidade, fuso, {p: v for p, v in novos.items() if p < atual})
+        dados.update(novos)
+
+    resultado = []
+    for p in inicios:
+        linhas = dados.get(p, [])
+        total = next((l for l in linhas if l["total"]), None)
+        resultado.append({
+            "inicio": p,
+            "fechado": p < atual,
+            "recebido": total["recebido"] if total else 0.0,
+            "os_qtd": total["os_qtd"] if total else 0,
+            "por_tipo": {l["tipo"]: l["recebido"] for l in linhas if not l["total"]},
+        })
+    return resultado